@@ -7,6 +7,7 @@ from drf_spectacular.extensions import OpenApiAuthenticationExtension
 
 class KnoxTokenScheme(OpenApiAuthenticationExtension):
     target_class = 'knox.auth.TokenAuthentication'
+    match_subclasses = True
     name = 'knoxTokenAuth'
      
     def get_security_definition(self, auto_schema):
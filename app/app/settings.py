@@ -69,6 +69,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that it times the whole request (see core/metrics.py)
+    'core.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -110,7 +112,7 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'core.db.backends.mysql',
         'HOST': os.environ.get('MYSQL_HOST'),
         'NAME': os.environ.get('MYSQL_DATABASE'),
         'USER': os.environ.get('MYSQL_USER'),
@@ -118,6 +120,28 @@ DATABASES = {
         'TEST': {
             'NAME': 'test_db',
         },
+        # Connection reuse per process (see core/db/pool.py). MAX_IDLE must
+        # stay below the server's wait_timeout.
+        'POOL': {
+            'ENABLED': bool(int(os.environ.get('DB_POOL_ENABLED', 1))),
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 8)),
+            'MAX_IDLE': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'HEALTH_CHECK_AFTER': float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', 1)),
+        },
+    }
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Per process by default; set CACHE_BACKEND/CACHE_LOCATION to a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache) so that
+# invalidations reach every uWSGI worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
@@ -178,7 +202,7 @@ AUTHENTICATION_BACKENDS = (
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    'DEFAULT_AUTHENTICATION_CLASSES': ('knox.auth.TokenAuthentication', 'rest_framework.authentication.SessionAuthentication'),
+    'DEFAULT_AUTHENTICATION_CLASSES': ('users.authentication.CachedTokenAuthentication', 'rest_framework.authentication.SessionAuthentication'),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
@@ -198,9 +222,31 @@ REST_KNOX = {
   'MIN_REFRESH_INTERVAL': 60,
   'AUTH_HEADER_PREFIX': 'Token',
   'EXPIRY_DATETIME_FORMAT': api_settings.DATETIME_FORMAT,
-  'TOKEN_MODEL': 'knox.AuthToken',
 }
 
+# Job and run listings (see job/pagination.py): default and largest page
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", 50))
+LIST_MAX_PAGE_SIZE = int(os.environ.get("LIST_MAX_PAGE_SIZE", 500))
+
+# Engine feed (see job/feed.py): default and largest batch of events, and
+# how old an event after a missing id must be before the gap is skipped
+FEED_BATCH_SIZE = int(os.environ.get("FEED_BATCH_SIZE", 500))
+FEED_MAX_BATCH_SIZE = int(os.environ.get("FEED_MAX_BATCH_SIZE", 5000))
+FEED_GAP_TIMEOUT = float(os.environ.get("FEED_GAP_TIMEOUT", 10))
+
+# Largest batch of run statuses the engine may send at once (see job/bulk.py)
+BULK_STATUS_MAX_UPDATES = int(os.environ.get("BULK_STATUS_MAX_UPDATES", 1000))
+
+# Verified knox tokens kept per process (see users/authentication.py): how
+# many, and for how many seconds at most (never past the token's expiry).
+# Only used with a shared CACHE_BACKEND, which carries revocations
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", 1024))
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get("AUTH_TOKEN_CACHE_TTL", 60))
+
+# Seconds a signed stream token (see users/authentication.py), which lets a
+# browser EventSource open a job's event stream, can be used to connect
+STREAM_TOKEN_MAX_AGE = int(os.environ.get("STREAM_TOKEN_MAX_AGE", 60))
+
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 AWS_STORAGE_BUCKET_NAME = os.environ.get("AWS_STORAGE_BUCKET_NAME")
 BUCKET_PATH = "submissions"  # change to "scripts"
@@ -213,6 +259,91 @@ AWS_STEPFUNCTION = os.environ.get("AWS_STEPFUNCTION")
 
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
+AWS_SES_REGION_NAME = os.environ.get("AWS_SES_REGION_NAME", "us-east-1")
+
+# Shared boto3 clients (see core/aws.py)
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", 10))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", 5))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", 60))
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", 3))
+# Connections per aiobotocore client in each ASGI worker (see core/aws_async.py)
+AWS_ASYNC_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_ASYNC_MAX_POOL_CONNECTIONS", 100))
+
+# Size of the chunks relayed from S3 by the result download endpoints
+RESULTS_CHUNK_SIZE = int(os.environ.get("RESULTS_CHUNK_SIZE", 64 * 1024))
+# Part size of the multipart uploads of released outputs (S3 minimum is 5MB)
+RESULTS_UPLOAD_PART_SIZE = int(os.environ.get("RESULTS_UPLOAD_PART_SIZE", 8 * 1024 ** 2))
+
+# Hand result downloads over to nginx with X-Accel-Redirect. The locations
+# must match the internal blocks in nginx/default*.conf.tpl.
+RESULTS_X_ACCEL_REDIRECT = bool(int(os.environ.get("RESULTS_X_ACCEL_REDIRECT", 0)))
+RESULTS_X_ACCEL_S3_LOCATION = '/protected-s3/'
+RESULTS_X_ACCEL_FILE_LOCATION = '/protected-results/'
+RESULTS_X_ACCEL_URL_EXPIRY = 60
+RESULTS_LOCAL_ROOT = os.environ.get("RESULTS_LOCAL_ROOT", '/vol/results')
+
+# Serve the S3-bound run actions with job/async_views.py. Only set in the
+# ASGI service; nginx routes those actions to it.
+RESULTS_ASYNC_VIEWS = bool(int(os.environ.get("RESULTS_ASYNC_VIEWS", 0)))
+
+# Status event streams (see job/events.py): how often each ASGI worker polls
+# for new events, how long an id skipped by a poll is waited for, the
+# events kept per slow client before it is dropped, the events replayed
+# on reconnect and the seconds between keepalive comments
+EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", 1))
+EVENTS_GAP_TIMEOUT = float(os.environ.get("EVENTS_GAP_TIMEOUT", 10))
+EVENTS_BATCH_SIZE = int(os.environ.get("EVENTS_BATCH_SIZE", 1000))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+EVENTS_REPLAY_LIMIT = int(os.environ.get("EVENTS_REPLAY_LIMIT", 500))
+EVENTS_KEEPALIVE = float(os.environ.get("EVENTS_KEEPALIVE", 15))
+EVENTS_RETRY_MS = int(os.environ.get("EVENTS_RETRY_MS", 3000))
+
+# Local disk cache for sanitized outputs (see job/cache.py)
+RESULTS_CACHE_ENABLED = bool(int(os.environ.get("RESULTS_CACHE_ENABLED", 1)))
+RESULTS_CACHE_DIR = os.path.join(RESULTS_LOCAL_ROOT, 'cache')
+RESULTS_CACHE_MAX_BYTES = int(os.environ.get("RESULTS_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# Budget holds (see core.models.BudgetReservation): how long a hold lives
+# before sweep_reservations settles it into a charge
+BUDGET_RESERVATION_TTL = int(os.environ.get("BUDGET_RESERVATION_TTL", 6 * 3600))
+
+# Seconds a user's group names are cached (see core.models.User.group_names);
+# group changes invalidate them
+USER_GROUPS_CACHE_TIMEOUT = int(os.environ.get("USER_GROUPS_CACHE_TIMEOUT", 300))
+
+# Seconds a user's budget row is served from the cache (see core.models.Budget);
+# it is invalidated on every change, the timeout bounds staleness across
+# processes when the cache is not shared
+BUDGET_CACHE_TIMEOUT = int(os.environ.get("BUDGET_CACHE_TIMEOUT", 5))
+
+# Bearer token Prometheus scrapes /api/metrics with (see core/metrics.py);
+# the endpoint is off without one. PROMETHEUS_MULTIPROC_DIR is read from the
+# environment by prometheus_client itself.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Multiprocess directories of the other services that record metrics
+# (app-async, dispatcher, sweeper), comma-separated; a scrape adds up their
+# samples with this service's
+METRICS_SERVICE_DIRS = list(filter(None, os.environ.get("METRICS_SERVICE_DIRS", "").split(',')))
+
+# Background releases (see job/tasks.py): worker threads per uWSGI process
+# (0 runs releases inline) and how often a running release saves its progress
+RELEASE_WORKERS = int(os.environ.get("RELEASE_WORKERS", 2))
+RELEASE_PROGRESS_INTERVAL = float(os.environ.get("RELEASE_PROGRESS_INTERVAL", 1))
+
+# Seconds without progress after which sweep_reservations fails a queued or
+# running release task, e.g. one stranded by a restarted uWSGI worker
+RELEASE_TASK_STALE_AFTER = int(os.environ.get("RELEASE_TASK_STALE_AFTER", 15 * 60))
+
+# Outbox dispatcher (see core/outbox.py). The lease must outlast a send with
+# all of its botocore retries.
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY", 8))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BACKOFF_BASE = float(os.environ.get("OUTBOX_BACKOFF_BASE", 2))
+OUTBOX_BACKOFF_MAX = float(os.environ.get("OUTBOX_BACKOFF_MAX", 300))
+OUTBOX_LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", 300))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1))
 # AWS_S3_OBJECT_PARAMETERS = {
 #     "SSEKMSKeyId": os.environ.get("AWS_KMS_KEY_ID"),
 #     "ServerSideEncryption": "aws:kms"
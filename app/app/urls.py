@@ -8,6 +8,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from core.metrics import metrics_view
+
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularSwaggerView,
@@ -39,7 +41,8 @@ urlpatterns = [
     ),
     path('api/users/', include('users.urls')),
     path('api/job/', include('job.urls')),
-    path('api/budget/', include('budget.urls'))
+    path('api/budget/', include('budget.urls')),
+    path('api/metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,85 @@
+"""
+Benchmark concurrent result downloads against a running deployment.
+
+Runs the same download of a run's sanitized output from many clients at
+once and reports throughput and latency. Point it at the uWSGI app and at
+the ASGI app (job/async_views.py) in turn to compare them, e.g. with the
+deploy stack up, through nginx with and without the ASGI location, or
+directly:
+
+    # ASGI (uvicorn --workers 4, RESULTS_ASYNC_VIEWS=1)
+    python benchmarks/bench_downloads.py --url http://localhost:9001 \\
+        --token <knox token> --job <job id> --run 1 --concurrency 10 50 200
+
+    # uWSGI (--workers 4) behind nginx
+    python benchmarks/bench_downloads.py --url https://localhost --insecure ...
+
+Use an output of a realistic size and disable X-Accel-Redirect and the
+result cache so that the app server itself relays the bytes from S3.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+
+async def download(session, url, headers):
+    start = time.perf_counter()
+    size = 0
+    async with session.get(url, headers=headers) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+    return time.perf_counter() - start, size
+
+
+async def run_level(url, headers, concurrency, requests, ssl):
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=ssl)
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded():
+            async with semaphore:
+                return await download(session, url, headers)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bounded() for _ in range(requests)), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    errors = len(results) - len(ok)
+    latencies = sorted(latency for latency, _ in ok) or [0]
+    total_bytes = sum(size for _, size in ok)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f'concurrency={concurrency:<5} requests={len(results):<5} errors={errors:<4} '
+        f'req/s={len(ok) / elapsed:8.1f}  MB/s={total_bytes / elapsed / 1024 ** 2:8.1f}  '
+        f'p50={statistics.median(latencies):6.3f}s  p95={p95:6.3f}s'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', required=True, help='Base URL of the app, e.g. http://localhost:9001')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--job', required=True)
+    parser.add_argument('--run', default='1')
+    parser.add_argument('--released', action='store_true', help='Download the released output instead')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--requests', type=int, default=None, help='Downloads per level (default 4x concurrency)')
+    parser.add_argument('--insecure', action='store_true', help='Skip TLS verification')
+    args = parser.parse_args()
+
+    action = 'get-released-csv-results' if args.released else 'get-csv-results'
+    url = f'{args.url.rstrip("/")}/api/job/jobs/{args.job}/runs/{args.run}/{action}/'
+    headers = {'Authorization': f'Token {args.token}'}
+    for concurrency in args.concurrency:
+        requests = args.requests or concurrency * 4
+        asyncio.run(run_level(url, headers, concurrency, requests, ssl=False if args.insecure else None))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark the sanitized output processing in job/results.py against the
+per-line loops it replaced in RunViewSet.get_analyses and release.
+
+Usage (from the app directory):
+
+    python benchmarks/bench_results.py [--rows 1000000] [--analyses 200]
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job.results import summarize_analyses, ReleaseFilter  # noqa: E402
+
+
+def make_output(rows, analyses):
+    """Build a sanitized output CSV with the engine's columns."""
+    rng = random.Random(0)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['analysis_id', 'analysis_name', 'statistic', 'var', 'value_sanitized', 'epsilon'])
+    for i in range(rows):
+        analysis_id = rng.randrange(analyses)
+        writer.writerow([
+            analysis_id,
+            f'Analysis {analysis_id}',
+            'mean',
+            'earned_income',
+            f'{rng.random() * 10000:.5f}',
+            f'{rng.random():.6f}',
+        ])
+    return buffer.getvalue().encode('utf-8')
+
+
+def loop_analyses(data):
+    """The get-analyses loop before job/results.py."""
+    analyses_dict = {}
+    line_num = 1
+    for csv_line in data.decode('utf-8').splitlines():
+        if line_num == 1:
+            col_list = csv_line.split(',')
+            analysis_id_index = col_list.index("analysis_id")
+            analysis_name_index = col_list.index("analysis_name")
+            epsilon_index = col_list.index("epsilon")
+        else:
+            value_list = csv_line.split(',')
+            analysis_id = value_list[analysis_id_index]
+            analysis_name = value_list[analysis_name_index]
+            epsilon = float(value_list[epsilon_index])
+            if analysis_id not in analyses_dict:
+                analyses_dict[analysis_id] = {"epsilon": epsilon, "analysis_name": analysis_name}
+            else:
+                analyses_dict[analysis_id]['epsilon'] += epsilon
+        line_num = line_num + 1
+    return analyses_dict
+
+
+def loop_release(data, released_ids):
+    """The release loop before job/results.py."""
+    output_buffer = io.StringIO()
+    writer = csv.writer(output_buffer)
+    line_num = 1
+    cost = 0
+    for csv_line in data.decode('utf-8').splitlines():
+        if line_num == 1:
+            col_list = csv_line.split(',')
+            analysis_id_index = col_list.index("analysis_id")
+            epsilon_index = col_list.index("epsilon")
+            writer.writerow(csv_line.split(','))
+        else:
+            value_list = csv_line.split(',')
+            analysis_id = int(value_list[analysis_id_index])
+            if analysis_id in released_ids:
+                writer.writerow(csv_line.split(','))
+                cost = cost + float(value_list[epsilon_index])
+        line_num = line_num + 1
+    return cost
+
+
+def vectorized_release(data, released_ids):
+    released = ReleaseFilter(io.BytesIO(data), released_ids)
+    for _ in released:
+        pass
+    return released.cost
+
+
+def timed(label, rows, size, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    print(f'{label:<28} {elapsed:8.3f}s {rows / elapsed / 1e6:8.2f} Mrows/s {size / elapsed / 1e6:8.1f} MB/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--analyses', type=int, default=200)
+    args = parser.parse_args()
+
+    data = make_output(args.rows, args.analyses)
+    released_ids = list(range(0, args.analyses, 2))
+    print(f'{args.rows} rows, {len(data) / 1e6:.1f} MB, {len(released_ids)} released analyses')
+
+    timed('get-analyses loop', args.rows, len(data), loop_analyses, data)
+    timed('get-analyses vectorized', args.rows, len(data), lambda: summarize_analyses(io.BytesIO(data)))
+    timed('release loop', args.rows, len(data), loop_release, data, released_ids)
+    timed('release vectorized', args.rows, len(data), vectorized_release, data, released_ids)
+
+
+if __name__ == '__main__':
+    main()
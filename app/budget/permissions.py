@@ -4,6 +4,8 @@ Permissions for budget app.
 
 from rest_framework import permissions
 
+from core.models import in_group
+
 class IsDataStewardOrReadOnly(permissions.BasePermission):
     """
     Custom permission to allow only data steward users to modify budgets.
@@ -12,6 +14,6 @@ class IsDataStewardOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
             return True
-        if request.method in ['PATCH'] and request.user.groups.filter(name='datasteward').exists():
+        if request.method in ['PATCH'] and in_group(request.user, 'datasteward'):
             return True
         return False
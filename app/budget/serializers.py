@@ -4,7 +4,9 @@ Serializers for budget APIs.
 
 from rest_framework import serializers
 
-from core.models import Budget
+from django.db import transaction
+
+from core.models import Budget, BudgetCharge
 from .permissions import IsDataStewardOrReadOnly
 
 class BudgetSerializer(serializers.ModelSerializer):
@@ -23,5 +25,17 @@ class BudgetSerializer(serializers.ModelSerializer):
             fields['release'].read_only = True
         return fields
 
+    def update(self, instance, validated_data):
+        """Apply a steward's new balances as ledger adjustments."""
+        with transaction.atomic():
+            for kind in (Budget.REVIEW, Budget.RELEASE):
+                if kind not in validated_data:
+                    continue
+                delta = validated_data[kind] - getattr(instance, kind)
+                if delta:
+                    Budget.credit(instance.user, kind, delta, reason=BudgetCharge.ADJUSTMENT)
+        instance.refresh_from_db()
+        return instance
+
 
 
@@ -3,6 +3,7 @@ Tests for Budget API.
 """
 from django.urls import reverse
 from django.test import TestCase
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 
@@ -12,7 +13,7 @@ from rest_framework.test import APIClient
 import json
 from moto import mock_s3, mock_stepfunctions
 
-from core.models import Job, default_job_status, Budget
+from core.models import Job, default_job_status, Budget, BudgetCharge
 from budget.serializers import BudgetSerializer
 
 
@@ -134,3 +135,70 @@ class DataStewardBudgetAPITests(TestCase):
         
         self.assertEqual(Budget.objects.filter(id=other_user.id)[0].review, 150)
         self.assertEqual(Budget.objects.filter(id=other_user.id)[0].release, 200)
+
+
+class BudgetCacheTests(TestCase):
+    """Test budget reads are served from the budget cache."""
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+        self.budget = Budget.objects.get(user=self.user)
+
+    def test_budget_read_once(self):
+        """Test the budget is queried once and then served from the cache."""
+        url = detail_url(self.budget.id)
+
+        # Group check and budget
+        with self.assertNumQueries(2):
+            res = self.client.get(url)
+        with self.assertNumQueries(0):
+            res2 = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res2.data, res.data)
+
+    def test_charge_invalidates_cache(self):
+        """Test a charge is visible on the next read."""
+        self.client.get(BUDGET_URL)
+
+        Budget.charge(self.user, Budget.REVIEW, 10, reason=BudgetCharge.ADJUSTMENT)
+        res = self.client.get(BUDGET_URL)
+
+        self.assertEqual(res.data[0]['review'], Budget.DEFAULT_REVIEW - 10)
+
+    def test_steward_patch_invalidates_cache(self):
+        """Test a steward's change is visible to the user on the next read."""
+        self.client.get(detail_url(self.budget.id))
+        steward = create_user(email='steward@example.com', password='test123')
+        steward.groups.add(Group.objects.get_or_create(name='datasteward')[0])
+        steward_client = APIClient()
+        steward_client.force_authenticate(steward)
+
+        steward_client.patch(detail_url(self.budget.id), {'review': 150})
+        res = self.client.get(detail_url(self.budget.id))
+
+        self.assertEqual(res.data['review'], 150)
+
+    def test_budget_not_modified(self):
+        """Test an unchanged budget is answered with 304 until it is charged."""
+        url = detail_url(self.budget.id)
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Budget.charge(self.user, Budget.RELEASE, 1, reason=BudgetCharge.ADJUSTMENT)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['release'], Budget.DEFAULT_RELEASE - 1)
+
+    def test_other_budget_not_found(self):
+        """Test the cached budget is not served for another budget id."""
+        other = create_user(email='other@example.com', password='test123')
+
+        res = self.client.get(detail_url(Budget.objects.get(user=other).id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
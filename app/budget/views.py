@@ -1,30 +1,74 @@
 """
 Views for the budget APIs.
 """
+from django.http import Http404
+
 from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from knox.auth import TokenAuthentication
+from users.authentication import CachedTokenAuthentication
 
 from budget import serializers
+from core.conditional import make_etag, not_modified, set_validators
 from core.models import Run, Budget
 from .permissions import IsDataStewardOrReadOnly
 
 
+def budget_etag(budget):
+    """Budgets have no timestamp; their balances are their version."""
+    return make_etag(budget.id, repr(budget.review), repr(budget.release))
+
+
 class BudgetViewSet(viewsets.ModelViewSet):
     """View for manage budget APIs."""
     serializer_class = serializers.BudgetSerializer
     queryset = Budget.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated, IsDataStewardOrReadOnly]
 
+    def is_steward(self):
+        return self.request.user.in_group('datasteward')
+
     def get_queryset(self):
         """Retrieve budget for authenticated user."""
-        if self.request.user.groups.filter(name='datasteward').exists():
-            return self.queryset
+        # super() copies the class queryset, whose results would otherwise be
+        # cached across requests
+        queryset = super().get_queryset()
+        if self.is_steward():
+            return queryset
         else:
-            return self.queryset.filter(user=self.request.user)
+            return queryset.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        if self.is_steward():
+            return super().list(request, *args, **kwargs)
+        # A user only sees their own budget, which is cached
+        budget = Budget.for_request(request)
+        etag = budget_etag(budget) if budget is not None else None
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        serializer = self.get_serializer([budget] if budget is not None else [], many=True)
+        return set_validators(Response(serializer.data), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        budget = self.get_object()
+        etag = budget_etag(budget)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_validators(Response(self.get_serializer(budget).data), etag)
+
+    def get_object(self):
+        """Return the requested budget, the user's own from the cache."""
+        if self.is_steward():
+            return super().get_object()
+        budget = Budget.for_request(self.request)
+        if budget is None or str(budget.pk) != str(self.kwargs[self.lookup_url_kwarg or self.lookup_field]):
+            raise Http404
+        self.check_object_permissions(self.request, budget)
+        return budget
 
 
 
@@ -41,4 +41,38 @@ class UserAdmin(BaseUserAdmin):
 
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Job)
\ No newline at end of file
+admin.site.register(models.Job)
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    ordering = ['-id']
+    list_display = ['id', 'kind', 'run', 'status', 'attempts', 'available_at', 'sent_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
+
+
+admin.site.register(models.OutboxMessage, OutboxMessageAdmin)
+
+
+class BudgetChargeAdmin(admin.ModelAdmin):
+    ordering = ['-id']
+    list_display = ['id', 'user', 'kind', 'amount', 'reason', 'job', 'run', 'created_at']
+    list_filter = ['kind', 'reason']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(models.BudgetCharge, BudgetChargeAdmin)
+
+
+class BudgetReservationAdmin(admin.ModelAdmin):
+    ordering = ['-id']
+    list_display = ['id', 'user', 'kind', 'amount', 'reason', 'run', 'status', 'charged', 'expires_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['created_at', 'resolved_at']
+
+
+admin.site.register(models.BudgetReservation, BudgetReservationAdmin)
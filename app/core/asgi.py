@@ -0,0 +1,125 @@
+"""
+ASGI handler with support for asynchronous streaming responses.
+
+Django 4.0 iterates streaming responses synchronously, even under ASGI, so a
+view cannot relay an object from an async S3 client without blocking the
+event loop. Views return an AsyncStreamingHttpResponse over an async
+iterator instead, and StreamingASGIHandler sends its chunks as they arrive.
+Every other response is sent by Django as usual.
+
+An async stream stops as soon as the client disconnects, so long-lived
+streams (the event stream of job/events.py) do not outlive their clients.
+"""
+import asyncio
+import contextvars
+
+from asgiref.sync import sync_to_async
+
+from django.core.handlers.asgi import ASGIHandler
+from django.http.response import HttpResponseBase
+
+
+class AsyncStreamingHttpResponse(HttpResponseBase):
+    """A streaming response whose content is an async iterator of bytes."""
+
+    streaming = True
+
+    def __init__(self, streaming_content, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.async_streaming_content = streaming_content
+
+    def __iter__(self):
+        raise TypeError('AsyncStreamingHttpResponse can only be served by StreamingASGIHandler')
+
+    def getvalue(self):
+        raise TypeError('AsyncStreamingHttpResponse has no content to read synchronously')
+
+
+def response_headers(response):
+    """Encode the headers and cookies of a response for ASGI."""
+    headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode('ascii')
+        if isinstance(value, str):
+            value = value.encode('latin1')
+        headers.append((bytes(header), bytes(value)))
+    for c in response.cookies.values():
+        headers.append((b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+    return headers
+
+
+# The ASGI receive channel of the request being handled
+_receive = contextvars.ContextVar('receive', default=None)
+
+
+async def wait_for_disconnect(receive):
+    """Return once the client has gone away.
+
+    Django has read the whole request body by the time a response is sent,
+    so the next message is the disconnect.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler that can send AsyncStreamingHttpResponses."""
+
+    async def __call__(self, scope, receive, send):
+        token = _receive.set(receive)
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _receive.reset(token)
+
+    async def send_response(self, response, send):
+        if not isinstance(response, AsyncStreamingHttpResponse):
+            return await super().send_response(response, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers(response),
+        })
+        content = response.async_streaming_content
+        receive = _receive.get()
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive)) if receive is not None else None
+        try:
+            async for part in self.until_disconnect(content, disconnect):
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+        finally:
+            if disconnect is not None:
+                disconnect.cancel()
+            if hasattr(content, 'aclose'):
+                await content.aclose()
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    @staticmethod
+    async def until_disconnect(content, disconnect):
+        """Yield the parts of content until it ends or the client disconnects."""
+        iterator = content.__aiter__()
+        while True:
+            next_part = asyncio.ensure_future(iterator.__anext__())
+            waiting = {next_part, disconnect} if disconnect is not None else {next_part}
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if not next_part.done():
+                next_part.cancel()
+                try:
+                    await next_part
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+                return
+            try:
+                part = next_part.result()
+            except StopAsyncIteration:
+                return
+            yield part
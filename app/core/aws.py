@@ -0,0 +1,124 @@
+"""
+Shared AWS clients.
+
+Building a boto3 client loads the service model from disk and creates a new
+HTTP connection pool, so clients are created once per process and reused by
+every request. boto3 clients are thread-safe once built; only their creation
+is guarded by a lock. After a fork (e.g. uWSGI prefork) the registry notices
+the new pid and starts over, so workers never share sockets with the master.
+"""
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+from django.conf import settings
+
+from core.metrics import instrument_client
+
+
+_lock = threading.Lock()
+_clients = {}
+_session = None
+_pid = None
+# Lookups happen on many threads, and the lookup of a cached client takes
+# no other lock
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _client_config(signature_version=None):
+    """Return the botocore config shared by all clients."""
+    return Config(
+        max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_READ_TIMEOUT,
+        retries={'max_attempts': settings.AWS_MAX_ATTEMPTS, 'mode': 'standard'},
+        signature_version=signature_version,
+    )
+
+
+def _reset_after_fork():
+    """Drop clients inherited from a parent process."""
+    global _session, _pid
+    _clients.clear()
+    _session = None
+    _pid = os.getpid()
+
+
+def get_client(service, region_name=None, signature_version=None):
+    """Return the process-wide client for an AWS service."""
+    if region_name is None:
+        region_name = settings.AWS_S3_REGION_NAME
+    key = (service, region_name, signature_version)
+
+    client = _clients.get(key) if _pid == os.getpid() else None
+    if client is not None:
+        _count('hits')
+        return client
+
+    global _session
+    with _lock:
+        if _pid != os.getpid():
+            _reset_after_fork()
+        client = _clients.get(key)
+        if client is not None:
+            _count('hits')
+            return client
+
+        if _session is None:
+            _session = boto3.session.Session(
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            )
+        client = instrument_client(_session.client(
+            service,
+            region_name=region_name,
+            config=_client_config(signature_version),
+        ))
+        _clients[key] = client
+        _count('misses')
+        return client
+
+
+def get_s3_client(signature_version=None):
+    return get_client('s3', signature_version=signature_version)
+
+
+def get_lambda_client():
+    return get_client('lambda')
+
+
+def get_stepfunctions_client():
+    return get_client('stepfunctions')
+
+
+def get_ses_client():
+    return get_client('ses', region_name=settings.AWS_SES_REGION_NAME)
+
+
+def client_stats():
+    """Return pool hit/miss counters for this process."""
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        'pid': os.getpid(),
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'clients': len(_clients) if _pid == os.getpid() else 0,
+    }
+
+
+def reset_clients():
+    """Forget every client; mainly useful for tests that patch AWS."""
+    with _lock:
+        _reset_after_fork()
+    with _stats_lock:
+        _stats['hits'] = 0
+        _stats['misses'] = 0
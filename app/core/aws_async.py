@@ -0,0 +1,83 @@
+"""
+Shared asyncio AWS clients for the ASGI result views.
+
+aiobotocore clients are bound to the event loop they were created on, so
+they are kept per loop (uvicorn runs one loop per worker process) and
+created lazily with the same settings as the boto3 clients in core/aws.py.
+The connection pool is larger because one ASGI worker multiplexes many
+downloads.
+"""
+import asyncio
+import contextlib
+import weakref
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+
+from django.conf import settings
+
+from core.metrics import instrument_client
+
+
+_loops = weakref.WeakKeyDictionary()
+
+
+class _LoopClients:
+    """Clients entered on one event loop."""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.stack = contextlib.AsyncExitStack()
+        self.session = get_session()
+        self.clients = {}
+
+
+def _client_config(signature_version=None):
+    return AioConfig(
+        max_pool_connections=settings.AWS_ASYNC_MAX_POOL_CONNECTIONS,
+        connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_READ_TIMEOUT,
+        retries={'max_attempts': settings.AWS_MAX_ATTEMPTS, 'mode': 'standard'},
+        signature_version=signature_version,
+    )
+
+
+async def get_async_client(service, region_name=None, signature_version=None):
+    """Return the client for an AWS service on the running event loop."""
+    if region_name is None:
+        region_name = settings.AWS_S3_REGION_NAME
+    key = (service, region_name, signature_version)
+
+    loop = asyncio.get_running_loop()
+    loop_clients = _loops.get(loop)
+    if loop_clients is None:
+        loop_clients = _loops[loop] = _LoopClients()
+
+    client = loop_clients.clients.get(key)
+    if client is not None:
+        return client
+    async with loop_clients.lock:
+        client = loop_clients.clients.get(key)
+        if client is None:
+            client = await loop_clients.stack.enter_async_context(
+                loop_clients.session.create_client(
+                    service,
+                    region_name=region_name,
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                    config=_client_config(signature_version),
+                )
+            )
+            loop_clients.clients[key] = instrument_client(client)
+        return client
+
+
+async def get_async_s3_client():
+    return await get_async_client('s3')
+
+
+async def close_clients():
+    """Close the clients of the running event loop."""
+    loop_clients = _loops.pop(asyncio.get_running_loop(), None)
+    if loop_clients is not None:
+        await loop_clients.stack.aclose()
@@ -0,0 +1,45 @@
+"""
+Conditional GET: validators and 304 Not Modified responses.
+
+Views compute an ETag (and a Last-Modified time where there is one) from
+what they already have in hand, before serializing or fetching a body, and
+return the 304 from not_modified() when the client's copy is current.
+"""
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def is_conditional(request):
+    """Whether the request carries validators worth checking."""
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def make_etag(*parts):
+    """Strong ETag from the parts that identify a representation."""
+    return quote_etag('-'.join(str(part) for part in parts))
+
+
+def version(dt):
+    """Microsecond version number of a timestamp."""
+    return int(dt.timestamp() * 1_000_000)
+
+
+def timestamp(dt):
+    """Last-Modified time (whole seconds) of a datetime, or None."""
+    return int(dt.timestamp()) if dt is not None else None
+
+
+def set_validators(response, etag=None, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """Return a 304 (or 412) response if the request's validators match, else None."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
@@ -0,0 +1,65 @@
+"""
+MySQL backend that reuses connections through core.db.pool.
+
+Set ``'ENGINE': 'core.db.backends.mysql'`` and a ``POOL`` dict (ENABLED,
+MAX_SIZE, MAX_IDLE, TIMEOUT, HEALTH_CHECK_AFTER) in the database settings.
+Everything else behaves like django.db.backends.mysql: Django still
+"connects" and "closes" per request, but connect checks a raw connection
+out of the pool and close returns it.
+"""
+import os
+
+from django.db.backends.mysql import base
+
+from core.db import pool as db_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    _pool = None
+    _pool_pid = None
+
+    def pool_key(self, conn_params):
+        label = f"{conn_params.get('host', '')}/{conn_params.get('database', conn_params.get('db', ''))}"
+        return (label, tuple(sorted((k, repr(v)) for k, v in conn_params.items())))
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get('POOL') or {}
+        if not options.get('ENABLED', True):
+            return super().get_new_connection(conn_params)
+
+        pool = db_pool.get_pool(self.pool_key(conn_params), options)
+        connection = pool.checkout(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+            self._ping,
+        )
+        self._pool, self._pool_pid = pool, os.getpid()
+        return connection
+
+    @staticmethod
+    def _ping(connection):
+        try:
+            connection.ping()
+        except Exception:
+            return False
+        return True
+
+    def _close(self):
+        pool, self._pool = self._pool, None
+        if pool is None or self.connection is None:
+            return super()._close()
+
+        connection = self.connection
+        if self._pool_pid != os.getpid():
+            # Opened before a fork; the parent still owns the session
+            db_pool.keep_inherited(connection)
+            return
+        if self.in_atomic_block or (self.errors_occurred and not self.is_usable()):
+            pool.discard(connection)
+            return
+        if not self.autocommit:
+            try:
+                connection.rollback()
+            except Exception:
+                pool.discard(connection)
+                return
+        pool.checkin(connection)
@@ -0,0 +1,200 @@
+"""
+Process-wide pools of raw database connections.
+
+Django opens a connection per request and closes it afterwards (CONN_MAX_AGE
+is 0), paying for TCP setup and MySQL authentication every time. The pooled
+backend (core/db/backends/mysql) hands the raw connection back to a pool
+here instead, and the next request checks it out again.
+
+- A connection that sat idle for HEALTH_CHECK_AFTER seconds is pinged on
+  checkout and replaced if the server dropped it.
+- At most MAX_SIZE connections per pool are open in a process; checkouts
+  beyond that wait up to TIMEOUT seconds for one to be returned.
+- Connections idle for more than MAX_IDLE seconds are closed on the next
+  checkout or checkin, so no reaper thread is needed.
+- After a fork (uWSGI prefork) a worker starts with empty pools. Connections
+  inherited from the parent are kept referenced but never used or closed,
+  since closing them would end the parent's sessions.
+"""
+import os
+import threading
+import time
+
+from django.db import OperationalError
+
+
+_lock = threading.Lock()
+_pools = {}
+_pid = None
+# Connections opened by a parent process; see the module docstring
+_inherited = []
+
+COUNTERS = (
+    'created', 'reused', 'health_check_failures', 'reaped', 'closed',
+    'waits', 'wait_seconds', 'timeouts',
+)
+
+
+class PoolTimeout(OperationalError):
+    """No connection was returned to a full pool in time."""
+
+
+class ConnectionPool:
+    """A bounded pool of connections to one database."""
+
+    def __init__(self, max_size=8, max_idle=300, timeout=10, health_check_after=1):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.cond = threading.Condition()
+        # (connection, checked in at), most recently used last
+        self.idle = []
+        # Open connections, idle or checked out
+        self.size = 0
+        self.stats = dict.fromkeys(COUNTERS, 0)
+
+    def checkout(self, connect, ping):
+        """Return an idle connection that passes ping(), or one from connect()."""
+        waited_since = None
+        while True:
+            with self.cond:
+                stale = self._take_stale()
+                if self.idle:
+                    connection, checked_in_at = self.idle.pop()
+                elif self.size < self.max_size:
+                    connection = None
+                    self.size += 1
+                else:
+                    now = time.monotonic()
+                    if waited_since is None:
+                        waited_since = now
+                        self.stats['waits'] += 1
+                    remaining = self.timeout - (now - waited_since)
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        self.stats['wait_seconds'] += now - waited_since
+                        raise PoolTimeout(
+                            f'No database connection was returned within {self.timeout}s '
+                            f'({self.max_size} in use)'
+                        )
+                    self.cond.wait(remaining)
+                    continue
+                if waited_since is not None:
+                    self.stats['wait_seconds'] += time.monotonic() - waited_since
+                    waited_since = None
+            self._close_all(stale)
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    self._forget()
+                    raise
+                self._count('created')
+                return connection
+
+            if time.monotonic() - checked_in_at < self.health_check_after or ping(connection):
+                self._count('reused')
+                return connection
+            self._count('health_check_failures')
+            self.discard(connection)
+
+    def checkin(self, connection):
+        """Make a connection available to the next checkout."""
+        with self.cond:
+            self.idle.append((connection, time.monotonic()))
+            stale = self._take_stale()
+            self.cond.notify()
+        self._close_all(stale)
+
+    def discard(self, connection):
+        """Close a checked out connection instead of returning it."""
+        self._close_all([connection], counter='closed')
+
+    def _take_stale(self):
+        """Remove and return the connections idle longer than max_idle (lock held)."""
+        cutoff = time.monotonic() - self.max_idle
+        stale = [connection for connection, checked_in_at in self.idle if checked_in_at < cutoff]
+        if stale:
+            self.idle = [(c, t) for c, t in self.idle if t >= cutoff]
+        return stale
+
+    def _close_all(self, connections, counter='reaped'):
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+            self._forget(counter)
+
+    def _forget(self, counter=None):
+        with self.cond:
+            self.size -= 1
+            if counter:
+                self.stats[counter] += 1
+            self.cond.notify()
+
+    def _count(self, counter):
+        with self.cond:
+            self.stats[counter] += 1
+
+    def close(self):
+        """Close every idle connection."""
+        with self.cond:
+            idle, self.idle = [c for c, _ in self.idle], []
+        self._close_all(idle, counter='closed')
+
+    def snapshot(self):
+        with self.cond:
+            return dict(self.stats, size=self.size, idle=len(self.idle), max_size=self.max_size)
+
+
+def _reset_after_fork():
+    """Start over with empty pools, keeping the parent's connections alive."""
+    global _pid
+    for pool in _pools.values():
+        _inherited.extend(connection for connection, _ in pool.idle)
+    _pools.clear()
+    _pid = os.getpid()
+
+
+def get_pool(key, options):
+    """Return this process's pool for a database, created on first use."""
+    pool = _pools.get(key) if _pid == os.getpid() else None
+    if pool is not None:
+        return pool
+    with _lock:
+        if _pid != os.getpid():
+            _reset_after_fork()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                max_size=options.get('MAX_SIZE', 8),
+                max_idle=options.get('MAX_IDLE', 300),
+                timeout=options.get('TIMEOUT', 10),
+                health_check_after=options.get('HEALTH_CHECK_AFTER', 1),
+            )
+        return pool
+
+
+def keep_inherited(connection):
+    """Hold on to a connection another process opened, without closing it."""
+    _inherited.append(connection)
+
+
+def pool_stats():
+    """Return the counters of this process's pools, by database."""
+    if _pid != os.getpid():
+        return {}
+    return {key[0]: pool.snapshot() for key, pool in list(_pools.items())}
+
+
+def reset_pools():
+    """Close idle connections and forget every pool; mainly for tests."""
+    with _lock:
+        if _pid != os.getpid():
+            _reset_after_fork()
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,53 @@
+"""
+Django command to send the pending messages of the outbox.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    """Drain the outbox in batches until interrupted."""
+    help = 'Send pending engine and sanitizer invocations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--concurrency', type=int, default=None)
+        parser.add_argument('--max-attempts', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=None)
+        parser.add_argument('--once', action='store_true', help='Send one batch and exit')
+        parser.add_argument('--requeue-dead', action='store_true', help='Retry dead-lettered messages and exit')
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command"""
+        if options['requeue_dead']:
+            count = outbox.requeue_dead()
+            self.stdout.write(self.style.SUCCESS(f'Requeued {count} dead messages'))
+            return
+
+        poll_interval = options['poll_interval'] or settings.OUTBOX_POLL_INTERVAL
+        self.stdout.write('Dispatching outbox...')
+        try:
+            while True:
+                close_old_connections()
+                counts = outbox.dispatch_batch(
+                    batch_size=options['batch_size'],
+                    concurrency=options['concurrency'],
+                    max_attempts=options['max_attempts'],
+                )
+                if counts['claimed']:
+                    self.stdout.write(
+                        f"sent={counts['sent']} retry={counts['pending']} dead={counts['dead']}"
+                    )
+                if options['once']:
+                    break
+                # Keep going while there is a backlog
+                if counts['claimed'] < (options['batch_size'] or settings.OUTBOX_BATCH_SIZE):
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS('Outbox dispatcher stopped'))
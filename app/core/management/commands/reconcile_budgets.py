@@ -0,0 +1,26 @@
+"""
+Django command to check budget balances against the budget ledger.
+"""
+from django.core.management.base import BaseCommand
+
+from core.models import Budget
+
+
+class Command(BaseCommand):
+    """Report (and optionally fix) balances that differ from their ledger."""
+    help = 'Reconcile budget balances with the BudgetCharge ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Reset differing balances to the ledger total')
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command"""
+        mismatches = Budget.reconcile(fix=options['fix'])
+        for budget, kind, balance, total in mismatches:
+            self.stdout.write(self.style.WARNING(
+                f'Budget {budget.id} (user {budget.user_id}) {kind}: balance {balance} != ledger {total}'
+            ))
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('All budgets match their ledger'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(mismatches)} balances'))
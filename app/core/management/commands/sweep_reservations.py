@@ -0,0 +1,43 @@
+"""
+Django command to settle expired budget holds and fail stranded release
+tasks.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.models import BudgetReservation, ReleaseTask
+
+
+class Command(BaseCommand):
+    """Charge the budget held by reservations past their expiry."""
+    help = 'Settle budget reservations that have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep sweeping every INTERVAL seconds instead of once')
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command"""
+        try:
+            while True:
+                close_old_connections()
+                # First, so that the holds of stranded tasks are given back, not charged
+                failed = ReleaseTask.fail_stale()
+                if failed:
+                    self.stdout.write(self.style.WARNING(f'Failed {failed} stale release tasks'))
+                settled = 0
+                while True:
+                    count = BudgetReservation.sweep_expired(batch_size=options['batch_size'])
+                    settled += count
+                    if count < options['batch_size']:
+                        break
+                if settled or options['interval'] is None:
+                    self.stdout.write(self.style.SUCCESS(f'Settled {settled} expired reservations'))
+                if options['interval'] is None:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
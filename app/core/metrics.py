@@ -0,0 +1,401 @@
+"""
+Prometheus metrics, served at /api/metrics.
+
+uWSGI and uvicorn run several worker processes, so with
+PROMETHEUS_MULTIPROC_DIR set (scripts/run.sh and the app-async, dispatcher
+and sweeper services do) every worker writes its samples to memory-mapped
+files in that directory and a scrape of any worker adds up all of them.
+Each service has a directory of its own on a shared volume, since process
+ids repeat across containers; a scrape of the app also adds up the
+directories in METRICS_SERVICE_DIRS. Recording a sample is a dict lookup
+and a write to the mapped file, with no locks shared between processes.
+
+Recorded here:
+
+* latency of each request by view, action, method and status code, and the
+  number and total time of its database queries (sync views only; async
+  views query on another thread);
+* requests in flight, summed over the live workers;
+* latency and errors of every S3, Lambda and Step Functions call, through
+  botocore's event hooks on the shared clients (core/aws.py,
+  core/aws_async.py);
+* budget charges by kind, reason and outcome (core/models.py);
+* the in-process counters of the database connection pool, the shared AWS
+  clients, the result cache and the verified-token cache. Those are plain
+  dicts updated without touching prometheus_client; StatsCollector copies
+  them into metrics at most every STATS_SYNC_INTERVAL seconds, after a
+  request or before a scrape, so every worker's values reach the files.
+"""
+import asyncio
+import atexit
+import glob
+import os
+import threading
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Time to produce a response (the body of a streaming response is not included).',
+    ['view', 'action', 'method', 'status'],
+    buckets=REQUEST_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'Requests being handled.',
+    multiprocess_mode='livesum',
+)
+REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries',
+    'Database queries made by a request.',
+    ['view', 'action'],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    'http_request_db_seconds',
+    'Time a request spent in database queries.',
+    ['view', 'action'],
+    buckets=REQUEST_BUCKETS,
+)
+AWS_CALL_LATENCY = Histogram(
+    'aws_call_duration_seconds',
+    'Time of an AWS API call, retries included.',
+    ['service', 'operation'],
+    buckets=REQUEST_BUCKETS,
+)
+AWS_CALL_ERRORS = Counter(
+    'aws_call_errors',
+    'AWS API calls that failed, by error code.',
+    ['service', 'operation', 'code'],
+)
+BUDGET_CHARGES = Counter(
+    'budget_charges',
+    'Charges against review and release budgets.',
+    ['kind', 'reason', 'result'],
+)
+DB_POOL_EVENTS = Counter(
+    'db_pool_events',
+    'Connection pool events (see core/db/pool.py COUNTERS), e.g. reused connections and waits.',
+    ['database', 'event'],
+)
+DB_POOL_WAIT_SECONDS = Counter(
+    'db_pool_wait_seconds',
+    'Time spent waiting for a free pooled connection.',
+    ['database'],
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections',
+    'Pooled connections, open and idle, summed over the live workers.',
+    ['database', 'state'],
+    multiprocess_mode='livesum',
+)
+AWS_CLIENT_LOOKUPS = Counter(
+    'aws_client_lookups',
+    'Lookups of the shared AWS clients, by whether a client was reused.',
+    ['result'],
+)
+AWS_CLIENTS = Gauge(
+    'aws_clients',
+    'Shared AWS clients, summed over the live workers.',
+    multiprocess_mode='livesum',
+)
+RESULT_CACHE_EVENTS = Counter(
+    'result_cache_events',
+    'Result cache hits, misses and evictions.',
+    ['event'],
+)
+TOKEN_CACHE_LOOKUPS = Counter(
+    'auth_token_cache_lookups',
+    'Lookups of the verified-token cache.',
+    ['result'],
+)
+TOKEN_CACHE_ENTRIES = Gauge(
+    'auth_token_cache_entries',
+    'Verified tokens cached, summed over the live workers.',
+    multiprocess_mode='livesum',
+)
+
+# Seconds between two copies of the in-process counters into metrics
+STATS_SYNC_INTERVAL = 1.0
+
+
+def multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+def _mark_process_dead():
+    # Drops this worker's live gauges from the sums
+    multiprocess.mark_process_dead(os.getpid())
+
+
+def _register_exit_hook():
+    try:
+        import uwsgi
+    except ImportError:
+        # uvicorn workers and management commands exit through atexit
+        atexit.register(_mark_process_dead)
+        return
+    # uWSGI workers skip atexit handlers and call uwsgi.atexit instead
+    previous = getattr(uwsgi, 'atexit', None)
+
+    def worker_exit():
+        _mark_process_dead()
+        if previous is not None:
+            previous()
+
+    uwsgi.atexit = worker_exit
+
+
+if multiprocess_dir():
+    _register_exit_hook()
+
+
+def record_budget_charge(kind, reason, result):
+    BUDGET_CHARGES.labels(kind, reason or 'none', result).inc()
+
+
+def _pool_stats():
+    from core.db.pool import COUNTERS, pool_stats
+
+    for database, stats in pool_stats().items():
+        for event in COUNTERS:
+            if event != 'wait_seconds':
+                yield DB_POOL_EVENTS.labels(database, event), stats[event]
+        yield DB_POOL_WAIT_SECONDS.labels(database), stats['wait_seconds']
+        DB_POOL_CONNECTIONS.labels(database, 'open').set(stats['size'])
+        DB_POOL_CONNECTIONS.labels(database, 'idle').set(stats['idle'])
+
+
+def _aws_stats():
+    from core.aws import client_stats
+
+    stats = client_stats()
+    yield AWS_CLIENT_LOOKUPS.labels('hit'), stats['hits']
+    yield AWS_CLIENT_LOOKUPS.labels('miss'), stats['misses']
+    AWS_CLIENTS.set(stats['clients'])
+
+
+def _result_cache_stats():
+    from job.cache import get_result_cache
+
+    cache = get_result_cache()
+    if cache is None:
+        return
+    stats = cache.stats()
+    for event, name in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions')):
+        yield RESULT_CACHE_EVENTS.labels(event), stats[name]
+
+
+def _token_cache_stats():
+    from users.authentication import token_cache
+
+    stats = token_cache.stats()
+    yield TOKEN_CACHE_LOOKUPS.labels('hit'), stats['hits']
+    yield TOKEN_CACHE_LOOKUPS.labels('miss'), stats['misses']
+    TOKEN_CACHE_ENTRIES.set(stats['size'])
+
+
+class StatsCollector:
+    """Copy in-process counters into metrics.
+
+    Each source yields (counter, running total) pairs and sets its gauges;
+    counters are increased by what the total grew since the last copy, so
+    they stay monotonic when a source is reset.
+    """
+
+    def __init__(self, sources):
+        self.sources = list(sources)
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.synced_at = None
+        self.pid = None
+
+    def collect(self, force=False):
+        now = time.monotonic()
+        if not force and self.synced_at is not None and now - self.synced_at < STATS_SYNC_INTERVAL:
+            return
+        with self.lock:
+            self.synced_at = now
+            # Totals a forked worker inherited were never this process's to export
+            if self.pid != os.getpid():
+                self.totals.clear()
+                self.pid = os.getpid()
+            for source in self.sources:
+                for counter, total in source():
+                    delta = total - self.totals.get(counter, 0)
+                    if delta > 0:
+                        counter.inc(delta)
+                    self.totals[counter] = total
+
+
+stats_collector = StatsCollector([_pool_stats, _aws_stats, _result_cache_stats, _token_cache_stats])
+
+
+class QueryTimer:
+    """Database execute wrapper that counts and times a request's queries."""
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def view_labels(request):
+    """Return the (view, action) labels of a request.
+
+    DRF views are labelled with their class and viewset action, other
+    views with their URL name; requests that match no URL share one label.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', ''
+    view = getattr(match.func, 'cls', None)
+    if view is None:
+        return match.view_name, ''
+    actions = getattr(match.func, 'actions', None) or {}
+    return view.__name__, actions.get(request.method.lower(), '')
+
+
+class MetricsMiddleware:
+    """Record the latency, status and database use of every request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django to call this middleware without a thread hop
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        timer = QueryTimer()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        self.observe(request, response, time.perf_counter() - start, timer)
+        stats_collector.collect()
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await self.get_response(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        self.observe(request, response, time.perf_counter() - start)
+        stats_collector.collect()
+        return response
+
+    @staticmethod
+    def observe(request, response, seconds, timer=None):
+        view, action = view_labels(request)
+        REQUEST_LATENCY.labels(view, action, request.method, str(response.status_code)).observe(seconds)
+        if timer is not None:
+            REQUEST_DB_QUERIES.labels(view, action).observe(timer.count)
+            REQUEST_DB_SECONDS.labels(view, action).observe(timer.seconds)
+
+
+def _before_aws_call(context, **kwargs):
+    context['metrics_start'] = time.perf_counter()
+
+
+def _after_aws_call(event_name, context, parsed=None, exception=None, **kwargs):
+    start = context.pop('metrics_start', None)
+    if start is None:
+        return
+    # after-call.<service id>.<operation>
+    _, service, operation = event_name.split('.', 2)
+    AWS_CALL_LATENCY.labels(service, operation).observe(time.perf_counter() - start)
+    if exception is not None:
+        AWS_CALL_ERRORS.labels(service, operation, type(exception).__name__).inc()
+    elif parsed and 'Error' in parsed:
+        AWS_CALL_ERRORS.labels(service, operation, parsed['Error'].get('Code', 'Unknown')).inc()
+
+
+def instrument_client(client):
+    """Time every API call of a boto3 or aiobotocore client."""
+    events = client.meta.events
+    # First, so that a handler returning a response (e.g. a Stubber) is timed too
+    events.register_first('before-call.*.*', _before_aws_call, unique_id='metrics-before-call')
+    events.register('after-call.*.*', _after_aws_call, unique_id='metrics-after-call')
+    events.register('after-call-error.*.*', _after_aws_call, unique_id='metrics-after-call-error')
+    return client
+
+
+class ServicesCollector:
+    """Add up the samples of the workers of several services.
+
+    Like prometheus_client's MultiProcessCollector, over more than one
+    directory.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def collect(self):
+        files = []
+        for path in self.paths:
+            files.extend(glob.glob(os.path.join(path, '*.db')))
+        return multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+
+
+def metrics_registry():
+    """Return the registry to expose: every worker's samples in multiprocess mode."""
+    if not multiprocess_dir():
+        return REGISTRY
+    registry = CollectorRegistry()
+    registry.register(ServicesCollector([multiprocess_dir(), *settings.METRICS_SERVICE_DIRS]))
+    return registry
+
+
+def metrics_view(request):
+    """Expose the metrics in the Prometheus text format.
+
+    Scrapers authenticate with ``Authorization: Bearer <METRICS_TOKEN>``;
+    without a METRICS_TOKEN the endpoint does not exist.
+    """
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+        response = HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    stats_collector.collect(force=True)
+    return HttpResponse(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
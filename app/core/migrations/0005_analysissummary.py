@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_delete_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('analysis_id', models.CharField(max_length=64)),
+                ('analysis_name', models.CharField(blank=True, max_length=255)),
+                ('epsilon_sum', models.FloatField()),
+                ('row_count', models.PositiveIntegerField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analyses', to='core.run')),
+            ],
+            options={
+                'ordering': ('run', 'id'),
+                'unique_together': {('run', 'analysis_id')},
+            },
+        ),
+    ]
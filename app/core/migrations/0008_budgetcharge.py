@@ -0,0 +1,47 @@
+# Generated by Django 4.0.6 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_opening_balances(apps, schema_editor):
+    """Start the ledger of existing budgets from their current balances."""
+    Budget = apps.get_model('core', 'Budget')
+    BudgetCharge = apps.get_model('core', 'BudgetCharge')
+    charges = []
+    for budget in Budget.objects.all():
+        charges.append(BudgetCharge(user_id=budget.user_id, kind='review', amount=budget.review, reason='opening'))
+        charges.append(BudgetCharge(user_id=budget.user_id, kind='release', amount=budget.release, reason='opening'))
+    BudgetCharge.objects.bulk_create(charges, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_releasetask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BudgetCharge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('review', 'Review'), ('release', 'Release')], max_length=16)),
+                ('amount', models.FloatField()),
+                ('reason', models.CharField(blank=True, choices=[('grant', 'Grant'), ('opening', 'Opening balance'), ('first_run', 'First run'), ('refine', 'Refine'), ('release', 'Release'), ('refund', 'Refund'), ('adjustment', 'Adjustment')], max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='budget_charges', to='core.job')),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='budget_charges', to='core.run')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='budget_charges', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='budgetcharge',
+            index=models.Index(fields=['user', 'kind'], name='core_budgetcharge_user_idx'),
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.0.6 on 2026-10-18 13:55
+
+import core.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+REASON_CHOICES = [
+    ('grant', 'Grant'),
+    ('opening', 'Opening balance'),
+    ('hold', 'Hold'),
+    ('hold_release', 'Hold released'),
+    ('first_run', 'First run'),
+    ('refine', 'Refine'),
+    ('release', 'Release'),
+    ('refund', 'Refund'),
+    ('adjustment', 'Adjustment'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_budgetcharge'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='budgetcharge',
+            name='reason',
+            field=models.CharField(blank=True, choices=REASON_CHOICES, max_length=16),
+        ),
+        migrations.CreateModel(
+            name='BudgetReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('review', 'Review'), ('release', 'Release')], max_length=16)),
+                ('amount', models.FloatField()),
+                ('reason', models.CharField(blank=True, choices=REASON_CHOICES, max_length=16)),
+                ('status', models.CharField(choices=[('held', 'Held'), ('settled', 'Settled'), ('released', 'Released'), ('expired', 'Expired')], default='held', max_length=16)),
+                ('charged', models.FloatField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(default=core.models.default_reservation_expiry)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='budget_reservations', to='core.run')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='budget_reservations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='budgetreservation',
+            index=models.Index(fields=['status', 'expires_at'], name='core_reservation_expiry_idx'),
+        ),
+        migrations.AddField(
+            model_name='releasetask',
+            name='reservation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.budgetreservation'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.6 on 2026-10-18 14:45
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_next_run_id(apps, schema_editor):
+    """Continue each job's counter after its highest run_id."""
+    Job = apps.get_model('core', 'Job')
+    Run = apps.get_model('core', 'Run')
+    last_run_id = (
+        Run.objects.filter(job=OuterRef('pk'))
+        .values('job')
+        .annotate(last=Max('run_id'))
+        .values('last')
+    )
+    Job.objects.update(next_run_id=Coalesce(Subquery(last_run_id), 0) + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_job_run_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='next_run_id',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(backfill_next_run_id, migrations.RunPython.noop),
+    ]
@@ -3,13 +3,16 @@ Database models.
 """
 import uuid
 import os
+import copy
 import json
-import boto3
+from datetime import timedelta
 
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import m2m_changed, post_save, pre_delete, pre_save
 from django.db.models import Sum
 from django.dispatch import receiver
-from django.db import models
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
 
 from django.contrib.auth.models import (
@@ -20,15 +23,11 @@ from django.contrib.auth.models import (
 )
 from django.conf import settings
 
-from rest_framework.response import Response
-from rest_framework import status
+from core.metrics import record_budget_charge
 
-from botocore import exceptions
-
-def trigger_engine(instance):
-    run = instance
-
-    event = {
+def engine_event(run):
+    """Return the Step Functions input that starts the engine for a run."""
+    return {
         "job_id": str(run.job.id),
         "run_id": run.run_id,
         "user_email": run.job.user.email,
@@ -37,28 +36,6 @@ def trigger_engine(instance):
         "k": 10,
         "sample_frac": 0.1,
     }
-            
-    try:
-        # invoke engine
-        client = boto3.client(
-            "stepfunctions", 
-            region_name = os.getenv('AWS_S3_REGION_NAME'),
-            aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-        )
-
-        response = client.start_execution(
-            stateMachineArn = settings.AWS_STEPFUNCTION,
-            name = str(event['job_id']),
-            input = json.dumps(event),
-            #InvocationType="DryRun"
-        )
-        return Response(response, status=status.HTTP_200_OK)
-    except exceptions.ClientError as e:
-        error_response = e.response
-        #error_code = error_response['Error']['Code']
-        error_message = error_response['Error']['Message']
-        return Response({'error': error_message}, status=status.HTTP_400_BAD_REQUEST)
 
 
 def job_script_file_path(instance, filename):
@@ -78,6 +55,24 @@ def default_run_name(instance):
     return f'{instance.job.title}_{index}'
 
 
+class StatusTracking:
+    """Remember the status a model instance was loaded with.
+
+    The post_save receivers below compare it with the saved status to record
+    a StatusEvent only when the status actually changed.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'status' in instance.__dict__:
+            instance._loaded_status = copy.deepcopy(instance.status)
+        return instance
+
+    def status_changed(self):
+        return not hasattr(self, '_loaded_status') or self._loaded_status != self.status
+
+
 class Epsilon:
     def __init__(self, statistic_id, epsilon):
         self.statistic_id = statistic_id
@@ -133,11 +128,71 @@ class User(AbstractBaseUser, PermissionsMixin):
         super(User, self).save(*args, **kwargs)
         if created:
             self.refresh_from_db()
-            Budget.objects.create(user=self)
-
-
-
-class Job(models.Model):
+            Budget.open_for(self)
+
+    @staticmethod
+    def group_names_cache_key(user_id):
+        return f'user_groups:{user_id}'
+
+    @property
+    def group_names(self):
+        """Frozenset of the user's group names.
+
+        Resolved once per user object (and so once per request), from a
+        cache shared across requests that the m2m_changed receiver below
+        invalidates when the user's groups change.
+        """
+        try:
+            return self._group_names
+        except AttributeError:
+            pass
+        key = self.group_names_cache_key(self.pk)
+        names = cache.get(key)
+        if names is None:
+            names = frozenset(self.groups.values_list('name', flat=True))
+            cache.set(key, names, settings.USER_GROUPS_CACHE_TIMEOUT)
+        self._group_names = names
+        return names
+
+    def in_group(self, name):
+        return name in self.group_names
+
+    def forget_group_names(self):
+        """Drop the user's group names from this object and the cache."""
+        self.__dict__.pop('_group_names', None)
+        cache.delete(self.group_names_cache_key(self.pk))
+
+
+def in_group(user, name):
+    """Return whether a user, possibly anonymous, is in the named group."""
+    return user.is_authenticated and user.in_group(name)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def forget_group_names(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate cached group names when group memberships change."""
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups.add(...) and friends
+        instance.forget_group_names()
+        return
+    # group.users.add(...) and friends
+    if action == 'pre_clear':
+        pk_set = set(instance.users.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        return
+    cache.delete_many([User.group_names_cache_key(pk) for pk in pk_set or ()])
+
+
+@receiver(pre_delete, sender=Group)
+def forget_group_members(sender, instance, **kwargs):
+    """Invalidate the cached group names of a deleted group's members."""
+    cache.delete_many([User.group_names_cache_key(pk) for pk in instance.users.values_list('pk', flat=True)])
+
+
+
+class Job(StatusTracking, models.Model):
     """Job object."""
     DATASET_CHOICES = [
         ("cps", "CPS"),
@@ -156,8 +211,25 @@ class Job(models.Model):
     script = models.FileField(null=True, upload_to=job_script_file_path)
     dataset_id = models.CharField(max_length=32, choices=DATASET_CHOICES, blank=False)
     max_epsilon = models.JSONField(default=None, null=True)
+    # Next run_id to hand out; only changed by allocate_run_id()
+    next_run_id = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        # Listings page newest first by (created_at, id)
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='core_job_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='core_job_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        if self._state.adding:
+            # The job, its first run and the engine submission commit together
+            with transaction.atomic():
+                self._save(*args, **kwargs)
+        else:
+            self._save(*args, **kwargs)
+
+    def _save(self, *args, **kwargs):
         create_run = self._state.adding
         if create_run:
             # Object is new, so set the upload_to path after saving
@@ -168,11 +240,49 @@ class Job(models.Model):
             if 'force_insert' in kwargs:
                 kwargs.pop('force_insert')
 
+        # Never write back a stale run counter
+        if kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'next_run_id'
+            ]
         super().save(*args, **kwargs)
 
         if create_run:
             Run.objects.create(job=self)
 
+    @classmethod
+    def allocate_run_id(cls, job_id):
+        """Reserve the next run_id of a job with a single statement.
+
+        The increment and the read are one atomic UPDATE, so concurrent
+        refines of a job get distinct ids; they queue on the job's row lock
+        only until their transaction ends.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        column = connection.ops.quote_name('next_run_id')
+        pk = connection.ops.quote_name(cls._meta.pk.column)
+        params = [cls._meta.pk.get_db_prep_value(job_id, connection)]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                # LAST_INSERT_ID(expr) hands the new value back with the UPDATE
+                cursor.execute(
+                    f'UPDATE {table} SET {column} = LAST_INSERT_ID({column} + 1) WHERE {pk} = %s', params
+                )
+                if cursor.rowcount:
+                    return cursor.lastrowid - 1
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'UPDATE {table} SET {column} = {column} + 1 WHERE {pk} = %s RETURNING {column}', params
+                )
+                row = cursor.fetchone()
+                if row:
+                    return row[0] - 1
+            else:
+                with transaction.atomic():
+                    if cls.objects.filter(pk=job_id).update(next_run_id=models.F('next_run_id') + 1):
+                        return cls.objects.filter(pk=job_id).values_list('next_run_id', flat=True).get() - 1
+        raise cls.DoesNotExist(f'Job {job_id} does not exist')
+
     def get_epsilon_for_index(self, array, index):
         for i in range(len(array)):
             if array[i]['statistic_id'] == index:
@@ -185,7 +295,7 @@ class Job(models.Model):
 
 
 
-class Run(models.Model):
+class Run(StatusTracking, models.Model):
     """Run object."""
     job = models.ForeignKey(
         Job,
@@ -202,6 +312,9 @@ class Run(models.Model):
     class Meta:
         unique_together = ('job', 'run_id')
         ordering = ('job', 'run_id')
+        indexes = [
+            models.Index(fields=['job', 'created_at', 'id'], name='core_run_job_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -227,27 +340,265 @@ class Run(models.Model):
     def save(self, *args, **kwargs):
         if self.id is None: # object is being created
             print("creating new run")
-            last_id = Run.objects.filter(job=self.job).order_by('-run_id').values_list('run_id', flat=True).first()
-            self.run_id = 1 if last_id is None else last_id + 1
+            self.run_id = Job.allocate_run_id(self.job_id)
             # determine if sensitivities need to be computed
             if self.run_id > 1:
                 self.compute_sensitivities = False
             else:
                 # charge default epsilon for first run
-                budget = Budget.objects.filter(user=self.job.user)[0]
-                budget.charge_review_budget(1)
+                Budget.charge(self.job.user, Budget.REVIEW, 1, job=self.job, reason=BudgetCharge.FIRST_RUN)
         super(Run, self).save(*args, **kwargs)
 
+class AnalysisSummary(models.Model):
+    """Total epsilon of one analysis in the sanitized output of a run."""
+    run = models.ForeignKey(
+        Run,
+        on_delete=models.CASCADE,
+        related_name='analyses'
+    )
+    analysis_id = models.CharField(max_length=64)
+    analysis_name = models.CharField(max_length=255, blank=True)
+    epsilon_sum = models.FloatField()
+    row_count = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('run', 'analysis_id')
+        ordering = ('run', 'id')
+
+    def __str__(self):
+        return f'{self.run_id}: {self.analysis_name}'
+
+    @classmethod
+    def create_for_run(cls, run, analyses):
+        """Store the summaries of a run with a single bulk insert."""
+        cls.objects.bulk_create(
+            [cls(run=run, **analysis) for analysis in analyses],
+            ignore_conflicts=True,
+        )
+        return cls.objects.filter(run=run)
+
+
+class StatusEvent(models.Model):
+    """A status a job or run was saved with, in the order they were saved.
+
+    Append-only; the id is the sequence that the event stream of
+    job/events.py follows and clients resume from.
+    """
+    id = models.BigAutoField(primary_key=True)
+    job = models.ForeignKey(
+        Job,
+        on_delete=models.CASCADE,
+        related_name='status_events'
+    )
+    run = models.ForeignKey(
+        Run,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='status_events'
+    )
+    status = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['job', 'id'], name='core_statusevent_job_idx'),
+        ]
+
+    def __str__(self):
+        return f'#{self.id} {self.run or self.job}'
+
+    @classmethod
+    def for_instance(cls, instance):
+        if isinstance(instance, Run):
+            return cls(job_id=instance.job_id, run=instance, status=instance.status)
+        return cls(job=instance, status=instance.status)
+
+    @classmethod
+    def record(cls, instance):
+        """Record the status of a saved Job or Run if it changed."""
+        if not instance.status_changed():
+            return None
+        event = cls.for_instance(instance)
+        event.save()
+        instance._loaded_status = copy.deepcopy(instance.status)
+        return event
+
+    @classmethod
+    def record_many(cls, instances):
+        """Record the changed statuses of instances saved in bulk, with one insert."""
+        changed = [instance for instance in instances if instance.status_changed()]
+        events = cls.objects.bulk_create([cls.for_instance(instance) for instance in changed])
+        for instance in changed:
+            instance._loaded_status = copy.deepcopy(instance.status)
+        return events
+
+
+@receiver(post_save, sender=Job)
+@receiver(post_save, sender=Run)
+def record_status_event(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'status' in update_fields:
+        StatusEvent.record(instance)
+
+
+class ReleaseTask(models.Model):
+    """A release of a run processed in the background (see job/tasks.py)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    run = models.ForeignKey(
+        Run,
+        on_delete=models.CASCADE,
+        related_name='release_tasks'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    analysis_ids = models.JSONField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.FloatField(default=0)
+    reserved_cost = models.FloatField()
+    reservation = models.ForeignKey(
+        'BudgetReservation',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    charged_cost = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.run} release ({self.status})'
+
+    @classmethod
+    def fail_stale(cls, stale_after=None):
+        """Fail active tasks not updated for stale_after seconds; returns how many.
+
+        Tasks run on a thread pool inside a web worker (see job/tasks.py),
+        so a worker that is restarted or killed strands them as queued or
+        running. A running task saves its progress every few seconds, so one
+        that has been silent for RELEASE_TASK_STALE_AFTER seconds is gone.
+        Its hold is given back, since nothing was charged for it.
+        """
+        if stale_after is None:
+            stale_after = settings.RELEASE_TASK_STALE_AFTER
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        failed = 0
+        stale = cls.objects.filter(status__in=cls.ACTIVE_STATUSES, updated_at__lte=cutoff).select_related('reservation')
+        for task in stale:
+            now = timezone.now()
+            # Conditional, so a task that just moved on is left alone
+            if not cls.objects.filter(id=task.id, status=task.status, updated_at=task.updated_at).update(
+                status=cls.FAILED, error='Interrupted', finished_at=now, updated_at=now
+            ):
+                continue
+            if task.reservation is not None:
+                task.reservation.release()
+            failed += 1
+        return failed
+
+
+
+class OutboxMessage(models.Model):
+    """An AWS invocation waiting to be sent by the outbox dispatcher.
+
+    Messages are written in the same transaction as the change that needs
+    them, so a rolled back request never starts an execution and a committed
+    one always does (see core/outbox.py).
+    """
+    ENGINE = 'engine'
+    SANITIZER = 'sanitizer'
+    KIND_CHOICES = [
+        (ENGINE, 'Engine'),
+        (SANITIZER, 'Sanitizer'),
+    ]
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    ]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    run = models.ForeignKey(
+        Run,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='outbox_messages'
+    )
+    payload = models.JSONField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='core_outbox_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.id} ({self.status})'
+
+    @classmethod
+    def enqueue(cls, kind, payload, run=None):
+        """Record an invocation to be sent once the current transaction commits."""
+        return cls.objects.create(kind=kind, payload=payload, run=run)
+
+
 @receiver(post_save, sender=Run)
 def submit_run(sender, instance, created, **kwargs):
-    if created:
-        trigger_engine(instance)
+    # Only a job's first run goes to the engine; refined runs are queued for
+    # the sanitizer by the refine view instead
+    if created and instance.run_id == 1:
+        OutboxMessage.enqueue(OutboxMessage.ENGINE, engine_event(instance), run=instance)
+
+
+class InsufficientBudget(Exception):
+    """A charge is larger than what is left of the budget."""
 
 
 class Budget(models.Model):
+    """Budget object.
+
+    ``review`` and ``release`` are balances materialized from the user's
+    BudgetCharge ledger. They only change through charge() and credit(), which
+    update the balance with one conditional UPDATE and append the matching
+    ledger row in the same transaction.
+
+    Reads go through for_request() / for_user(), which keep the row in a
+    short-lived shared cache (BUDGET_CACHE_TIMEOUT). Everything that changes
+    a balance calls invalidate_cache(), so the cache only serves reads and
+    quick rejections; the conditional UPDATE stays the authority on spending.
+    """
     DEFAULT_REVIEW = 100
     DEFAULT_RELEASE = 100
-    """Budget object."""
+    REVIEW = 'review'
+    RELEASE = 'release'
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
@@ -255,13 +606,369 @@ class Budget(models.Model):
     review = models.FloatField(null=False, default=DEFAULT_REVIEW)
     release = models.FloatField(null=False, default=DEFAULT_RELEASE)
 
-    def charge_review_budget(self, cost):
+    @classmethod
+    def open_for(cls, user):
+        """Create the budget of a new user and record its initial grants."""
+        budget = cls.objects.create(user=user)
+        BudgetCharge.objects.bulk_create([
+            BudgetCharge(user=user, kind=cls.REVIEW, amount=budget.review, reason=BudgetCharge.GRANT),
+            BudgetCharge(user=user, kind=cls.RELEASE, amount=budget.release, reason=BudgetCharge.GRANT),
+        ])
+        return budget
+
+    @staticmethod
+    def cache_key(user_id):
+        return f'budget:{user_id}'
+
+    @classmethod
+    def for_user(cls, user):
+        """Return the user's budget, from the shared cache if possible, or None."""
+        key = cls.cache_key(user.pk)
+        budget = cache.get(key)
+        if budget is None:
+            budget = cls.objects.filter(user=user).first()
+            if budget is not None:
+                cache.set(key, budget, settings.BUDGET_CACHE_TIMEOUT)
+        return budget
+
+    @classmethod
+    def for_request(cls, request):
+        """Return the budget of the request's user, looked up at most once per request."""
+        try:
+            return request._budget
+        except AttributeError:
+            request._budget = cls.for_user(request.user)
+            return request._budget
+
+    @classmethod
+    def invalidate_cache(cls, user_id):
+        """Drop a user's cached budget, now and again once the transaction commits.
+
+        The second delete stops a concurrent request from caching the old
+        balance before the change is visible.
+        """
+        key = cls.cache_key(user_id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    @classmethod
+    def charge(cls, user, kind, cost, run=None, job=None, reason=''):
+        """Take cost from the user's review or release budget.
+
+        The balance is checked and decremented by a single
+        ``UPDATE ... SET kind = kind - cost WHERE kind >= cost``, so concurrent
+        charges never overspend and no row lock is held beyond the statement's
+        transaction. Raises InsufficientBudget.
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(user=user, **{f'{kind}__gte': cost}).update(
+                **{kind: models.F(kind) - cost}
+            )
+            if not updated:
+                record_budget_charge(kind, reason, 'insufficient')
+                raise InsufficientBudget(f'Insufficient {kind} budget for a cost of {cost}')
+            record_budget_charge(kind, reason, 'charged')
+            cls.invalidate_cache(getattr(user, 'pk', user))
+            return BudgetCharge.record(user, kind, -cost, run=run, job=job, reason=reason)
+
+    @classmethod
+    def credit(cls, user, kind, amount, run=None, job=None, reason=''):
+        """Add amount (possibly negative) to the user's review or release budget."""
+        with transaction.atomic():
+            cls.objects.filter(user=user).update(**{kind: models.F(kind) + amount})
+            cls.invalidate_cache(getattr(user, 'pk', user))
+            return BudgetCharge.record(user, kind, amount, run=run, job=job, reason=reason)
+
+    def charge_review_budget(self, cost, run=None, reason=''):
         """Update the user's budget."""
-        self.review = self.review - cost
-        self.save()
+        Budget.charge(self.user, Budget.REVIEW, cost, run=run, reason=reason)
+        self.refresh_from_db(fields=['review'])
 
-    def charge_release_budget(self, cost):
+    def charge_release_budget(self, cost, run=None, reason=''):
         """Update the user's release budget."""
-        self.release = self.release - cost
-        self.save()
+        Budget.charge(self.user, Budget.RELEASE, cost, run=run, reason=reason)
+        self.refresh_from_db(fields=['release'])
+
+    @classmethod
+    def reconcile(cls, fix=False):
+        """Compare every balance with its ledger.
+
+        Returns a list of (budget, kind, balance, ledger_total) for the ones
+        that differ; with fix=True the balances are reset to the ledger.
+        """
+        totals = {
+            (row['user'], row['kind']): row['total']
+            for row in BudgetCharge.objects.values('user', 'kind').annotate(total=Sum('amount'))
+        }
+        mismatches = []
+        for budget in cls.objects.all():
+            for kind in (cls.REVIEW, cls.RELEASE):
+                balance = getattr(budget, kind)
+                total = totals.get((budget.user_id, kind), 0)
+                if abs(balance - total) > 1e-9:
+                    mismatches.append((budget, kind, balance, total))
+                    if fix:
+                        cls.objects.filter(id=budget.id).update(**{kind: total})
+                        cls.invalidate_cache(budget.user_id)
+        return mismatches
+
+
+class BudgetCharge(models.Model):
+    """Append-only ledger of every change to a budget balance.
+
+    ``amount`` is signed: charges are negative, grants and refunds positive.
+    """
+    GRANT = 'grant'
+    OPENING = 'opening'
+    HOLD = 'hold'
+    HOLD_RELEASE = 'hold_release'
+    FIRST_RUN = 'first_run'
+    REFINE = 'refine'
+    RELEASE = 'release'
+    REFUND = 'refund'
+    ADJUSTMENT = 'adjustment'
+    REASON_CHOICES = [
+        (GRANT, 'Grant'),
+        (OPENING, 'Opening balance'),
+        (HOLD, 'Hold'),
+        (HOLD_RELEASE, 'Hold released'),
+        (FIRST_RUN, 'First run'),
+        (REFINE, 'Refine'),
+        (RELEASE, 'Release'),
+        (REFUND, 'Refund'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
 
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='budget_charges'
+    )
+    kind = models.CharField(max_length=16, choices=[(Budget.REVIEW, 'Review'), (Budget.RELEASE, 'Release')])
+    amount = models.FloatField()
+    reason = models.CharField(max_length=16, choices=REASON_CHOICES, blank=True)
+    job = models.ForeignKey(
+        Job,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='budget_charges'
+    )
+    run = models.ForeignKey(
+        Run,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='budget_charges'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['user', 'kind'], name='core_budgetcharge_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.kind} {self.amount:+g} ({self.reason})'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Budget charges are append-only')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Budget charges are append-only')
+
+    @classmethod
+    def record(cls, user, kind, amount, run=None, job=None, reason=''):
+        if job is None and run is not None:
+            job = run.job
+        return cls.objects.create(user=user, kind=kind, amount=amount, run=run, job=job, reason=reason)
+
+
+def default_reservation_expiry():
+    return timezone.now() + timedelta(seconds=settings.BUDGET_RESERVATION_TTL)
+
+
+class BudgetReservation(models.Model):
+    """A hold on review or release budget while the work it pays for runs.
+
+    Placing a hold takes the amount out of the balance right away (with the
+    same conditional UPDATE as Budget.charge), so concurrent requests never
+    spend it twice and no lock is held while AWS does the work. The hold is
+    then settled into a charge when the work finishes or the hold expires,
+    or released back to the balance when the work definitely failed. Every transition is a conditional
+    UPDATE on the hold's status, so it happens exactly once.
+    """
+    HELD = 'held'
+    SETTLED = 'settled'
+    RELEASED = 'released'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (HELD, 'Held'),
+        (SETTLED, 'Settled'),
+        (RELEASED, 'Released'),
+        (EXPIRED, 'Expired'),
+    ]
+
+    # Status info the engine reports once a run's outputs are written
+    RUN_COMPLETED = 'completed'
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='budget_reservations'
+    )
+    kind = models.CharField(max_length=16, choices=[(Budget.REVIEW, 'Review'), (Budget.RELEASE, 'Release')])
+    amount = models.FloatField()
+    reason = models.CharField(max_length=16, choices=BudgetCharge.REASON_CHOICES, blank=True)
+    run = models.ForeignKey(
+        Run,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='budget_reservations'
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=HELD)
+    charged = models.FloatField(null=True, blank=True)
+    expires_at = models.DateTimeField(default=default_reservation_expiry)
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='core_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.kind} {self.amount:g} ({self.status})'
+
+    @classmethod
+    def hold(cls, user, kind, amount, run=None, reason=''):
+        """Take amount out of the user's budget until settled or released.
+
+        Raises InsufficientBudget.
+        """
+        with transaction.atomic():
+            Budget.charge(user, kind, amount, run=run, reason=BudgetCharge.HOLD)
+            return cls.objects.create(user=user, kind=kind, amount=amount, run=run, reason=reason)
+
+    def _resolve(self, status, charged=None):
+        """Move a held reservation to status; False if it was already resolved."""
+        now = timezone.now()
+        resolved = BudgetReservation.objects.filter(id=self.id, status=self.HELD).update(
+            status=status, charged=charged, resolved_at=now
+        )
+        if resolved:
+            self.status, self.charged, self.resolved_at = status, charged, now
+        return bool(resolved)
+
+    def settle(self, cost=None):
+        """Turn the hold into a charge of cost (the held amount by default).
+
+        A cost above the held amount charges the difference and raises
+        InsufficientBudget if the balance cannot cover it. Returns False if
+        the reservation was already resolved.
+        """
+        cost = self.amount if cost is None else cost
+        with transaction.atomic():
+            if not self._resolve(self.SETTLED, charged=cost):
+                return False
+            difference = self.amount - cost
+            if difference < 0:
+                updated = Budget.objects.filter(user=self.user_id, **{f'{self.kind}__gte': -difference}).update(
+                    **{self.kind: models.F(self.kind) + difference}
+                )
+                if not updated:
+                    record_budget_charge(self.kind, self.reason, 'insufficient')
+                    raise InsufficientBudget(f'Insufficient {self.kind} budget for a cost of {cost}')
+            elif difference > 0:
+                Budget.objects.filter(user=self.user_id).update(**{self.kind: models.F(self.kind) + difference})
+            Budget.invalidate_cache(self.user_id)
+            BudgetCharge.objects.bulk_create([
+                BudgetCharge(user_id=self.user_id, kind=self.kind, amount=self.amount,
+                             run_id=self.run_id, reason=BudgetCharge.HOLD_RELEASE),
+                BudgetCharge(user_id=self.user_id, kind=self.kind, amount=-cost,
+                             run_id=self.run_id, reason=self.reason),
+            ])
+            record_budget_charge(self.kind, self.reason, 'charged')
+        return True
+
+    def release(self, status=RELEASED):
+        """Give the held amount back; returns False if already resolved."""
+        with transaction.atomic():
+            if not self._resolve(status):
+                return False
+            Budget.credit(self.user, self.kind, self.amount, run=self.run, reason=BudgetCharge.HOLD_RELEASE)
+        return True
+
+    @classmethod
+    def resolve_for_run(cls, run):
+        """Settle or release the holds of a run the engine reported as done.
+
+        The engine reports {'ok', 'info', 'errormsg'}. ``ok: false`` releases
+        every hold of the run; ``info: 'completed'`` settles its refine holds
+        (release holds are settled by their release task). Holds of runs that
+        report neither are settled when they expire (see sweep_expired()), so
+        budget is never given back on a guess.
+        """
+        return cls.resolve_for_runs([run])
+
+    @classmethod
+    def resolve_for_runs(cls, runs):
+        """resolve_for_run() for many runs, with one query for their holds."""
+        succeeded = {}
+        for run in runs:
+            status = run.status or {}
+            if status.get('ok') is False:
+                succeeded[run.id] = False
+            elif status.get('info') == cls.RUN_COMPLETED:
+                succeeded[run.id] = True
+        if not succeeded:
+            return 0
+        resolved = 0
+        for reservation in cls.objects.filter(run__in=succeeded, status=cls.HELD):
+            if not succeeded[reservation.run_id]:
+                resolved += reservation.release()
+            elif reservation.reason == BudgetCharge.REFINE:
+                resolved += reservation.settle()
+        return resolved
+
+    @classmethod
+    def release_for_run(cls, run_id):
+        """Release every hold of a run whose work will not happen."""
+        return sum(reservation.release() for reservation in cls.objects.filter(run_id=run_id, status=cls.HELD))
+
+    @classmethod
+    def sweep_expired(cls, batch_size=500):
+        """Settle expired holds in bulk; returns how many were settled.
+
+        A hold that outlived BUDGET_RESERVATION_TTL without its run failing
+        is charged in full: the amount already left the balance when it was
+        placed, so only the hold and the ledger rows change. Each batch is
+        claimed with SKIP LOCKED and the ledger rows are bulk inserted.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            expired = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status=cls.HELD, expires_at__lte=now)
+                .order_by('expires_at')[:batch_size]
+            )
+            if not expired:
+                return 0
+            cls.objects.filter(id__in=[r.id for r in expired]).update(
+                status=cls.EXPIRED, charged=models.F('amount'), resolved_at=now
+            )
+
+            charges = []
+            for r in expired:
+                charges.append(BudgetCharge(user_id=r.user_id, kind=r.kind, amount=r.amount,
+                                            run_id=r.run_id, reason=BudgetCharge.HOLD_RELEASE))
+                charges.append(BudgetCharge(user_id=r.user_id, kind=r.kind, amount=-r.amount,
+                                            run_id=r.run_id, reason=r.reason))
+                record_budget_charge(r.kind, r.reason, 'expired')
+            BudgetCharge.objects.bulk_create(charges)
+        return len(expired)
@@ -0,0 +1,172 @@
+"""
+Dispatcher of the transactional outbox.
+
+Requests never call Step Functions or Lambda themselves; they add an
+OutboxMessage in the same transaction as the run that needs it and return.
+``manage.py dispatch_outbox`` drains the table:
+
+* a batch of due messages is claimed with ``SELECT ... FOR UPDATE SKIP
+  LOCKED`` and leased for ``OUTBOX_LEASE_SECONDS``, so several dispatchers
+  can run side by side and a crashed one only delays its batch,
+* the AWS calls of a batch run on a thread pool, outside of any transaction,
+* throttling, 5xx and connection errors are retried with exponential backoff
+  and jitter; other errors, or running out of attempts, dead-letter the
+  message for inspection in the admin.
+"""
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.aws import get_lambda_client, get_stepfunctions_client
+from core.models import BudgetReservation, OutboxMessage
+
+
+RETRYABLE_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+    'InternalFailure',
+    'InternalServerError',
+}
+
+
+def execution_name(payload):
+    """Name of the engine execution of a run.
+
+    Execution names are unique per state machine, so refine runs, which
+    share their job's id, get their run id appended; naming executions
+    after the job alone would refuse every run but the first.
+    """
+    return f"{payload['job_id']}-{payload['run_id']}"
+
+
+def send_engine(payload):
+    """Start the engine state machine for a run."""
+    try:
+        get_stepfunctions_client().start_execution(
+            stateMachineArn=settings.AWS_STEPFUNCTION,
+            name=execution_name(payload),
+            input=json.dumps(payload),
+        )
+    except ClientError as e:
+        # The name is the run's, so this run was already started by a
+        # previous attempt whose response was lost
+        if e.response['Error']['Code'] != 'ExecutionAlreadyExists':
+            raise
+
+
+def send_sanitizer(payload):
+    """Invoke the sanitizer lambda asynchronously."""
+    get_lambda_client().invoke(
+        FunctionName=settings.AWS_SANITIZER_LAMBDA,
+        Payload=json.dumps(payload).encode(),
+        InvocationType='Event',
+    )
+
+
+SENDERS = {
+    OutboxMessage.ENGINE: send_engine,
+    OutboxMessage.SANITIZER: send_sanitizer,
+}
+
+
+def is_retryable(error):
+    """Return True if sending again later may succeed."""
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        http_status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in RETRYABLE_ERROR_CODES or http_status >= 500
+    # Connection errors and timeouts
+    return isinstance(error, BotoCoreError)
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before the next attempt, with jitter."""
+    delay = min(settings.OUTBOX_BACKOFF_MAX, settings.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def claim_batch(batch_size):
+    """Lease the next due messages to this dispatcher."""
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutboxMessage.PENDING, available_at__lte=now)
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        for message in messages:
+            message.attempts += 1
+            message.available_at = now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+        OutboxMessage.objects.bulk_update(messages, ['attempts', 'available_at'])
+    return messages
+
+
+def deliver(message):
+    """Send one message; returns the error, or None on success."""
+    try:
+        SENDERS[message.kind](message.payload)
+    except Exception as e:  # classified by is_retryable
+        return e
+    return None
+
+
+def record_result(message, error, max_attempts):
+    """Mark a delivered message sent, or schedule its retry or dead-letter it."""
+    now = timezone.now()
+    if error is None:
+        message.status = OutboxMessage.SENT
+        message.sent_at = now
+        message.last_error = ''
+    else:
+        message.last_error = f'{type(error).__name__}: {error}'
+        if is_retryable(error) and message.attempts < max_attempts:
+            message.available_at = now + timedelta(seconds=backoff_delay(message.attempts))
+        else:
+            message.status = OutboxMessage.DEAD
+    message.save(update_fields=['status', 'sent_at', 'last_error', 'available_at'])
+
+    # The run will not be processed, so its budget holds are given back
+    if message.status == OutboxMessage.DEAD and message.run_id is not None:
+        BudgetReservation.release_for_run(message.run_id)
+
+
+def dispatch_batch(batch_size=None, concurrency=None, max_attempts=None):
+    """Claim and send one batch; returns counts of sent, retried and dead messages."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    concurrency = concurrency or settings.OUTBOX_CONCURRENCY
+    max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+
+    counts = {'claimed': 0, OutboxMessage.SENT: 0, OutboxMessage.PENDING: 0, OutboxMessage.DEAD: 0}
+    messages = claim_batch(batch_size)
+    if not messages:
+        return counts
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(messages))) as executor:
+        errors = list(executor.map(deliver, messages))
+
+    for message, error in zip(messages, errors):
+        record_result(message, error, max_attempts)
+        counts[message.status] += 1
+    counts['claimed'] = len(messages)
+    return counts
+
+
+def requeue_dead():
+    """Give every dead-lettered message a fresh set of attempts."""
+    return OutboxMessage.objects.filter(status=OutboxMessage.DEAD).update(
+        status=OutboxMessage.PENDING,
+        attempts=0,
+        available_at=timezone.now(),
+    )
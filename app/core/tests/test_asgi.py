@@ -0,0 +1,92 @@
+"""
+Tests for the streaming ASGI handler.
+"""
+import asyncio
+
+from asgiref.sync import async_to_sync
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase
+
+from core.asgi import AsyncStreamingHttpResponse, StreamingASGIHandler, _receive
+
+
+class StreamingASGIHandlerTests(SimpleTestCase):
+    """Test sending async streaming responses over ASGI."""
+
+    def send_response(self, response):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(StreamingASGIHandler().send_response)(response, send)
+        return messages
+
+    def test_async_streaming_response(self):
+        """Test every chunk of the async iterator is sent, then the end of the body."""
+        closed = []
+
+        async def content():
+            try:
+                yield b'analysis_id,epsilon\n'
+                yield b'1,0.5\n'
+            finally:
+                closed.append(True)
+
+        response = AsyncStreamingHttpResponse(content(), content_type='text/csv')
+        response['Content-Length'] = 26
+
+        messages = self.send_response(response)
+
+        self.assertEqual(messages[0]['type'], 'http.response.start')
+        self.assertIn((b'Content-Length', b'26'), messages[0]['headers'])
+        body = b''.join(m.get('body', b'') for m in messages[1:])
+        self.assertEqual(body, b'analysis_id,epsilon\n1,0.5\n')
+        self.assertFalse(messages[-1].get('more_body', False))
+        self.assertEqual(closed, [True])
+
+    def test_stops_when_client_disconnects(self):
+        """Test an endless stream is closed once the client goes away."""
+        closed = []
+        messages = []
+
+        async def content():
+            try:
+                while True:
+                    yield b': keepalive\n\n'
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.append(True)
+
+        async def send(message):
+            messages.append(message)
+
+        async def receive():
+            await asyncio.sleep(0.05)
+            return {'type': 'http.disconnect'}
+
+        async def serve():
+            _receive.set(receive)
+            response = AsyncStreamingHttpResponse(content(), content_type='text/event-stream')
+            await asyncio.wait_for(StreamingASGIHandler().send_response(response, send), timeout=5)
+
+        async_to_sync(serve)()
+
+        self.assertEqual(closed, [True])
+        self.assertGreater(len(messages), 2)
+
+    def test_other_responses_unchanged(self):
+        """Test regular responses are sent by Django's handler."""
+        messages = self.send_response(HttpResponse(b'ok'))
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(b''.join(m.get('body', b'') for m in messages[1:]), b'ok')
+
+    def test_cannot_iterate_synchronously(self):
+        """Test the response refuses to be served by a sync handler."""
+        async def content():
+            yield b''
+
+        with self.assertRaises(TypeError):
+            list(AsyncStreamingHttpResponse(content()))
@@ -0,0 +1,66 @@
+"""
+Tests for the shared AWS client registry.
+"""
+import threading
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core import aws
+
+
+class ClientRegistryTests(SimpleTestCase):
+    """Test the process-wide AWS client registry."""
+
+    def setUp(self):
+        aws.reset_clients()
+
+    def tearDown(self):
+        aws.reset_clients()
+
+    def test_client_is_reused(self):
+        """Test the same client is returned for repeated calls."""
+        first = aws.get_s3_client()
+        second = aws.get_s3_client()
+
+        self.assertIs(first, second)
+        stats = aws.client_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_clients_are_keyed_by_service_and_signature(self):
+        """Test different services and signature versions get their own client."""
+        s3 = aws.get_s3_client()
+        s3v4 = aws.get_s3_client(signature_version='s3v4')
+        lambda_client = aws.get_lambda_client()
+
+        self.assertIsNot(s3, s3v4)
+        self.assertIsNot(s3, lambda_client)
+        self.assertEqual(aws.client_stats()['clients'], 3)
+
+    def test_clients_rebuilt_after_fork(self):
+        """Test a forked process does not reuse its parent's clients."""
+        parent = aws.get_s3_client()
+
+        with patch('core.aws.os.getpid', return_value=-1):
+            child = aws.get_s3_client()
+
+        self.assertIsNot(parent, child)
+
+    def test_lookups_counted_across_threads(self):
+        """Test every lookup is counted when many threads look clients up at once."""
+        aws.get_s3_client()
+
+        def look_up():
+            for _ in range(2000):
+                aws.get_s3_client()
+
+        threads = [threading.Thread(target=look_up) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = aws.client_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 8 * 2000)
@@ -0,0 +1,211 @@
+"""
+Tests for budget charges and the budget ledger.
+"""
+from datetime import timedelta
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from budget.serializers import BudgetSerializer
+from core.models import Budget, BudgetCharge, BudgetReservation, InsufficientBudget, Job
+
+
+class BudgetLedgerTests(TestCase):
+    """Test charging budgets through the ledger."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+
+    def balances(self):
+        budget = Budget.objects.get(user=self.user)
+        return budget.review, budget.release
+
+    def test_new_user_ledger_matches_budget(self):
+        """Test a new budget starts with grants equal to its balances."""
+        self.assertEqual(self.balances(), (Budget.DEFAULT_REVIEW, Budget.DEFAULT_RELEASE))
+        self.assertEqual(
+            list(BudgetCharge.objects.filter(user=self.user).values_list('kind', 'amount', 'reason')),
+            [
+                (Budget.REVIEW, Budget.DEFAULT_REVIEW, BudgetCharge.GRANT),
+                (Budget.RELEASE, Budget.DEFAULT_RELEASE, BudgetCharge.GRANT),
+            ],
+        )
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_charge(self):
+        """Test a charge decrements the balance and appends a ledger row."""
+        job = Job.objects.create(user=self.user, title='Sample job', dataset_id='cps')
+        run = job.run_set.get()
+
+        Budget.charge(self.user, Budget.RELEASE, 2.5, run=run, reason=BudgetCharge.RELEASE)
+
+        self.assertEqual(self.balances(), (Budget.DEFAULT_REVIEW - 1, Budget.DEFAULT_RELEASE - 2.5))
+        charge = BudgetCharge.objects.filter(user=self.user).last()
+        self.assertEqual((charge.amount, charge.run, charge.job), (-2.5, run, job))
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_charge_over_budget(self):
+        """Test a charge larger than the balance changes nothing."""
+        ledger_size = BudgetCharge.objects.count()
+
+        with self.assertRaises(InsufficientBudget):
+            Budget.charge(self.user, Budget.REVIEW, Budget.DEFAULT_REVIEW + 1)
+
+        self.assertEqual(self.balances(), (Budget.DEFAULT_REVIEW, Budget.DEFAULT_RELEASE))
+        self.assertEqual(BudgetCharge.objects.count(), ledger_size)
+
+    def test_charge_to_zero(self):
+        """Test the whole balance can be spent."""
+        Budget.charge(self.user, Budget.REVIEW, Budget.DEFAULT_REVIEW)
+
+        self.assertEqual(self.balances()[0], 0)
+
+    def test_steward_update_is_an_adjustment(self):
+        """Test setting a balance records the difference in the ledger."""
+        budget = Budget.objects.get(user=self.user)
+        serializer = BudgetSerializer(budget, data={'release': 150}, partial=True)
+        serializer.is_valid(raise_exception=True)
+
+        serializer.save()
+
+        self.assertEqual(self.balances(), (Budget.DEFAULT_REVIEW, 150))
+        adjustment = BudgetCharge.objects.filter(user=self.user).last()
+        self.assertEqual((adjustment.kind, adjustment.amount), (Budget.RELEASE, 50))
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_reconcile_fixes_drift(self):
+        """Test reconcile reports and fixes balances changed outside the ledger."""
+        Budget.objects.filter(user=self.user).update(review=5)
+
+        mismatches = Budget.reconcile(fix=True)
+
+        self.assertEqual([(kind, balance, total) for _, kind, balance, total in mismatches], [
+            (Budget.REVIEW, 5, Budget.DEFAULT_REVIEW),
+        ])
+        self.assertEqual(self.balances()[0], Budget.DEFAULT_REVIEW)
+
+    def test_ledger_is_append_only(self):
+        """Test ledger rows cannot be changed or deleted."""
+        charge = BudgetCharge.objects.filter(user=self.user).first()
+
+        with self.assertRaises(ValueError):
+            charge.save()
+        with self.assertRaises(ValueError):
+            charge.delete()
+
+
+class BudgetReservationTests(TestCase):
+    """Test holding budget until the work it pays for is done."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.job = Job.objects.create(user=self.user, title='Sample job', dataset_id='cps')
+        self.run = self.job.run_set.get()
+
+    def release_balance(self):
+        return Budget.objects.get(user=self.user).release
+
+    def hold(self, amount=2):
+        return BudgetReservation.hold(
+            self.user, Budget.RELEASE, amount, run=self.run, reason=BudgetCharge.RELEASE
+        )
+
+    def test_hold_takes_amount_out_of_balance(self):
+        """Test a hold is spent right away and over budget holds fail."""
+        self.hold(2)
+
+        self.assertEqual(self.release_balance(), Budget.DEFAULT_RELEASE - 2)
+        with self.assertRaises(InsufficientBudget):
+            self.hold(Budget.DEFAULT_RELEASE)
+        self.assertEqual(BudgetReservation.objects.count(), 1)
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_settle(self):
+        """Test settling charges the final cost, below or above the hold."""
+        for cost in (2, 1.5, 3):
+            reservation = self.hold(2)
+            balance = self.release_balance() + 2
+
+            self.assertTrue(reservation.settle(cost))
+
+            self.assertEqual(self.release_balance(), balance - cost)
+            reservation.refresh_from_db()
+            self.assertEqual((reservation.status, reservation.charged), (BudgetReservation.SETTLED, cost))
+            self.assertFalse(reservation.settle(cost))
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_settle_over_budget(self):
+        """Test a cost the balance cannot cover leaves the hold in place."""
+        reservation = self.hold(2)
+
+        with self.assertRaises(InsufficientBudget):
+            reservation.settle(Budget.DEFAULT_RELEASE + 1)
+
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, BudgetReservation.HELD)
+        self.assertEqual(self.release_balance(), Budget.DEFAULT_RELEASE - 2)
+
+    def test_release_once(self):
+        """Test releasing gives the hold back exactly once."""
+        reservation = self.hold(2)
+
+        self.assertTrue(reservation.release())
+        self.assertFalse(reservation.release())
+        self.assertFalse(reservation.settle())
+
+        self.assertEqual(self.release_balance(), Budget.DEFAULT_RELEASE)
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_sweep_expired(self):
+        """Test the sweep charges expired holds only."""
+        expired = self.hold(1)
+        BudgetReservation.objects.filter(id=expired.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        current = self.hold(2)
+
+        self.assertEqual(BudgetReservation.sweep_expired(), 1)
+        self.assertEqual(BudgetReservation.sweep_expired(), 0)
+
+        expired.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual(expired.status, BudgetReservation.EXPIRED)
+        self.assertEqual(expired.charged, 1)
+        self.assertEqual(current.status, BudgetReservation.HELD)
+        self.assertEqual(self.release_balance(), Budget.DEFAULT_RELEASE - 3)
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_resolve_for_run(self):
+        """Test only an explicit failure gives the run's holds back."""
+        failed = self.hold(1)
+        self.run.status = {'ok': False, 'info': 'error', 'errormsg': 'boom'}
+        self.assertEqual(BudgetReservation.resolve_for_run(self.run), 1)
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, BudgetReservation.RELEASED)
+
+        pending = self.hold(2)
+        for info in ('running', 'completed', 'anything else'):
+            self.run.status = {'ok': True, 'info': info, 'errormsg': None}
+            self.assertEqual(BudgetReservation.resolve_for_run(self.run), 0)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, BudgetReservation.HELD)
+
+        self.assertEqual(self.release_balance(), Budget.DEFAULT_RELEASE - 2)
+        self.assertEqual(Budget.reconcile(), [])
+
+    def test_resolve_for_completed_run(self):
+        """Test a completed run settles its refine holds and keeps its release holds."""
+        review_before = Budget.objects.get(user=self.user).review
+        refine = BudgetReservation.hold(self.user, Budget.REVIEW, 3, run=self.run, reason=BudgetCharge.REFINE)
+        release = self.hold(1)
+
+        self.run.status = {'ok': True, 'info': 'completed', 'errormsg': None}
+        self.assertEqual(BudgetReservation.resolve_for_run(self.run), 1)
+        self.assertEqual(BudgetReservation.resolve_for_run(self.run), 0)
+
+        refine.refresh_from_db()
+        release.refresh_from_db()
+        self.assertEqual(refine.status, BudgetReservation.SETTLED)
+        self.assertEqual(refine.charged, 3)
+        self.assertEqual(release.status, BudgetReservation.HELD)
+        self.assertEqual(Budget.objects.get(user=self.user).review, review_before - 3)
+        self.assertEqual(Budget.reconcile(), [])
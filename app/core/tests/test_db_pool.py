@@ -0,0 +1,121 @@
+"""
+Tests for the database connection pool.
+"""
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core.db import pool as db_pool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def ping(connection):
+    return connection.alive
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Test checking connections in and out of a pool."""
+
+    def setUp(self):
+        self.pool = db_pool.ConnectionPool(max_size=2, max_idle=300, timeout=0.05, health_check_after=0)
+
+    def test_connection_is_reused(self):
+        """Test a returned connection is handed out again."""
+        first = self.pool.checkout(FakeConnection, ping)
+        self.pool.checkin(first)
+        second = self.pool.checkout(FakeConnection, ping)
+
+        self.assertIs(first, second)
+        stats = self.pool.snapshot()
+        self.assertEqual((stats['created'], stats['reused'], stats['size']), (1, 1, 1))
+
+    def test_dead_connection_replaced(self):
+        """Test a connection failing its health check is closed and replaced."""
+        first = self.pool.checkout(FakeConnection, ping)
+        self.pool.checkin(first)
+        first.alive = False
+
+        second = self.pool.checkout(FakeConnection, ping)
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        stats = self.pool.snapshot()
+        self.assertEqual((stats['health_check_failures'], stats['size']), (1, 1))
+
+    def test_recently_used_connection_not_pinged(self):
+        """Test connections returned moments ago skip the health check."""
+        self.pool.health_check_after = 60
+        first = self.pool.checkout(FakeConnection, ping)
+        self.pool.checkin(first)
+
+        with patch(__name__ + '.ping') as mock_ping:
+            self.assertIs(self.pool.checkout(FakeConnection, mock_ping), first)
+        mock_ping.assert_not_called()
+
+    def test_full_pool_times_out(self):
+        """Test checkouts beyond max_size wait and then fail."""
+        self.pool.checkout(FakeConnection, ping)
+        self.pool.checkout(FakeConnection, ping)
+
+        with self.assertRaises(db_pool.PoolTimeout):
+            self.pool.checkout(FakeConnection, ping)
+
+        stats = self.pool.snapshot()
+        self.assertEqual((stats['waits'], stats['timeouts']), (1, 1))
+        self.assertGreater(stats['wait_seconds'], 0)
+
+    def test_failed_connect_frees_slot(self):
+        """Test a connect error does not use up the pool."""
+        def fail():
+            raise db_pool.OperationalError('refused')
+
+        for _ in range(3):
+            with self.assertRaises(db_pool.OperationalError):
+                self.pool.checkout(fail, ping)
+
+        self.assertEqual(self.pool.snapshot()['size'], 0)
+
+    def test_idle_connections_reaped(self):
+        """Test connections idle longer than max_idle are closed."""
+        self.pool.max_idle = 0
+        first = self.pool.checkout(FakeConnection, ping)
+        self.pool.checkin(first)
+
+        second = self.pool.checkout(FakeConnection, ping)
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.pool.snapshot()['reaped'], 1)
+
+
+class PoolRegistryTests(SimpleTestCase):
+    """Test the per-process pool registry."""
+
+    def setUp(self):
+        db_pool.reset_pools()
+
+    def tearDown(self):
+        db_pool.reset_pools()
+
+    def test_pools_reset_after_fork(self):
+        """Test a forked process gets new pools and never closes the parent's connections."""
+        pool = db_pool.get_pool(('db', ()), {'MAX_SIZE': 1})
+        connection = pool.checkout(FakeConnection, ping)
+        pool.checkin(connection)
+        self.assertIs(db_pool.get_pool(('db', ()), {}), pool)
+
+        with patch('core.db.pool.os.getpid', return_value=-1):
+            child_pool = db_pool.get_pool(('db', ()), {'MAX_SIZE': 1})
+
+            self.assertIsNot(child_pool, pool)
+            self.assertIsNot(child_pool.checkout(FakeConnection, ping), connection)
+        self.assertFalse(connection.closed)
+        self.assertIn(connection, db_pool._inherited)
@@ -0,0 +1,159 @@
+"""
+Tests for the Prometheus metrics.
+"""
+import os
+import sys
+import tempfile
+import types
+from unittest import mock
+
+from botocore.stub import Stubber
+from prometheus_client import REGISTRY
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import aws, metrics
+from core.models import Budget, BudgetCharge, InsufficientBudget
+
+
+METRICS_URL = reverse('metrics')
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsEndpointTests(TestCase):
+    """Test the metrics endpoint and the request metrics."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+
+    def test_requires_token(self):
+        """Test scrapes need the metrics token, and the endpoint is off without one."""
+        res = self.client.get(METRICS_URL)
+        res2 = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer wrong')
+        with self.settings(METRICS_TOKEN=''):
+            res3 = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer ')
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res2.status_code, 401)
+        self.assertEqual(res3.status_code, 404)
+
+    def test_records_requests_by_view_and_action(self):
+        """Test a request is counted with its view, action, status and queries."""
+        labels = {'view': 'JobViewSet', 'action': 'list'}
+        before = sample('http_request_duration_seconds_count', method='GET', status='200', **labels)
+        queries_before = sample('http_request_db_queries_count', **labels)
+        self.client.force_authenticate(self.user)
+
+        self.client.get(reverse('job:job-list'))
+
+        self.assertEqual(sample('http_request_duration_seconds_count', method='GET', status='200', **labels), before + 1)
+        self.assertEqual(sample('http_request_db_queries_count', **labels), queries_before + 1)
+        self.assertGreater(sample('http_request_db_queries_sum', **labels), 0)
+
+    def test_exposition(self):
+        """Test the metrics are served in the Prometheus text format."""
+        # A request to be recorded, so the run order of the tests does not matter
+        self.client.get(METRICS_URL)
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'http_request_duration_seconds_bucket', res.content)
+        self.assertIn(b'budget_charges_total', res.content)
+
+    def test_in_process_stats_exported(self):
+        """Test the pool, AWS client and cache counters are copied in before a scrape."""
+        self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        hits = sample('aws_client_lookups_total', result='hit')
+
+        aws.get_s3_client()
+        aws.get_s3_client()
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertGreater(sample('aws_client_lookups_total', result='hit'), hits)
+        self.assertIn(b'aws_clients', res.content)
+        self.assertIn(b'auth_token_cache_lookups_total', res.content)
+
+    def test_budget_charges_counted(self):
+        """Test charges are counted by outcome."""
+        labels = {'kind': Budget.REVIEW, 'reason': BudgetCharge.REFINE}
+        charged = sample('budget_charges_total', result='charged', **labels)
+        insufficient = sample('budget_charges_total', result='insufficient', **labels)
+
+        Budget.charge(self.user, Budget.REVIEW, 1, reason=BudgetCharge.REFINE)
+        with self.assertRaises(InsufficientBudget):
+            Budget.charge(self.user, Budget.REVIEW, Budget.DEFAULT_REVIEW * 10, reason=BudgetCharge.REFINE)
+
+        self.assertEqual(sample('budget_charges_total', result='charged', **labels), charged + 1)
+        self.assertEqual(sample('budget_charges_total', result='insufficient', **labels), insufficient + 1)
+
+
+class AWSMetricsTests(SimpleTestCase):
+    """Test AWS calls of the shared clients are timed."""
+
+    def setUp(self):
+        aws.reset_clients()
+
+    def tearDown(self):
+        aws.reset_clients()
+
+    def test_calls_and_errors_recorded(self):
+        """Test latency is recorded for every call and errors by code."""
+        s3 = aws.get_s3_client()
+        labels = {'service': 's3', 'operation': 'HeadObject'}
+        calls = sample('aws_call_duration_seconds_count', **labels)
+        errors = sample('aws_call_errors_total', code='404', **labels)
+
+        with Stubber(s3) as stubber:
+            stubber.add_response('head_object', {'ContentLength': 1}, {'Bucket': 'b', 'Key': 'k'})
+            stubber.add_client_error('head_object', service_error_code='404', http_status_code=404)
+            s3.head_object(Bucket='b', Key='k')
+            with self.assertRaises(s3.exceptions.ClientError):
+                s3.head_object(Bucket='b', Key='k')
+
+        self.assertEqual(sample('aws_call_duration_seconds_count', **labels), calls + 2)
+        self.assertEqual(sample('aws_call_errors_total', code='404', **labels), errors + 1)
+
+
+class ExitHookTests(SimpleTestCase):
+    """Test dead workers are dropped from the live gauges."""
+
+    def test_uwsgi_worker_exit(self):
+        """Test uWSGI workers mark themselves dead through uwsgi.atexit, keeping an existing hook."""
+        previous = mock.Mock()
+        uwsgi = types.SimpleNamespace(atexit=previous)
+
+        with mock.patch.dict(sys.modules, {'uwsgi': uwsgi}), \
+                mock.patch.object(metrics.multiprocess, 'mark_process_dead') as mark_process_dead:
+            metrics._register_exit_hook()
+            uwsgi.atexit()
+
+        mark_process_dead.assert_called_once_with(os.getpid())
+        previous.assert_called_once_with()
+
+
+class ServicesCollectorTests(SimpleTestCase):
+    """Test a scrape adds up the samples of every service."""
+
+    def test_merges_every_directory(self):
+        """Test the sample files of this and the other services' directories are merged."""
+        with tempfile.TemporaryDirectory() as own, tempfile.TemporaryDirectory() as other:
+            files = [os.path.join(own, 'counter_7.db'), os.path.join(other, 'counter_7.db')]
+            for path in files:
+                open(path, 'wb').close()
+
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': own}), \
+                    self.settings(METRICS_SERVICE_DIRS=[other]), \
+                    mock.patch.object(metrics.multiprocess.MultiProcessCollector, 'merge', return_value=[]) as merge:
+                list(metrics.metrics_registry().collect())
+
+        merge.assert_called_once_with(files, accumulate=True)
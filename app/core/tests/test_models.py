@@ -3,12 +3,16 @@ Tests for models
 """
 from unittest.mock import patch
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.conf import settings
 
 from core import models
+from job.permissions import IsEngineUser, IsResearcher
 import json
 
 
@@ -102,6 +106,60 @@ class ModelTests(TestCase):
 
         self.assertEqual(run.job, job)
 
+    def test_run_ids_allocated_from_job_counter(self):
+        """Test run ids come from the job's counter in one statement."""
+        user = get_user_model().objects.create_user('test@example.com', 'testpass123')
+        job = models.Job.objects.create(user=user, title='Job title', dataset_id='cps')
+        self.assertEqual(job.run_set.get().run_id, 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            run = models.Run.objects.create(job=job)
+
+        # One UPDATE takes the id from the job's counter, whatever else the
+        # run's creation writes
+        counter_updates = [
+            q['sql'] for q in queries
+            if q['sql'].startswith('UPDATE') and 'next_run_id' in q['sql']
+        ]
+        self.assertEqual(len(counter_updates), 1, counter_updates)
+
+        self.assertEqual(run.run_id, 2)
+        self.assertEqual(models.Run.objects.create(job=job).run_id, 3)
+        job.refresh_from_db()
+        self.assertEqual(job.next_run_id, 4)
+
+    def test_job_save_keeps_run_counter(self):
+        """Test saving a stale job object does not rewind its run counter."""
+        user = get_user_model().objects.create_user('test@example.com', 'testpass123')
+        job = models.Job.objects.create(user=user, title='Job title', dataset_id='cps')
+        stale = models.Job.objects.get(id=job.id)
+        models.Run.objects.create(job=job)
+
+        stale.title = 'New title'
+        stale.save()
+
+        self.assertEqual(models.Run.objects.create(job=job).run_id, 3)
+
+    def test_status_changes_recorded(self):
+        """Test a status event is recorded when a job or run is created or its status changes."""
+        user = get_user_model().objects.create_user('test@example.com', 'testpass123')
+        job = models.Job.objects.create(user=user, title='Job title', dataset_id='cps')
+        run = models.Run.objects.get(job=job)
+
+        run.save()
+        run.status = {'ok': True, 'info': 'running', 'errormsg': None}
+        run.save()
+        loaded = models.Job.objects.get(id=job.id)
+        loaded.status['info'] = 'completed'
+        loaded.save()
+
+        events = list(models.StatusEvent.objects.values_list('job_id', 'run__run_id', 'status'))
+        self.assertEqual(events, [
+            (job.id, None, models.default_job_status()),
+            (job.id, 1, {}),
+            (job.id, 1, {'ok': True, 'info': 'running', 'errormsg': None}),
+            (job.id, None, {'ok': True, 'info': 'completed', 'errormsg': None}),
+        ])
 
     def test_create_user_creates_budget(self):
         """Creating a new user creates an associated budget instance."""
@@ -115,3 +173,57 @@ class ModelTests(TestCase):
         self.assertNotEqual(budget.count(), 0)
         self.assertEqual(budget[0].review, models.Budget.DEFAULT_REVIEW)
         self.assertEqual(budget[0].release, models.Budget.DEFAULT_RELEASE)
+
+
+class GroupNamesTests(TestCase):
+    """Test the cached group names of users."""
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.engine = Group.objects.create(name='engine')
+
+    def fresh_user(self):
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def test_group_names_resolved_once(self):
+        """Test group names cost one query, then none in any request."""
+        with self.assertNumQueries(1):
+            self.assertEqual(self.user.group_names, frozenset(['researcher']))
+            self.assertTrue(self.user.in_group('researcher'))
+            self.assertFalse(self.user.in_group('engine'))
+
+        user = self.fresh_user()
+        request = type('Request', (), {'user': user, 'method': 'POST'})()
+        with self.assertNumQueries(0):
+            self.assertTrue(IsResearcher().has_permission(request, None))
+            self.assertFalse(IsEngineUser().has_permission(request, None))
+
+    def test_adding_group_invalidates(self):
+        """Test changes from either side of the relation are seen."""
+        self.assertFalse(self.user.in_group('engine'))
+
+        self.user.groups.add(self.engine)
+        self.assertTrue(self.user.in_group('engine'))
+        self.assertTrue(self.fresh_user().in_group('engine'))
+
+        self.engine.users.remove(self.user)
+        self.assertFalse(self.fresh_user().in_group('engine'))
+
+        self.engine.users.add(self.user)
+        self.engine.users.clear()
+        self.assertFalse(self.fresh_user().in_group('engine'))
+
+    def test_deleting_group_invalidates(self):
+        """Test members of a deleted group are no longer in it."""
+        self.user.groups.add(self.engine)
+        self.assertTrue(self.fresh_user().in_group('engine'))
+
+        self.engine.delete()
+
+        self.assertFalse(self.fresh_user().in_group('engine'))
+
+    def test_anonymous_user_in_no_group(self):
+        """Test anonymous users are in no group."""
+        from django.contrib.auth.models import AnonymousUser
+
+        self.assertFalse(models.in_group(AnonymousUser(), 'researcher'))
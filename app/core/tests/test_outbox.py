@@ -0,0 +1,137 @@
+"""
+Tests for the outbox and its dispatcher.
+"""
+import json
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from core import aws, outbox
+from core.models import Job, OutboxMessage
+
+
+def client_error(code, http_status=400):
+    return ClientError(
+        {'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': http_status}},
+        'StartExecution',
+    )
+
+
+class OutboxTests(TestCase):
+    """Test engine submissions go through the outbox."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.senders = patch.dict(outbox.SENDERS, {OutboxMessage.ENGINE: self.send})
+        self.senders.start()
+        self.sent = []
+        self.errors = []
+
+    def tearDown(self):
+        self.senders.stop()
+
+    def send(self, payload):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(payload)
+
+    def create_job(self):
+        return Job.objects.create(user=self.user, title='Sample job', dataset_id='cps')
+
+    def test_creating_job_queues_engine(self):
+        """Test a new job records its engine submission without calling AWS."""
+        with patch('core.aws.get_client') as get_client:
+            job = self.create_job()
+
+        get_client.assert_not_called()
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.kind, OutboxMessage.ENGINE)
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.payload['job_id'], str(job.id))
+        self.assertEqual(message.payload['run_id'], 1)
+
+    @override_settings(AWS_STEPFUNCTION='arn:aws:states:us-east-1:123456789012:stateMachine:engine')
+    def test_engine_execution_per_run(self):
+        """Test each run gets its own execution and starting it again is not an error."""
+        aws.reset_clients()
+        self.addCleanup(aws.reset_clients)
+        sfn = aws.get_stepfunctions_client()
+        payload = {'job_id': 'a1b2', 'run_id': 2}
+
+        with Stubber(sfn) as stubber:
+            stubber.add_response(
+                'start_execution',
+                {'executionArn': 'arn:aws:states:us-east-1:123456789012:execution:engine:a1b2-2',
+                 'startDate': timezone.now()},
+                {'stateMachineArn': 'arn:aws:states:us-east-1:123456789012:stateMachine:engine',
+                 'name': 'a1b2-2', 'input': json.dumps(payload)},
+            )
+            stubber.add_client_error('start_execution', service_error_code='ExecutionAlreadyExists')
+            outbox.send_engine(payload)
+            outbox.send_engine(payload)
+            stubber.assert_no_pending_responses()
+
+    def test_dispatch_sends_pending(self):
+        """Test the dispatcher sends pending messages once."""
+        job = self.create_job()
+
+        counts = outbox.dispatch_batch()
+        outbox.dispatch_batch()
+
+        self.assertEqual(counts['sent'], 1)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0]['job_id'], str(job.id))
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.SENT)
+        self.assertEqual(message.attempts, 1)
+
+    def test_retryable_error_backs_off(self):
+        """Test throttling and connection errors are retried later."""
+        self.create_job()
+        self.errors = [client_error('ThrottlingException')]
+
+        counts = outbox.dispatch_batch()
+
+        self.assertEqual(counts['pending'], 1)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertGreater(message.available_at, timezone.now())
+        self.assertIn('ThrottlingException', message.last_error)
+        # Not due yet
+        self.assertEqual(outbox.dispatch_batch()['claimed'], 0)
+
+        OutboxMessage.objects.update(available_at=timezone.now())
+        self.errors = [EndpointConnectionError(endpoint_url='https://states')]
+        self.assertEqual(outbox.dispatch_batch()['pending'], 1)
+
+        OutboxMessage.objects.update(available_at=timezone.now())
+        self.assertEqual(outbox.dispatch_batch()['sent'], 1)
+        self.assertEqual(OutboxMessage.objects.get().attempts, 3)
+
+    def test_permanent_error_dead_letters(self):
+        """Test errors that cannot succeed later are dead-lettered at once."""
+        self.create_job()
+        self.errors = [client_error('ValidationException')]
+
+        counts = outbox.dispatch_batch()
+
+        self.assertEqual(counts['dead'], 1)
+        self.assertEqual(OutboxMessage.objects.get().status, OutboxMessage.DEAD)
+
+    def test_dead_letter_after_max_attempts(self):
+        """Test a message is dead-lettered once it runs out of attempts."""
+        self.create_job()
+        self.errors = [client_error('InternalFailure', 500), client_error('InternalFailure', 500)]
+
+        outbox.dispatch_batch(max_attempts=2)
+        OutboxMessage.objects.update(available_at=timezone.now())
+        counts = outbox.dispatch_batch(max_attempts=2)
+
+        self.assertEqual(counts['dead'], 1)
+        self.assertEqual(outbox.requeue_dead(), 1)
+        self.assertEqual(outbox.dispatch_batch()['sent'], 1)
@@ -0,0 +1,406 @@
+"""
+Async versions of the S3-bound run actions, served by the ASGI app.
+
+Under uWSGI every S3 read in RunViewSet holds a whole worker process. These
+views do their S3 I/O with aiobotocore on the event loop, so one uvicorn
+worker can relay hundreds of downloads at once. nginx sends only these
+routes to the ASGI app (``RESULTS_ASYNC_VIEWS`` adds them to job/urls.py);
+everything else stays on the DRF views under uWSGI.
+
+Django 4.0 has no async ORM, so queries go through ``sync_to_async`` (on the
+thread shared by sync code). CPU-bound work on pandas/pyarrow and the disk
+I/O of the result cache run on worker threads of their own. Requests for
+``?format=parquet|arrow`` and for ``release?async=true`` are rare, so they
+are handed to the sync DRF views. A release follows job.tasks release_run(),
+with its download and upload on the event loop and only the budget and
+status updates on the sync thread.
+"""
+import functools
+import itertools
+import json
+import os
+import tempfile
+
+from asgiref.sync import sync_to_async
+from botocore.exceptions import ClientError
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, JsonResponse
+
+from rest_framework import exceptions as drf_exceptions, status
+
+from core.asgi import AsyncStreamingHttpResponse
+from core.aws_async import get_async_s3_client
+from core.conditional import is_conditional, not_modified, set_validators, timestamp
+from core.models import AnalysisSummary, Budget, BudgetCharge, InsufficientBudget, Run
+from job import columnar, serializers
+from job.cache import get_result_cache
+from job.results import ReleaseFilter, summarize_analyses_parquet, write_parquet
+from job.tasks import mark_released
+from job.util import (
+    cached_file_response,
+    released_output_key,
+    result_etag,
+    sanitized_output_key,
+    x_accel_s3_response,
+)
+from users.authentication import CachedTokenAuthentication
+
+
+@sync_to_async
+def authenticate(request):
+    """Return the user of the request's knox token, or None."""
+    try:
+        result = CachedTokenAuthentication().authenticate(request)
+    except drf_exceptions.AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+@sync_to_async
+def get_run(user, jobs_pk, run_id):
+    """Return a run visible to the user (all runs for the engine), or None."""
+    try:
+        runs = Run.objects.filter(job=jobs_pk, run_id=run_id).select_related('job')
+        if not user.in_group('engine'):
+            runs = runs.filter(job__user=user)
+        return runs.first()
+    except (ValidationError, ValueError):
+        return None
+
+
+def run_action(*methods):
+    """Authenticate the request and look up the run like RunViewSet does."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, jobs_pk, run_id):
+            if request.method not in methods:
+                return JsonResponse(
+                    {'detail': f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                )
+            user = await authenticate(request)
+            if user is None:
+                response = JsonResponse(
+                    {'detail': 'Authentication credentials were not provided.'},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
+                response['WWW-Authenticate'] = 'Token'
+                return response
+            run = await get_run(user, jobs_pk, run_id)
+            if run is None:
+                return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+            request.user = user
+            return await view(request, run)
+
+        # Token authenticated, like the DRF views
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+async def sync_action(action, request, run):
+    """Serve a request with the sync RunViewSet action."""
+    from job.views import RunViewSet
+
+    view = RunViewSet.as_view({request.method.lower(): action})
+    return await sync_to_async(view)(request, jobs_pk=str(run.job_id), run_id=run.run_id)
+
+
+async def iter_async_body(body, chunk_size=None):
+    """Yield the bytes of an aiobotocore streaming body in chunks."""
+    if chunk_size is None:
+        chunk_size = settings.RESULTS_CHUNK_SIZE
+    try:
+        async for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+async def stream_s3_object(file_key, content_type='text/csv'):
+    """Relay an object from S3 without blocking the event loop.
+
+    Raises botocore ClientError if the object cannot be retrieved.
+    """
+    s3 = await get_async_s3_client()
+    obj = await s3.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file_key)
+
+    response = AsyncStreamingHttpResponse(iter_async_body(obj['Body']), content_type=content_type)
+    response['Content-Length'] = obj['ContentLength']
+    response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_key)}"'
+    return set_validators(response, result_etag(obj['ETag']), timestamp(obj.get('LastModified')))
+
+
+def _cache_get(file_key):
+    cache = get_result_cache()
+    return cache.get(settings.AWS_STORAGE_BUCKET_NAME, file_key) if cache is not None else None
+
+
+async def cache_get(file_key):
+    """Look an object up in the result cache on a worker thread."""
+    return await sync_to_async(_cache_get, thread_sensitive=False)(file_key)
+
+
+async def iter_file(f, chunk_size=None):
+    """Yield the content of an open file, reading on a worker thread."""
+    if chunk_size is None:
+        chunk_size = settings.RESULTS_CHUNK_SIZE
+    read = sync_to_async(f.read, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        f.close()
+
+
+async def cached_result_response(cached, filename):
+    """Async counterpart of job.util.cached_file_response."""
+    if settings.RESULTS_X_ACCEL_REDIRECT:
+        return cached_file_response(cached, filename)
+    f = await sync_to_async(cached.open, thread_sensitive=False)()
+    response = AsyncStreamingHttpResponse(iter_file(f), content_type='text/csv')
+    response['Content-Length'] = os.fstat(f.fileno()).st_size
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return set_validators(response, result_etag(cached.etag))
+
+
+async def not_modified_result(request, file_key, cacheable=False):
+    """Async counterpart of RunViewSet._not_modified_result."""
+    if not is_conditional(request):
+        return None
+    cached = await cache_get(file_key) if cacheable else None
+    if cached is not None:
+        etag, last_modified = result_etag(cached.etag), None
+    else:
+        s3 = await get_async_s3_client()
+        obj = await s3.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file_key)
+        etag, last_modified = result_etag(obj['ETag']), timestamp(obj['LastModified'])
+    return not_modified(request, etag, last_modified)
+
+
+async def result_download_response(file_key, cacheable=False):
+    """Async counterpart of job.util.result_download_response.
+
+    A cache miss is relayed from S3 rather than filled, since filling the
+    cache downloads synchronously.
+    """
+    cached = await cache_get(file_key) if cacheable else None
+    if cached is not None:
+        try:
+            return await cached_result_response(cached, os.path.basename(file_key))
+        except FileNotFoundError:
+            pass  # evicted by another process; relayed from S3 instead
+    if settings.RESULTS_X_ACCEL_REDIRECT:
+        return x_accel_s3_response(file_key)
+    return await stream_s3_object(file_key)
+
+
+async def download_file(file_key, path):
+    """Download an object to a local file."""
+    s3 = await get_async_s3_client()
+    obj = await s3.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file_key)
+    with open(path, 'wb') as f:
+        async for chunk in iter_async_body(obj['Body']):
+            f.write(chunk)
+
+
+async def upload_file(path, file_key, content_type):
+    """Upload a local file, in parts of RESULTS_UPLOAD_PART_SIZE if it is large."""
+    s3 = await get_async_s3_client()
+    bucket = settings.AWS_STORAGE_BUCKET_NAME
+    part_size = settings.RESULTS_UPLOAD_PART_SIZE
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= part_size:
+            await s3.put_object(Bucket=bucket, Key=file_key, Body=f.read(), ContentType=content_type)
+            return
+
+        upload_id = (await s3.create_multipart_upload(
+            Bucket=bucket,
+            Key=file_key,
+            ContentType=content_type,
+        ))['UploadId']
+        parts = []
+        try:
+            for part_number in itertools.count(1):
+                data = f.read(part_size)
+                if not data:
+                    break
+                response = await s3.upload_part(
+                    Bucket=bucket,
+                    Key=file_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                )
+                parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+            await s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=file_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except BaseException:
+            await s3.abort_multipart_upload(Bucket=bucket, Key=file_key, UploadId=upload_id)
+            raise
+
+
+async def open_local_source(file_key, tmpdir):
+    """Return a sanitized output opened from local disk, from the cache if possible."""
+    cached = await cache_get(file_key)
+    if cached is not None:
+        try:
+            return await sync_to_async(cached.open, thread_sensitive=False)()
+        except FileNotFoundError:
+            pass  # evicted by another process
+    path = os.path.join(tmpdir, os.path.basename(file_key))
+    await download_file(file_key, path)
+    return open(path, 'rb')
+
+
+def _write_parquet_file(source, path):
+    with source:
+        return write_parquet(source, path)
+
+
+async def summarize_run(run):
+    """Sum epsilon by analysis over the sidecar of a run, writing it if needed."""
+    file_key = sanitized_output_key(run.job_id, run.run_id)
+    key = columnar.sidecar_key(file_key)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, os.path.basename(key))
+        try:
+            await download_file(key, path)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in columnar.NOT_FOUND_CODES:
+                raise
+            source = await open_local_source(file_key, tmpdir)
+            await sync_to_async(_write_parquet_file, thread_sensitive=False)(source, path)
+            await upload_file(path, key, columnar.PARQUET_CONTENT_TYPE)
+        return await sync_to_async(summarize_analyses_parquet, thread_sensitive=False)(path)
+
+
+@run_action('GET')
+async def get_csv_results(request, run):
+    """Async get-csv-results."""
+    if request.GET.get('format'):
+        return await sync_action('get_csv_results', request, run)
+    file_key = sanitized_output_key(run.job_id, run.run_id)
+    try:
+        response = await not_modified_result(request, file_key, cacheable=True)
+        if response is not None:
+            return response
+        return await result_download_response(file_key, cacheable=True)
+    except ClientError as e:
+        return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
+
+
+@run_action('GET')
+async def get_released_csv_results(request, run):
+    """Async get-released-csv-results."""
+    if request.GET.get('format'):
+        return await sync_action('get_released_csv_results', request, run)
+    file_key = released_output_key(run.job_id, run.run_id)
+    try:
+        response = await not_modified_result(request, file_key)
+        if response is not None:
+            return response
+        return await result_download_response(file_key)
+    except ClientError as e:
+        return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
+
+
+@run_action('GET')
+async def get_analyses(request, run):
+    """Async get-analyses."""
+    analyses = await sync_to_async(list)(AnalysisSummary.objects.filter(run=run))
+    if not analyses:
+        try:
+            summaries = await summarize_run(run)
+        except ClientError as e:
+            return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
+        analyses = await sync_to_async(
+            lambda: list(AnalysisSummary.create_for_run(run, summaries))
+        )()
+
+    data = serializers.AnalysisSummarySerializer(analyses, many=True).data
+    return JsonResponse(data, safe=False)
+
+
+def _write_released(source, released_ids, path):
+    """Write the released rows of a sanitized output to a file; return their cost."""
+    released_rows = ReleaseFilter(source, released_ids)
+    with source, open(path, 'wb') as f:
+        for chunk in released_rows:
+            f.write(chunk)
+    return released_rows.cost
+
+
+async def delete_sidecar(file_key):
+    """Async counterpart of job.columnar.delete_sidecar."""
+    s3 = await get_async_s3_client()
+    await s3.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=columnar.sidecar_key(file_key))
+
+
+async def release_run(run, user, released_ids):
+    """Async counterpart of job.tasks.release_run.
+
+    The released rows are filtered to a local file on a worker thread, the
+    user is charged, and the file is uploaded; the charge is refunded if the
+    upload fails. Raises InsufficientBudget, in which case nothing is
+    written, or botocore ClientError.
+    """
+    file_key = sanitized_output_key(run.job_id, run.run_id)
+    output_file_key = released_output_key(run.job_id, run.run_id)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = await open_local_source(file_key, tmpdir)
+        path = os.path.join(tmpdir, os.path.basename(output_file_key))
+        cost = await sync_to_async(_write_released, thread_sensitive=False)(source, released_ids, path)
+
+        # Charge user; fails if the release budget is too small
+        await sync_to_async(Budget.charge)(user, Budget.RELEASE, cost, run=run, reason=BudgetCharge.RELEASE)
+
+        # Write released CSV to S3
+        try:
+            await upload_file(path, output_file_key, 'text/csv')
+        except BaseException:
+            await sync_to_async(Budget.credit)(user, Budget.RELEASE, cost, run=run, reason=BudgetCharge.REFUND)
+            raise
+
+    # Its sidecar is rebuilt on next use
+    await delete_sidecar(output_file_key)
+
+    await sync_to_async(mark_released)(run)
+    return cost
+
+
+@run_action('POST')
+async def release(request, run):
+    """Async release."""
+    if request.GET.get('async', '').lower() in ('1', 'true'):
+        return await sync_action('release', request, run)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error.'}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = serializers.ReleaseRequestSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        await release_run(run, request.user, serializer.validated_data['analysis_ids'])
+    except InsufficientBudget:
+        return JsonResponse({'error': 'Insufficient budget'}, status=status.HTTP_403_FORBIDDEN)
+    except ClientError as e:
+        return HttpResponse(f"Error writing file: {str(e)}", status=500)
+
+    file_key = sanitized_output_key(run.job_id, run.run_id)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_key)}"'
+    return response
@@ -0,0 +1,73 @@
+"""
+Bulk run status updates from the engine.
+
+RunViewSet.partial_update costs a request, a lookup and a full-row save per
+run. The engine sends its statuses in batches instead: the runs are read
+with one query, written with one bulk_update and their status events are
+inserted with one bulk_create, all in one transaction.
+"""
+import functools
+import operator
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import BudgetReservation, Run, StatusEvent
+from job.serializers import RunStatusUpdateSerializer
+
+
+def update_run_statuses(updates):
+    """Apply a list of {job_id, run_id, status} updates; return a result per update.
+
+    Invalid updates and unknown runs are reported in their result and do
+    not stop the others. When a run is updated twice the last status wins.
+    """
+    results = [None] * len(updates)
+    valid = []
+    for index, update in enumerate(updates):
+        serializer = RunStatusUpdateSerializer(data=update)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {
+                'job_id': update.get('job_id'),
+                'run_id': update.get('run_id'),
+                'ok': False,
+                'errors': serializer.errors,
+            }
+
+    with transaction.atomic():
+        runs = {}
+        if valid:
+            # Locked so that statuses and their events stay in the same order.
+            # Only the named (job, run) pairs: two IN lists would also lock
+            # every other run of those jobs with those run ids
+            pairs = {(data['job_id'], data['run_id']) for _, data in valid}
+            queryset = Run.objects.filter(
+                functools.reduce(operator.or_, (Q(job_id=job_id, run_id=run_id) for job_id, run_id in pairs))
+            ).only('id', 'job', 'run_id', 'status', 'created_at').select_for_update()
+            runs = {(run.job_id, run.run_id): run for run in queryset}
+
+        now = timezone.now()
+        updated = {}
+        for index, data in valid:
+            result = {'job_id': data['job_id'].hex, 'run_id': data['run_id']}
+            run = runs.get((data['job_id'], data['run_id']))
+            if run is None:
+                results[index] = dict(result, ok=False, errors={'detail': 'Not found.'})
+                continue
+            run.status = data['status']
+            # bulk_update does not apply auto_now, which versions the run's ETag
+            run.created_at = now
+            updated[run.id] = run
+            results[index] = dict(result, ok=True)
+
+        if updated:
+            updated = list(updated.values())
+            Run.objects.bulk_update(updated, ['status', 'created_at'])
+            StatusEvent.record_many(updated)
+            # A failed run gives its budget holds back
+            BudgetReservation.resolve_for_runs(updated)
+
+    return results
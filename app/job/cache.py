@@ -0,0 +1,273 @@
+"""
+Local disk cache for run outputs stored in S3.
+
+The sanitized output of a run is written once by the sanitizer and then read
+by several actions in quick succession (download, get-analyses, release).
+Only such immutable objects (sanitized outputs and their sidecars) may go
+through the cache: an entry is named after the ETag the object had when it
+was downloaded, but it is never revalidated against S3, so an object that
+is overwritten would keep being served from the old copy until evicted.
+
+Entries live in a single directory that is shared by every uWSGI worker on
+the host:
+
+* downloads go to a temporary file that is atomically renamed into place,
+* a per-key ``flock`` makes concurrent misses for the same object wait for
+  the first download instead of fetching it again,
+* the least recently used entries (by mtime, bumped on every hit) are evicted
+  once the directory grows past ``RESULTS_CACHE_MAX_BYTES``,
+* readers map files with ``mmap`` so the page cache is shared between workers.
+
+Another process may evict an entry at any time. A file that is already open
+stays readable; opening one that is gone raises FileNotFoundError, which
+callers treat as a miss.
+"""
+import contextlib
+import fcntl
+import glob
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import threading
+
+from django.conf import settings
+
+from core.aws import get_s3_client
+
+
+class CachedObject:
+    """A cached S3 object on local disk."""
+
+    def __init__(self, path, etag):
+        self.path = path
+        self.etag = etag
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def open(self):
+        """Open the cached file for binary reading."""
+        return open(self.path, 'rb')
+
+    def _map(self):
+        """Open and map the file read-only; returns (file, mmap or None if empty)."""
+        f = self.open()
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                return f, None
+            return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            f.close()
+            raise
+
+    @contextlib.contextmanager
+    def mmap(self):
+        """Map the cached file read-only; yields None for empty files."""
+        f, mm = self._map()
+        try:
+            yield mm
+        finally:
+            if mm is not None:
+                mm.close()
+            f.close()
+
+    def iter_chunks(self, chunk_size=None):
+        """Return an iterator over the content of the file in fixed-size chunks.
+
+        The file is opened right away, so an evicted entry raises
+        FileNotFoundError here rather than in the middle of a response.
+        """
+        if chunk_size is None:
+            chunk_size = settings.RESULTS_CHUNK_SIZE
+        return self._chunks(*self._map(), chunk_size)
+
+    @staticmethod
+    def _chunks(f, mm, chunk_size):
+        try:
+            if mm is None:
+                return
+            for start in range(0, len(mm), chunk_size):
+                yield mm[start:start + chunk_size]
+        finally:
+            if mm is not None:
+                mm.close()
+            f.close()
+
+    def iter_lines(self):
+        """Yield the decoded lines of the file without line endings."""
+        with self.mmap() as mm:
+            if mm is None:
+                return
+            for line in iter(mm.readline, b''):
+                yield line.decode('utf-8').rstrip('\r\n')
+
+
+class ResultCache:
+    """Read-through LRU cache of S3 objects in a local directory."""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    def stats(self):
+        """Return hit/miss/eviction counters for this process."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def _prefix(bucket, key):
+        return hashlib.sha256(f'{bucket}\0{key}'.encode()).hexdigest()[:40]
+
+    def _entry_path(self, bucket, key, etag):
+        clean_etag = re.sub(r'[^A-Za-z0-9]', '', etag)
+        extension = os.path.splitext(key)[1]
+        return os.path.join(self.root, f'{self._prefix(bucket, key)}-{clean_etag}{extension}')
+
+    def _entries_for(self, bucket, key):
+        return glob.glob(os.path.join(self.root, f'{self._prefix(bucket, key)}-*'))
+
+    @contextlib.contextmanager
+    def _lock(self, name, blocking=True):
+        """Hold an exclusive flock shared by all processes on this host."""
+        fd = os.open(os.path.join(self.root, f'.{name}.lock'), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(fd, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _lookup(self, bucket, key):
+        for path in self._entries_for(bucket, key):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                continue  # evicted by another process
+            etag = os.path.splitext(os.path.basename(path))[0].rsplit('-', 1)[1]
+            return CachedObject(path, etag)
+        return None
+
+    def get(self, bucket, key):
+        """Return the cached object, or None without downloading it."""
+        cached = self._lookup(bucket, key)
+        self._count('hits' if cached is not None else 'misses')
+        return cached
+
+    def fetch(self, bucket, key):
+        """Return the cached object, downloading it from S3 on a miss.
+
+        Raises botocore ClientError if the object cannot be retrieved.
+        """
+        cached = self._lookup(bucket, key)
+        if cached is not None:
+            self._count('hits')
+            return cached
+
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock(self._prefix(bucket, key)):
+            # Another process may have filled the entry while we waited
+            cached = self._lookup(bucket, key)
+            if cached is not None:
+                self._count('hits')
+                return cached
+
+            self._count('misses')
+            obj = get_s3_client().get_object(Bucket=bucket, Key=key)
+            path = self._entry_path(bucket, key, obj['ETag'])
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in obj['Body'].iter_chunks(settings.RESULTS_CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(tmp_path, path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(tmp_path)
+                raise
+            finally:
+                obj['Body'].close()
+
+        self.evict(keep=path)
+        return CachedObject(path, obj['ETag'])
+
+    def open(self, bucket, key, opener=None):
+        """Fetch an object and return its entry opened with opener(path).
+
+        By default the entry is opened for binary reading. An entry evicted
+        by another process between the lookup and the open is downloaded
+        again. Raises botocore ClientError if the object cannot be retrieved.
+        """
+        def open_entry():
+            path = self.fetch(bucket, key).path
+            return opener(path) if opener is not None else open(path, 'rb')
+
+        try:
+            return open_entry()
+        except FileNotFoundError:
+            return open_entry()
+
+    def invalidate(self, bucket, key):
+        """Drop every cached version of an object."""
+        for path in self._entries_for(bucket, key):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits its cap."""
+        with self._lock('evict', blocking=False) as locked:
+            if not locked:
+                return  # another process is already evicting
+            entries = []
+            total = 0
+            for entry in os.scandir(self.root):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+            entries.sort()
+            evicted = 0
+            for mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                    evicted += 1
+                total -= size
+            if evicted:
+                self._count('evictions', evicted)
+
+
+_cache = None
+
+
+def get_result_cache():
+    """Return the process-wide result cache, or None if it is disabled."""
+    global _cache
+    if not settings.RESULTS_CACHE_ENABLED:
+        return None
+    if _cache is None or _cache.root != settings.RESULTS_CACHE_DIR:
+        _cache = ResultCache(settings.RESULTS_CACHE_DIR, settings.RESULTS_CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,113 @@
+"""
+Columnar sidecars of run outputs.
+
+Each output CSV ``submissions/<job>/<name>.csv`` gets a zstd-compressed
+Parquet copy ``submissions/<job>/<name>.parquet``, written the first time it
+is needed. Computations that only need a few columns read them from the
+sidecar, and clients can download it, or an Arrow IPC stream built from it,
+with ``?format=parquet`` / ``?format=arrow``.
+"""
+import contextlib
+import io
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from core.aws import get_s3_client
+from job.cache import get_result_cache
+from job.results import write_parquet
+from job.util import open_result_object, result_download_response
+
+
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+ARROW_STREAM_CONTENT_TYPE = 'application/vnd.apache.arrow.stream'
+
+NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+
+def sidecar_key(file_key):
+    """S3 key of the Parquet sidecar of an output CSV."""
+    return f'{os.path.splitext(file_key)[0]}.parquet'
+
+
+def ensure_sidecar(file_key, cacheable=False):
+    """Return the key of the sidecar of an output CSV, writing it if needed.
+
+    Raises botocore ClientError if the CSV cannot be retrieved.
+    """
+    s3 = get_s3_client()
+    bucket = settings.AWS_STORAGE_BUCKET_NAME
+    key = sidecar_key(file_key)
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return key
+    except ClientError as e:
+        if e.response['Error']['Code'] not in NOT_FOUND_CODES:
+            raise
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, os.path.basename(key))
+        with contextlib.closing(open_result_object(file_key, cacheable)) as source:
+            write_parquet(source, path)
+        s3.upload_file(path, bucket, key, ExtraArgs={'ContentType': PARQUET_CONTENT_TYPE})
+    return key
+
+
+def delete_sidecar(file_key):
+    """Delete the sidecar of an output CSV that is about to change."""
+    get_s3_client().delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=sidecar_key(file_key))
+
+
+@contextlib.contextmanager
+def local_sidecar(file_key, cacheable=False):
+    """Yield the sidecar of an output CSV as a memory-mapped pyarrow file.
+
+    The mapping stays valid if the cache evicts the file meanwhile.
+    """
+    key = ensure_sidecar(file_key, cacheable)
+    cache = get_result_cache() if cacheable else None
+    if cache is not None:
+        with cache.open(settings.AWS_STORAGE_BUCKET_NAME, key, opener=pa.memory_map) as source:
+            yield source
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, os.path.basename(key))
+        get_s3_client().download_file(settings.AWS_STORAGE_BUCKET_NAME, key, path)
+        with pa.memory_map(path) as source:
+            yield source
+
+
+def parquet_download_response(file_key, cacheable=False):
+    """Return the download response for the sidecar of an output CSV."""
+    key = ensure_sidecar(file_key, cacheable)
+    return result_download_response(key, cacheable, content_type=PARQUET_CONTENT_TYPE)
+
+
+def iter_arrow_stream(file_key, cacheable=False):
+    """Yield the sidecar of an output CSV as an Arrow IPC stream."""
+    with local_sidecar(file_key, cacheable) as source:
+        parquet_file = pq.ParquetFile(source)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, parquet_file.schema_arrow) as writer:
+            for batch in parquet_file.iter_batches():
+                writer.write_batch(batch)
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+        yield sink.getvalue()
+
+
+def arrow_stream_response(file_key, cacheable=False):
+    """Return an Arrow IPC stream of an output CSV."""
+    ensure_sidecar(file_key, cacheable)
+    filename = f'{os.path.splitext(os.path.basename(file_key))[0]}.arrows'
+    response = StreamingHttpResponse(iter_arrow_stream(file_key, cacheable), content_type=ARROW_STREAM_CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
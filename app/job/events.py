@@ -0,0 +1,285 @@
+"""
+Server-Sent Events stream of the status changes of a job and its runs.
+
+Every saved status change is a StatusEvent row (see core/models.py). Each
+ASGI worker runs one poller per event loop that reads the events recorded
+since its last poll, one query every EVENTS_POLL_INTERVAL however many
+clients are connected, and hands them to the queues of the subscribers of
+their job. An idle subscriber is a coroutine waiting on its queue, so a
+worker holds thousands of them; the poller stops when the last one leaves.
+
+Clients authenticate with their knox token or, since a browser
+EventSource cannot send headers, with ``?token=`` set to a token from
+POST /api/jobs/<id>/events-token/.
+
+Event ids are the StatusEvent ids. A client that reconnects with
+Last-Event-ID is sent the events it missed; a new client first gets a
+snapshot of the job and its runs.
+"""
+import asyncio
+import json
+import time
+import uuid
+import weakref
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Q
+from django.http import JsonResponse
+
+from rest_framework import status
+
+from core.asgi import AsyncStreamingHttpResponse
+from core.models import Job, Run, StatusEvent
+from job.async_views import authenticate
+from users.authentication import verify_stream_token
+
+
+EVENT_FIELDS = ('id', 'job_id', 'run__run_id', 'status', 'created_at')
+
+
+def format_event(event_type, data, event_id=None):
+    """Encode one event in the text/event-stream format."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def format_status_event(event):
+    """Encode a StatusEvent row (EVENT_FIELDS values) as a job or run event."""
+    data = {'job_id': str(event['job_id']), 'status': event['status'], 'created_at': event['created_at']}
+    if event['run__run_id'] is None:
+        return format_event('job', data, event['id'])
+    data['run_id'] = event['run__run_id']
+    return format_event('run', data, event['id'])
+
+
+class EventHub:
+    """Fans the StatusEvents of all jobs out to the subscribers of one event loop.
+
+    Ids are allocated when an event is inserted but become visible when its
+    transaction commits, so a poll can see id n + 1 before n. Ids skipped
+    by a poll are asked for again until EVENTS_GAP_TIMEOUT has passed (a
+    rolled back insert leaves a gap for good).
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.last_id = None
+        self.gaps = {}
+        self.task = None
+        self.started = asyncio.Event()
+
+    def subscribe(self, job_id):
+        """Return a new queue of the events of a job."""
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault(job_id, set()).add(queue)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        queues = self.subscribers.get(job_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[job_id]
+
+    async def wait_started(self):
+        """Wait until events are being followed.
+
+        Everything recorded after this returns is dispatched.
+        """
+        await self.started.wait()
+
+    async def run(self):
+        try:
+            while self.subscribers:
+                try:
+                    events = await sync_to_async(self.fetch)()
+                except Exception:
+                    # Keep the streams open through a database hiccup
+                    events = []
+                if self.last_id is not None:
+                    self.started.set()
+                self.dispatch(events)
+                await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+        finally:
+            self.task = None
+            self.last_id = None
+            self.gaps.clear()
+            self.started = asyncio.Event()
+
+    def fetch(self):
+        """Return the events recorded since the last poll."""
+        if self.last_id is None:
+            # Subscribers get the events from their first poll on
+            self.last_id = StatusEvent.objects.aggregate(last=Max('id'))['last'] or 0
+            return []
+
+        now = time.monotonic()
+        self.gaps = {gap: deadline for gap, deadline in self.gaps.items() if deadline > now}
+        query = Q(id__gt=self.last_id)
+        if self.gaps:
+            query |= Q(id__in=list(self.gaps))
+        events = list(
+            StatusEvent.objects.filter(query).order_by('id').values(*EVENT_FIELDS)[:settings.EVENTS_BATCH_SIZE]
+        )
+
+        for event in events:
+            self.gaps.pop(event['id'], None)
+            if event['id'] > self.last_id:
+                deadline = now + settings.EVENTS_GAP_TIMEOUT
+                self.gaps.update((gap, deadline) for gap in range(self.last_id + 1, event['id']))
+                self.last_id = event['id']
+        return events
+
+    def dispatch(self, events):
+        for event in events:
+            for queue in list(self.subscribers.get(event['job_id'], ())):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # A client that cannot keep up reconnects with Last-Event-ID
+                    self.unsubscribe(event['job_id'], queue)
+                    queue.overflowed = True
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    """Return the hub of the running event loop."""
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = EventHub()
+    return hub
+
+
+def job_scope(pk):
+    """Return the stream token scope of a job id from the URL."""
+    try:
+        return uuid.UUID(pk).hex
+    except ValueError:
+        return ''
+
+
+@sync_to_async
+def get_job(user, pk):
+    """Return a job visible to the user (all jobs for the engine), or None."""
+    try:
+        jobs = Job.objects.filter(id=pk)
+        if not user.in_group('engine'):
+            jobs = jobs.filter(user=user)
+        return jobs.first()
+    except (ValidationError, ValueError):
+        return None
+
+
+@sync_to_async
+def initial_events(job, last_event_id):
+    """Return the first events of a stream.
+
+    The events after last_event_id, or a snapshot of the job and its runs.
+    """
+    if last_event_id is not None:
+        events = StatusEvent.objects.filter(job=job, id__gt=last_event_id).order_by('id')
+        events = events.values(*EVENT_FIELDS)[:settings.EVENTS_REPLAY_LIMIT]
+        return [(event['id'], format_status_event(event)) for event in events]
+
+    latest = job.status_events.aggregate(last=Max('id'))['last']
+    snapshot = {
+        'job_id': str(job.id),
+        'status': Job.objects.filter(id=job.id).values_list('status', flat=True).first(),
+        'runs': [
+            {'run_id': run_id, 'status': run_status}
+            for run_id, run_status in Run.objects.filter(job=job).values_list('run_id', 'status')
+        ],
+    }
+    return [(None, format_event('snapshot', snapshot, latest))]
+
+
+async def event_stream(hub, job_id, queue, initial):
+    """Yield the initial events, then the job's events as they arrive."""
+    try:
+        yield f'retry: {settings.EVENTS_RETRY_MS}\n\n'.encode()
+        sent = set()
+        for event_id, event in initial:
+            sent.add(event_id)
+            yield event
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if getattr(queue, 'overflowed', False):
+                    return
+                # Keeps proxies from closing an idle connection
+                yield b': keepalive\n\n'
+                continue
+            if event['id'] not in sent:
+                yield format_status_event(event)
+            if getattr(queue, 'overflowed', False) and queue.empty():
+                return
+    finally:
+        hub.unsubscribe(job_id, queue)
+
+
+async def job_events(request, pk):
+    """Stream the status changes of a job and its runs as Server-Sent Events."""
+    if request.method != 'GET':
+        return JsonResponse(
+            {'detail': f'Method "{request.method}" not allowed.'},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+    token = request.GET.get('token')
+    if token:
+        user = await sync_to_async(verify_stream_token)(token, job_scope(pk))
+    else:
+        user = await authenticate(request)
+    if user is None:
+        response = JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+        response['WWW-Authenticate'] = 'Token'
+        return response
+    job = await get_job(user, pk)
+    if job is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            last_event_id = None
+
+    # Subscribe first so that nothing saved meanwhile is missed
+    hub = get_hub()
+    queue = hub.subscribe(job.id)
+    try:
+        await hub.wait_started()
+        initial = await initial_events(job, last_event_id)
+    except BaseException:
+        hub.unsubscribe(job.id, queue)
+        raise
+
+    response = AsyncStreamingHttpResponse(
+        event_stream(hub, job.id, queue, initial),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Token authenticated, like the DRF views
+job_events.csrf_exempt = True
@@ -0,0 +1,57 @@
+"""
+Incremental feed of job and run changes for the engine.
+
+The cursor is the id of the last StatusEvent (see core/models.py) the
+engine has read. Every created job and run and every status change is one
+event, so a poll reads at most a batch of events from the primary key
+index and the current state of the jobs and runs they touch; its cost
+follows the rate of change instead of the size of the tables.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import Job, Run, StatusEvent
+
+
+def read_feed(after, limit):
+    """Return the jobs and runs changed after the cursor, and the next cursor.
+
+    A job is returned when it or its status changed, a run when it or its
+    status changed; a run's change does not return its job.
+
+    Ids are allocated on insert but become visible on commit, so a batch
+    ends before a missing id while the event after it is younger than
+    FEED_GAP_TIMEOUT; the missing event is read by a later poll. An older
+    gap is a rolled back or deleted event and is skipped.
+    """
+    events = list(
+        StatusEvent.objects.filter(id__gt=after).order_by('id')
+        .values_list('id', 'job_id', 'run_id', 'created_at')[:limit]
+    )
+    horizon = timezone.now() - timedelta(seconds=settings.FEED_GAP_TIMEOUT)
+
+    cursor = after
+    job_ids, run_ids = set(), set()
+    more = len(events) == limit
+    for event_id, job_id, run_id, created_at in events:
+        if event_id != cursor + 1 and created_at > horizon:
+            more = True
+            break
+        cursor = event_id
+        if run_id is None:
+            job_ids.add(job_id)
+        else:
+            run_ids.add(run_id)
+
+    jobs = Job.objects.filter(id__in=job_ids).values('id', 'status', 'dataset_id', 'script', 'max_epsilon')
+    runs = Run.objects.filter(id__in=run_ids).values(
+        'job_id', 'run_id', 'status', 'epsilons', 'compute_sensitivities'
+    )
+    return {
+        'cursor': cursor,
+        'more': more,
+        'jobs': [dict(job, id=job['id'].hex) for job in jobs],
+        'runs': [dict(run, job_id=run['job_id'].hex) for run in runs],
+    }
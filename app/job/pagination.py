@@ -0,0 +1,19 @@
+"""
+Cursor pagination for job and run listings.
+"""
+from django.conf import settings
+
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """Newest first, by (created_at, id).
+
+    Each page is one range scan on the (user, created_at) and
+    (job, created_at) indexes, however deep the client pages, unlike
+    OFFSET-based pages. Clients pass ?page_size= and follow ``next``.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = settings.LIST_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.LIST_MAX_PAGE_SIZE
@@ -3,6 +3,8 @@ Custom permissions.
 """
 from rest_framework import permissions
 
+from core.models import in_group
+
 class IsEngineOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
         # Allow safe methods (GET, OPTIONS, HEAD) for any user
@@ -10,25 +12,25 @@ class IsEngineOrReadOnly(permissions.BasePermission):
             return True
 
         # Only allow the admin to modify the field
-        return request.user.groups.filter(name='engine').exists()
+        return in_group(request.user, 'engine')
 
 
 class IsAdminUser(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='admin').exists()
+        return in_group(request.user, 'admin')
 
 class IsDeveloper(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='developer').exists()
+        return in_group(request.user, 'developer')
 
 class IsResearcher(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='researcher').exists()
+        return in_group(request.user, 'researcher')
 
 class IsDataSteward(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='datasteward').exists()
+        return in_group(request.user, 'datasteward')
 
 class IsEngineUser(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='engine').exists()
\ No newline at end of file
+        return in_group(request.user, 'engine')
@@ -0,0 +1,31 @@
+"""
+Renderers for the binary result formats of the run APIs.
+
+The actions that use them return ready-made HttpResponses; the renderers only
+let DRF's content negotiation accept ``?format=parquet`` and ``?format=arrow``.
+"""
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+
+from job.columnar import PARQUET_CONTENT_TYPE, ARROW_STREAM_CONTENT_TYPE
+
+
+class ParquetRenderer(renderers.BaseRenderer):
+    media_type = PARQUET_CONTENT_TYPE
+    format = 'parquet'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class ArrowStreamRenderer(ParquetRenderer):
+    media_type = ARROW_STREAM_CONTENT_TYPE
+    format = 'arrow'
+
+
+RESULT_RENDERER_CLASSES = list(api_settings.DEFAULT_RENDERER_CLASSES) + [
+    ParquetRenderer,
+    ArrowStreamRenderer,
+]
@@ -0,0 +1,221 @@
+"""
+Processing of the sanitized output CSVs produced by the engine.
+
+Outputs are parsed with the pandas C parser, a bounded number of rows at a
+time, so quoted fields are handled correctly, the per-row work happens in
+vectorized operations, and memory stays flat for outputs of any size.
+``source`` is a binary file-like object such as an S3 streaming body or a
+file from the local result cache.
+"""
+import csv
+import io
+from itertools import compress
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from pandas.errors import EmptyDataError
+
+
+DEFAULT_CHUNK_ROWS = 100_000
+DEFAULT_BLOCK_SIZE = 8 * 1024 ** 2
+
+SUMMARY_COLUMNS = ['analysis_id', 'analysis_name', 'epsilon']
+
+COLUMN_TYPES = {
+    'analysis_id': 'category',
+    'analysis_name': 'category',
+    'epsilon': 'float64',
+}
+
+
+def read_sanitized_output(source, columns, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Return an iterator of typed DataFrame chunks with the given columns."""
+    try:
+        return pd.read_csv(
+            source,
+            usecols=columns,
+            dtype={column: COLUMN_TYPES.get(column, str) for column in columns},
+            keep_default_na=False,
+            chunksize=chunk_rows,
+        )
+    except EmptyDataError:
+        return iter(())
+
+
+def summarize_analyses(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Sum epsilon by analysis_id over a sanitized output.
+
+    Returns a list of dicts with analysis_id, analysis_name, epsilon_sum and
+    row_count, in order of first appearance.
+    """
+    return _summarize_chunks(read_sanitized_output(source, SUMMARY_COLUMNS, chunk_rows))
+
+
+def summarize_analyses_parquet(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Sum epsilon by analysis_id over the Parquet sidecar of an output.
+
+    source is a path (which is memory-mapped) or an open file. Only the
+    needed columns are read; the result is the same as for
+    summarize_analyses.
+    """
+    parquet_file = pq.ParquetFile(source, memory_map=True)
+    chunks = (
+        batch.to_pandas()
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=SUMMARY_COLUMNS)
+    )
+    return _summarize_chunks(chunks)
+
+
+def _summarize_chunks(chunks):
+    sums = []
+    names = []
+    for chunk in chunks:
+        sums.append(chunk.groupby('analysis_id', sort=False, observed=True)['epsilon'].agg(['sum', 'size']))
+        names.append(chunk.drop_duplicates('analysis_id')[['analysis_id', 'analysis_name']])
+    if not sums:
+        return []
+
+    totals = pd.concat(sums).groupby(level=0, sort=False, observed=True).sum()
+    first_names = pd.concat(names).drop_duplicates('analysis_id').set_index('analysis_id')['analysis_name']
+    return [
+        {
+            "analysis_id": str(analysis_id),
+            "analysis_name": str(first_names[analysis_id]),
+            "epsilon_sum": float(epsilon_sum),
+            "row_count": int(row_count),
+        }
+        for analysis_id, epsilon_sum, row_count in zip(totals.index, totals['sum'], totals['size'])
+    ]
+
+
+def write_parquet(source, path, block_size=DEFAULT_BLOCK_SIZE):
+    """Convert a sanitized output CSV into a compressed Parquet file.
+
+    epsilon is stored as float64 and every other column as text, so values
+    survive the round trip unchanged. Returns the number of rows written.
+    """
+    blocks = iter_record_blocks(source, block_size)
+    header_line = next(blocks, b'')
+    header = next(csv.reader([header_line.decode('utf-8')]), [])
+    schema = pa.schema([
+        (column, pa.float64() if column == 'epsilon' else pa.string())
+        for column in header
+    ])
+    read_options = pa_csv.ReadOptions(column_names=header)
+    convert_options = pa_csv.ConvertOptions(
+        column_types=schema,
+        strings_can_be_null=False,
+        quoted_strings_can_be_null=False,
+    )
+
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for block in blocks:
+            if not block.strip():
+                continue
+            table = pa_csv.read_csv(
+                pa.BufferReader(block),
+                read_options=read_options,
+                convert_options=convert_options,
+            )
+            writer.write_table(table)
+            rows += table.num_rows
+    return rows
+
+
+def iter_record_blocks(source, block_size=DEFAULT_BLOCK_SIZE):
+    """Split a CSV stream into its header line and blocks of whole records.
+
+    Blocks end at a newline outside of quotes, so each one can be parsed on
+    its own. Yields the header line first, then the blocks.
+    """
+    pending = b''
+    header = None
+    while True:
+        data = source.read(block_size)
+        pending += data
+        if header is None:
+            end = pending.find(b'\n')
+            if end < 0 and data:
+                continue
+            header, pending = (pending, b'') if end < 0 else (pending[:end + 1], pending[end + 1:])
+            yield header
+
+        if not data:
+            if pending:
+                yield pending
+            return
+
+        cut = pending.rfind(b'\n')
+        # A newline inside a quoted field is not a record boundary
+        while cut >= 0 and pending.count(b'"', 0, cut) % 2:
+            cut = pending.rfind(b'\n', 0, cut)
+        if cut >= 0:
+            yield pending[:cut + 1]
+            pending = pending[cut + 1:]
+
+
+class ReleaseFilter:
+    """Stream the rows of a sanitized output that belong to released analyses.
+
+    Iterating yields the header and every row whose analysis_id is in
+    ``released_ids`` as encoded CSV, one block at a time. Only analysis_id and
+    epsilon are parsed; the selected records are copied through byte for byte
+    (or rewritten with the csv module when a block contains quoted fields or
+    blank lines). The epsilon of the yielded rows is added to ``cost`` as they
+    go by, so the total is known once the iteration is done.
+    """
+
+    def __init__(self, source, released_ids, block_size=DEFAULT_BLOCK_SIZE):
+        self.source = source
+        self.released_ids = np.array(sorted({int(analysis_id) for analysis_id in released_ids}), dtype='int64')
+        self.block_size = block_size
+        self.cost = 0
+        self.row_count = 0
+
+    def __iter__(self):
+        blocks = iter_record_blocks(self.source, self.block_size)
+        header_line = next(blocks, b'')
+        if not header_line.strip():
+            return
+        header = next(csv.reader([header_line.decode('utf-8')]))
+        yield header_line if header_line.endswith(b'\n') else header_line + b'\n'
+
+        for block in blocks:
+            released = self._filter_block(header, block)
+            if released:
+                yield released
+
+    def _filter_block(self, header, block):
+        try:
+            records = pd.read_csv(
+                io.BytesIO(block),
+                header=None,
+                names=header,
+                usecols=['analysis_id', 'epsilon'],
+                dtype={'analysis_id': 'int64', 'epsilon': 'float64'},
+            )
+        except EmptyDataError:
+            return b''
+        mask = records['analysis_id'].isin(self.released_ids).to_numpy()
+        self.cost += float(records['epsilon'].to_numpy()[mask].sum())
+        self.row_count += int(mask.sum())
+        if not mask.any():
+            return b''
+
+        lines = block.split(b'\n')
+        if lines[-1] == b'':
+            lines.pop()
+        if b'"' not in block and len(lines) == len(records):
+            # One line per record: copy the selected lines as they are
+            return b'\n'.join(compress(lines, mask)) + b'\n'
+
+        rows = pd.read_csv(io.BytesIO(block), header=None, names=header, dtype=str, keep_default_na=False)
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(
+            zip(*(rows[column].to_numpy()[mask].tolist() for column in header))
+        )
+        return buffer.getvalue().encode('utf-8')
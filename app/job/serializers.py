@@ -5,7 +5,7 @@ from rest_framework import serializers
 
 from django.conf import settings
 
-from core.models import Job, Run, Budget
+from core.models import Job, Run, Budget, AnalysisSummary, ReleaseTask
 from .permissions import IsEngineOrReadOnly
 
 
@@ -103,6 +103,50 @@ class RunDetailSerializer(RunSerializer):
 
 
 
+class RunStatusUpdateSerializer(serializers.Serializer):
+    """One run status reported by the engine."""
+    job_id = serializers.UUIDField()
+    run_id = serializers.IntegerField(min_value=1)
+    status = serializers.DictField()
+
+
+class BulkRunStatusSerializer(serializers.Serializer):
+    """A batch of run statuses; each update is validated on its own."""
+    updates = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.BULK_STATUS_MAX_UPDATES,
+    )
+
+
+class AnalysisSummarySerializer(serializers.ModelSerializer):
+    """Serializer for the analyses of a run."""
+
+    class Meta:
+        model = AnalysisSummary
+        fields = ['analysis_id', 'analysis_name', 'epsilon_sum']
+        read_only_fields = fields
+
+
+class ReleaseRequestSerializer(serializers.Serializer):
+    analysis_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class ReleaseTaskSerializer(serializers.ModelSerializer):
+    """Serializer for background releases."""
+    url = serializers.HyperlinkedIdentityField(view_name='job:releasetask-detail')
+    job_id = serializers.UUIDField(source='run.job_id', read_only=True)
+    run_id = serializers.IntegerField(source='run.run_id', read_only=True)
+
+    class Meta:
+        model = ReleaseTask
+        fields = [
+            'id', 'url', 'job_id', 'run_id', 'analysis_ids', 'status', 'progress',
+            'reserved_cost', 'charged_cost', 'error', 'created_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+
 class RefineReleaseStatisticSerializer(serializers.Serializer):
     statistic_id = serializers.IntegerField()
     epsilon = serializers.FloatField()
@@ -0,0 +1,191 @@
+"""
+Release of run outputs, inline or on a local worker pool.
+
+A release streams the selected rows of the sanitized output to S3, charges
+the user and marks the run and job released. Large outputs take longer than
+the uWSGI/nginx timeouts allow, so the release API can instead record a
+ReleaseTask (with a BudgetReservation holding the expected cost) and hand
+it to a small thread pool in the same process. Clients poll the
+task for its progress and the final charge.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from core.models import Job, Budget, BudgetCharge, InsufficientBudget, ReleaseTask
+from job import columnar
+from job.results import ReleaseFilter
+from job.util import S3MultipartUpload, open_sanitized_output, released_output_key
+
+
+RELEASED_STATUS = {'ok': True, 'info': 'released', 'errormsg': None}
+
+
+def release_run(run, user, released_ids, on_progress=None, reservation=None):
+    """Release the selected analyses of a run and return the charged cost.
+
+    ``on_progress`` is called with the number of rows released so far after
+    every uploaded block. The user is charged before the upload is completed
+    (by settling ``reservation`` if one is given) and refunded if completing
+    it fails. Raises InsufficientBudget, in which case nothing is written, or
+    botocore ClientError.
+    """
+    job_id = run.job_id
+    sanitized_output = open_sanitized_output(job_id, run.run_id)
+    try:
+        # Stream the released rows to S3 while computing the cost to release
+        output_file_key = released_output_key(job_id, run.run_id)
+        released_rows = ReleaseFilter(sanitized_output, released_ids)
+        upload = S3MultipartUpload(output_file_key)
+        try:
+            for chunk in released_rows:
+                upload.write(chunk)
+                if on_progress is not None:
+                    on_progress(released_rows.row_count)
+            cost = released_rows.cost
+
+            # Charge user; fails if the release budget is too small. A hold
+            # given back meanwhile (see ReleaseTask.fail_stale) is charged afresh
+            if reservation is None or not reservation.settle(cost):
+                Budget.charge(user, Budget.RELEASE, cost, run=run, reason=BudgetCharge.RELEASE)
+        except BaseException:
+            upload.abort()
+            raise
+
+        # Write released CSV to S3
+        try:
+            upload.complete()
+        except BaseException:
+            Budget.credit(user, Budget.RELEASE, cost, run=run, reason=BudgetCharge.REFUND)
+            upload.abort()
+            raise
+    finally:
+        sanitized_output.close()
+
+    # Its sidecar is rebuilt on next use
+    columnar.delete_sidecar(output_file_key)
+
+    mark_released(run)
+    return cost
+
+
+def mark_released(run):
+    """Mark a run and its job released."""
+    # Update run status to "released"
+    run.status = dict(RELEASED_STATUS)
+    run.save()
+
+    # Update job status to "released"
+    job = Job.objects.get(id=run.job_id)
+    job.status = dict(RELEASED_STATUS)
+    job.save()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_release_pool():
+    """Return this process's release worker pool, created on first use."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Threads do not survive a fork (uWSGI prefork)
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.RELEASE_WORKERS,
+                thread_name_prefix='release',
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def submit_release_task(task_id):
+    """Queue a release task on the worker pool.
+
+    With RELEASE_WORKERS = 0 the task runs in the caller, which is what the
+    tests use.
+    """
+    if not settings.RELEASE_WORKERS:
+        run_release_task(task_id)
+        return None
+    return get_release_pool().submit(_run_in_worker, task_id)
+
+
+def _run_in_worker(task_id):
+    # Worker threads get their own database connection
+    close_old_connections()
+    try:
+        run_release_task(task_id)
+    finally:
+        connection.close()
+
+
+class ProgressRecorder:
+    """Save the progress of a task at most every RELEASE_PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, task, expected_rows):
+        self.task = task
+        self.expected_rows = expected_rows
+        self.last_saved = 0
+
+    def __call__(self, rows):
+        now = time.monotonic()
+        if now - self.last_saved < settings.RELEASE_PROGRESS_INTERVAL:
+            return
+        self.last_saved = now
+        # updated_at is also the heartbeat ReleaseTask.fail_stale goes by
+        fields = {'updated_at': timezone.now()}
+        if self.expected_rows:
+            fields['progress'] = min(rows / self.expected_rows, 1.0)
+        ReleaseTask.objects.filter(id=self.task.id).update(**fields)
+
+
+def run_release_task(task_id):
+    """Process one queued release task."""
+    # Claimed with a conditional update, so a task failed as stale is not run
+    claimed = ReleaseTask.objects.filter(id=task_id, status=ReleaseTask.QUEUED).update(
+        status=ReleaseTask.RUNNING, updated_at=timezone.now()
+    )
+    if not claimed:
+        return
+    task = ReleaseTask.objects.select_related('run', 'user', 'reservation').get(id=task_id)
+    expected_rows = sum(
+        task.run.analyses.filter(analysis_id__in=[str(i) for i in task.analysis_ids])
+        .values_list('row_count', flat=True)
+    )
+
+    try:
+        cost = release_run(
+            task.run,
+            task.user,
+            task.analysis_ids,
+            ProgressRecorder(task, expected_rows),
+            reservation=task.reservation,
+        )
+    except InsufficientBudget:
+        task.status = ReleaseTask.FAILED
+        task.error = 'Insufficient budget'
+    except ClientError as e:
+        task.status = ReleaseTask.FAILED
+        task.error = f'Error writing file: {str(e)}'
+    except Exception as e:
+        task.status = ReleaseTask.FAILED
+        task.error = f'{type(e).__name__}: {e}'
+    else:
+        task.status = ReleaseTask.SUCCEEDED
+        task.progress = 1.0
+        task.charged_cost = cost
+    finally:
+        # A failed release gives back whatever is still held
+        if task.status == ReleaseTask.FAILED and task.reservation is not None:
+            task.reservation.release()
+        task.finished_at = timezone.now()
+        task.save(update_fields=['status', 'progress', 'charged_cost', 'error', 'finished_at', 'updated_at'])
@@ -0,0 +1,120 @@
+"""
+Tests for the async run actions.
+"""
+import io
+import json
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+
+from django.test import TestCase, RequestFactory
+
+from knox.models import AuthToken
+from rest_framework import status
+
+from core.models import Budget, Run, AnalysisSummary
+from job import async_views
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+class AsyncRunActionTests(TestCase):
+    """Test authentication and lookups of the async run actions."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.job = create_job(user=self.user)
+        self.run = Run.objects.filter(job=self.job).first()
+        _, self.token = AuthToken.objects.create(self.user)
+
+    def get(self, view, job_id, run_id, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = self.factory.get('/', **headers)
+        return async_to_sync(view)(request, jobs_pk=str(job_id), run_id=str(run_id))
+
+    def test_requires_token(self):
+        """Test requests without a valid token are rejected."""
+        res = self.get(async_views.get_analyses, self.job.id, self.run.run_id)
+        res2 = self.get(async_views.get_analyses, self.job.id, self.run.run_id, token='invalid')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(res2.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_run_of_other_user(self):
+        """Test runs of other users are not found."""
+        other = create_user(email='other@example.com', password='test123')
+        _, other_token = AuthToken.objects.create(other)
+
+        res = self.get(async_views.get_analyses, self.job.id, self.run.run_id, token=other_token)
+        res2 = self.get(async_views.get_analyses, 'not-a-uuid', self.run.run_id, token=self.token)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(res2.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_analyses_from_summaries(self):
+        """Test stored summaries are served without touching S3."""
+        AnalysisSummary.create_for_run(self.run, [
+            {'analysis_id': '1', 'analysis_name': 'Table A', 'epsilon_sum': 1.0, 'row_count': 2},
+        ])
+
+        res = self.get(async_views.get_analyses, self.job.id, self.run.run_id, token=self.token)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(res.content), [
+            {'analysis_id': '1', 'analysis_name': 'Table A', 'epsilon_sum': 1.0},
+        ])
+
+    def test_method_not_allowed(self):
+        """Test release only accepts POST."""
+        res = self.get(async_views.release, self.job.id, self.run.run_id, token=self.token)
+
+        self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_release_validates_body(self):
+        """Test a malformed release body is a 400, not a server error."""
+        def post(body):
+            request = self.factory.post(
+                '/', body, content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token}'
+            )
+            return async_to_sync(async_views.release)(request, jobs_pk=str(self.job.id), run_id=str(self.run.run_id))
+
+        res = post('not json')
+        res2 = post(json.dumps({}))
+        res3 = post(json.dumps({'analysis_ids': ['a']}))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res2.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('analysis_ids', json.loads(res2.content))
+        self.assertEqual(res3.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_release_uploads_released_rows(self):
+        """Test release uploads the selected rows and charges their cost."""
+        sanitized = b'analysis_id,epsilon,value\n1,0.5,a\n2,2.0,b\n1,0.25,c\n'
+        uploaded = {}
+
+        async def open_local_source(file_key, tmpdir):
+            return io.BytesIO(sanitized)
+
+        async def upload_file(path, file_key, content_type):
+            with open(path, 'rb') as f:
+                uploaded[file_key] = f.read()
+
+        async def delete_sidecar(file_key):
+            pass
+
+        before = Budget.objects.get(user=self.user).release
+        request = self.factory.post(
+            '/', json.dumps({'analysis_ids': [1]}), content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token}',
+        )
+        with patch.object(async_views, 'open_local_source', open_local_source), \
+                patch.object(async_views, 'upload_file', upload_file), \
+                patch.object(async_views, 'delete_sidecar', delete_sidecar):
+            res = async_to_sync(async_views.release)(request, jobs_pk=str(self.job.id), run_id=str(self.run.run_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(uploaded.values()), [b'analysis_id,epsilon,value\n1,0.5,a\n1,0.25,c\n'])
+        self.assertEqual(Budget.objects.get(user=self.user).release, before - 0.75)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status['info'], 'released')
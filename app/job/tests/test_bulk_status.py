@@ -0,0 +1,135 @@
+"""
+Tests for bulk run status updates.
+"""
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import TestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Budget, BudgetCharge, BudgetReservation, Run, StatusEvent
+from job.bulk import update_run_statuses
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+RUN_STATUS_URL = reverse('job:job-run-status')
+
+
+def run_status(info, ok=True):
+    return {'ok': ok, 'info': info, 'errormsg': None}
+
+
+class BulkRunStatusTests(TestCase):
+    """Test updating the status of many runs in one request."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.engine = create_user(email='engine@example.com', password='test123')
+        self.engine.groups.add(Group.objects.get_or_create(name='engine')[0])
+        self.user = create_user(email='user@example.com', password='test123')
+        self.jobs = [create_job(user=self.user) for _ in range(3)]
+        self.client.force_authenticate(self.engine)
+
+    def post(self, updates):
+        return self.client.post(RUN_STATUS_URL, {'updates': updates}, format='json')
+
+    def test_engine_only(self):
+        """Test other users cannot update statuses."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.post(RUN_STATUS_URL, {'updates': []}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_updates_runs_in_bulk(self):
+        """Test every run is updated and gets a status event."""
+        last_event = StatusEvent.objects.last().id
+
+        res = self.post([
+            {'job_id': job.id.hex, 'run_id': 1, 'status': run_status('running')} for job in self.jobs
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data['results'],
+            [{'job_id': job.id.hex, 'run_id': 1, 'ok': True} for job in self.jobs],
+        )
+        for job in self.jobs:
+            self.assertEqual(Run.objects.get(job=job).status, run_status('running'))
+        self.assertEqual(StatusEvent.objects.filter(id__gt=last_event).count(), 3)
+
+    def test_queries_do_not_grow_with_updates(self):
+        """Test a batch costs the same number of queries however many runs it updates."""
+        def count_queries(jobs, new_status):
+            updates = [{'job_id': job.id, 'run_id': 1, 'status': new_status} for job in jobs]
+            with CaptureQueriesContext(connection) as queries:
+                update_run_statuses(updates)
+            return len(queries)
+
+        one = count_queries(self.jobs[:1], run_status('failed', ok=False))
+        many = count_queries(self.jobs, run_status('error', ok=False))
+
+        self.assertEqual(one, many)
+
+    def test_per_update_errors(self):
+        """Test invalid updates and unknown runs are reported without stopping the others."""
+        job = self.jobs[0]
+
+        res = self.post([
+            {'job_id': job.id.hex, 'run_id': 1, 'status': run_status('running')},
+            {'job_id': job.id.hex, 'run_id': 9, 'status': run_status('running')},
+            {'job_id': 'not-a-uuid', 'run_id': 1, 'status': run_status('running')},
+            {'job_id': job.id.hex, 'run_id': 1, 'status': 'running'},
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['ok'] for result in res.data['results']], [True, False, False, False])
+        self.assertEqual(res.data['results'][1]['errors'], {'detail': 'Not found.'})
+        self.assertIn('job_id', res.data['results'][2]['errors'])
+        self.assertIn('status', res.data['results'][3]['errors'])
+        self.assertEqual(Run.objects.get(job=job).status, run_status('running'))
+
+    def test_batch_size_limits(self):
+        """Test empty batches and batches over BULK_STATUS_MAX_UPDATES are rejected."""
+        update = {'job_id': self.jobs[0].id.hex, 'run_id': 1, 'status': run_status('running')}
+
+        res = self.post([])
+        res2 = self.post([update] * (settings.BULK_STATUS_MAX_UPDATES + 1))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res2.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_resolves_budget_holds(self):
+        """Test a failed run releases its holds, like a single status update."""
+        run = Run.objects.get(job=self.jobs[0])
+        before = Budget.objects.get(user=self.user).release
+        BudgetReservation.hold(self.user, Budget.RELEASE, 2, run=run, reason=BudgetCharge.RELEASE)
+
+        res = self.post([
+            {'job_id': self.jobs[0].id.hex, 'run_id': 1, 'status': run_status('failed', ok=False)},
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(Budget.objects.get(user=self.user).release, before)
+        self.assertFalse(BudgetReservation.objects.filter(run=run, status=BudgetReservation.HELD).exists())
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_locks_only_named_runs(self):
+        """Test the lock query names each (job, run) pair instead of crossing job and run ids."""
+        updates = [
+            {'job_id': self.jobs[0].id, 'run_id': 1, 'status': run_status('running')},
+            {'job_id': self.jobs[1].id, 'run_id': 2, 'status': run_status('running')},
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            update_run_statuses(updates)
+
+        lock = next(q['sql'] for q in queries if 'FOR UPDATE' in q['sql'])
+        self.assertIn(' OR ', lock)
+        self.assertNotIn(' IN (', lock)
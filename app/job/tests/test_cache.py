@@ -0,0 +1,87 @@
+"""
+Tests for the local result cache.
+"""
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+import boto3
+from moto import mock_s3
+
+from core import aws
+from job.cache import ResultCache
+
+
+BUCKET = 'test-results-bucket'
+
+
+@mock_s3
+class ResultCacheTests(SimpleTestCase):
+    """Test the read-through disk cache for S3 objects."""
+
+    def setUp(self):
+        aws.reset_clients()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def put(self, key, content):
+        self.s3.put_object(Bucket=BUCKET, Key=key, Body=content)
+
+    def test_repeat_fetch_is_served_from_disk(self):
+        """Test the second fetch of an object does not hit S3."""
+        cache = ResultCache(self.tmpdir.name, max_bytes=1024)
+        self.put('a.csv', b'analysis_id,epsilon\n1,0.5\n')
+
+        first = cache.fetch(BUCKET, 'a.csv')
+        self.s3.delete_object(Bucket=BUCKET, Key='a.csv')
+        second = cache.fetch(BUCKET, 'a.csv')
+
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(list(second.iter_lines()), ['analysis_id,epsilon', '1,0.5'])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test entries are evicted in LRU order once the cap is exceeded."""
+        cache = ResultCache(self.tmpdir.name, max_bytes=25)
+        self.put('a.csv', b'a' * 10)
+        self.put('b.csv', b'b' * 10)
+        self.put('c.csv', b'c' * 10)
+
+        a = cache.fetch(BUCKET, 'a.csv')
+        b = cache.fetch(BUCKET, 'b.csv')
+        os.utime(b.path, (1, 1))  # make b the least recently used entry
+        cache.fetch(BUCKET, 'c.csv')
+
+        self.assertTrue(os.path.exists(a.path))
+        self.assertFalse(os.path.exists(b.path))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_empty_object(self):
+        """Test empty objects can be cached and read."""
+        cache = ResultCache(self.tmpdir.name, max_bytes=1024)
+        self.put('empty.csv', b'')
+
+        cached = cache.fetch(BUCKET, 'empty.csv')
+
+        self.assertEqual(list(cached.iter_chunks()), [])
+        self.assertEqual(cached.size, 0)
+
+    def test_evicted_entry(self):
+        """Test an open entry survives eviction and an evicted one fails on open, not mid-read."""
+        cache = ResultCache(self.tmpdir.name, max_bytes=1024)
+        self.put('a.csv', b'abc')
+        cached = cache.fetch(BUCKET, 'a.csv')
+
+        chunks = cached.iter_chunks()
+        os.unlink(cached.path)
+
+        self.assertEqual(list(chunks), [b'abc'])
+        with self.assertRaises(FileNotFoundError):
+            cached.iter_chunks()
+        with cache.open(BUCKET, 'a.csv') as f:
+            self.assertEqual(f.read(), b'abc')
@@ -0,0 +1,65 @@
+"""
+Tests for conditional GETs of jobs and runs.
+"""
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Job
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+def job_url(job_id):
+    return reverse('job:job-detail', args=[job_id])
+
+
+def run_url(job_id, run_id):
+    return reverse('job:run-detail', args=[job_id, run_id])
+
+
+class ConditionalGetTests(TestCase):
+    """Test unchanged jobs and runs are answered with 304."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+        self.job = create_job(user=self.user)
+        self.run = self.job.run_set.get()
+
+    def test_job_not_modified(self):
+        """Test a job is only sent again once it changed."""
+        res = self.client.get(job_url(self.job.id))
+        etag = res['ETag']
+
+        res2 = self.client.get(job_url(self.job.id), HTTP_IF_NONE_MATCH=etag)
+        res3 = self.client.get(job_url(self.job.id), HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res3.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res2['ETag'], etag)
+
+        job = Job.objects.get(id=self.job.id)
+        job.status = {'ok': True, 'info': 'running', 'errormsg': None}
+        job.save()
+        res4 = self.client.get(job_url(self.job.id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res4.status_code, status.HTTP_200_OK)
+        self.assertEqual(res4.data['status']['info'], 'running')
+
+    def test_run_not_modified(self):
+        """Test a run is sent again when it or its job changed."""
+        etag = self.client.get(run_url(self.job.id, self.run.run_id))['ETag']
+
+        res = self.client.get(run_url(self.job.id, self.run.run_id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.job.title = 'New title'
+        self.job.save()
+        res = self.client.get(run_url(self.job.id, self.run.run_id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['job']['title'], 'New title')
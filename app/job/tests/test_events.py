@@ -0,0 +1,163 @@
+"""
+Tests for the job status event stream.
+"""
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from knox.models import AuthToken
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Run, StatusEvent
+from job import events
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+def parse_event(chunk):
+    """Return the fields of an encoded event."""
+    fields = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n'))
+    fields['data'] = json.loads(fields['data'])
+    return fields
+
+
+@override_settings(EVENTS_POLL_INTERVAL=0.01, EVENTS_KEEPALIVE=60)
+class JobEventsTests(TestCase):
+    """Test the Server-Sent Events stream of a job."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.job = create_job(user=self.user)
+        self.run = Run.objects.filter(job=self.job).first()
+        _, self.token = AuthToken.objects.create(self.user)
+
+    def request(self, token=None, last_event_id=None, query=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        if last_event_id is not None:
+            headers['HTTP_LAST_EVENT_ID'] = str(last_event_id)
+        return self.factory.get('/', query or {}, **headers)
+
+    def events_token(self, user, job):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(reverse('job:job-events-token', args=[job.id]))
+
+    def set_run_status(self, info):
+        self.run.status = {'ok': True, 'info': info, 'errormsg': None}
+        self.run.save()
+
+    def test_requires_token(self):
+        """Test requests without a valid token are rejected."""
+        res = async_to_sync(events.job_events)(self.request(), pk=str(self.job.id))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_job_of_other_user(self):
+        """Test jobs of other users are not found."""
+        other = create_user(email='other@example.com', password='test123')
+        _, other_token = AuthToken.objects.create(other)
+
+        res = async_to_sync(events.job_events)(self.request(other_token), pk=str(self.job.id))
+        res2 = async_to_sync(events.job_events)(self.request(self.token), pk='not-a-uuid')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(res2.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_signed_token_in_query(self):
+        """Test a browser can open the stream with a token from the events-token endpoint."""
+        res = self.events_token(self.user, self.job)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        received = self.read_stream(self.request(query={'token': res.data['token']}), 1)
+        self.assertEqual(received[0]['event'], 'snapshot')
+
+    def test_signed_token_rejected(self):
+        """Test signed tokens only open the job they were issued for, and only while fresh."""
+        other_job = create_job(user=self.user)
+        token = self.events_token(self.user, other_job).data['token']
+        other = create_user(email='other@example.com', password='test123')
+
+        res = async_to_sync(events.job_events)(self.request(query={'token': token}), pk=str(self.job.id))
+        res2 = async_to_sync(events.job_events)(self.request(query={'token': token + 'x'}), pk=str(other_job.id))
+        with self.settings(STREAM_TOKEN_MAX_AGE=-1):
+            res3 = async_to_sync(events.job_events)(self.request(query={'token': token}), pk=str(other_job.id))
+        res4 = self.events_token(other, self.job)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(res2.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(res3.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(res4.status_code, status.HTTP_404_NOT_FOUND)
+
+    def read_stream(self, request, count, while_streaming=None):
+        """Return the first count events of the stream."""
+        async def read():
+            res = await events.job_events(request, pk=str(self.job.id))
+            self.assertEqual(res['Content-Type'], 'text/event-stream')
+            stream = res.async_streaming_content
+            chunks = []
+            try:
+                retry = await stream.__anext__()
+                self.assertTrue(retry.startswith(b'retry: '))
+                for _ in range(count):
+                    if len(chunks) == 1 and while_streaming is not None:
+                        await sync_to_async(while_streaming)()
+                    chunks.append(await asyncio.wait_for(stream.__anext__(), timeout=5))
+            finally:
+                await stream.aclose()
+                hub = events.get_hub()
+                if hub.task is not None:
+                    await hub.task
+            return [parse_event(chunk) for chunk in chunks]
+
+        return async_to_sync(read)()
+
+    def test_snapshot_then_status_changes(self):
+        """Test a new stream starts with a snapshot and then pushes saved status changes."""
+        initial_status = self.run.status
+        received = self.read_stream(self.request(self.token), 2, lambda: self.set_run_status('running'))
+
+        self.assertEqual(received[0]['event'], 'snapshot')
+        self.assertEqual(received[0]['data']['job_id'], str(self.job.id))
+        self.assertEqual(received[0]['data']['runs'], [{'run_id': 1, 'status': initial_status}])
+        self.assertEqual(received[1]['event'], 'run')
+        self.assertEqual(received[1]['data']['run_id'], 1)
+        self.assertEqual(received[1]['data']['status']['info'], 'running')
+        self.assertEqual(int(received[1]['id']), StatusEvent.objects.last().id)
+
+    def test_resume_from_last_event_id(self):
+        """Test a reconnecting client is sent the events it missed."""
+        last_seen = StatusEvent.objects.filter(job=self.job).last().id
+        self.set_run_status('running')
+        self.set_run_status('completed')
+
+        received = self.read_stream(self.request(self.token, last_event_id=last_seen), 2)
+
+        self.assertEqual([e['data']['status']['info'] for e in received], ['running', 'completed'])
+        self.assertLess(int(received[0]['id']), int(received[1]['id']))
+
+
+class EventHubTests(TestCase):
+    """Test the poller that fans events out."""
+
+    def test_fetch_retries_skipped_ids(self):
+        """Test ids skipped by a poll are asked for again."""
+        user = create_user(email='user@example.com', password='test123')
+        job = create_job(user=user)
+        hub = events.EventHub()
+        hub.last_id = StatusEvent.objects.last().id
+        first = StatusEvent.objects.create(job=job, status={'info': 'first'})
+        second = StatusEvent.objects.create(job=job, status={'info': 'second'})
+        first_id = first.id
+        first.delete()
+
+        self.assertEqual([e['id'] for e in hub.fetch()], [second.id])
+        self.assertIn(first_id, hub.gaps)
+        StatusEvent.objects.create(id=first_id, job=job, status={'info': 'first'})
+        self.assertEqual([e['id'] for e in hub.fetch()], [first_id])
+        self.assertEqual(hub.gaps, {})
@@ -0,0 +1,97 @@
+"""
+Tests for the engine feed of job and run changes.
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import Group
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Run, StatusEvent
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+FEED_URL = reverse('job:job-feed')
+
+
+class EngineFeedTests(TestCase):
+    """Test reading changes by cursor."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.engine = create_user(email='engine@example.com', password='test123')
+        self.engine.groups.add(Group.objects.get_or_create(name='engine')[0])
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.engine)
+
+    def read(self, after=0, **params):
+        res = self.client.get(FEED_URL, {'after': after, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_engine_only(self):
+        """Test other users cannot read the feed."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.get(FEED_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_changes_since_cursor(self):
+        """Test only jobs and runs changed after the cursor are returned."""
+        old_job = create_job(user=self.user)
+        cursor = self.read()['cursor']
+        job = create_job(user=self.user)
+        run = Run.objects.get(job=old_job)
+        run.status = {'ok': True, 'info': 'running', 'errormsg': None}
+        run.save()
+
+        data = self.read(cursor)
+
+        self.assertEqual(data['cursor'], StatusEvent.objects.last().id)
+        self.assertFalse(data['more'])
+        self.assertEqual({j['id'] for j in data['jobs']}, {job.id.hex})
+        self.assertEqual(
+            {(r['job_id'], r['run_id'], r['status'].get('info')) for r in data['runs']},
+            {(job.id.hex, 1, None), (old_job.id.hex, 1, 'running')},
+        )
+        self.assertEqual(self.read(data['cursor'])['jobs'], [])
+
+    def test_bounded_batches(self):
+        """Test a batch holds at most limit events and says when there are more."""
+        for _ in range(3):
+            create_job(user=self.user)
+
+        first = self.read(limit=4)
+        rest = self.read(first['cursor'], limit=4)
+
+        self.assertTrue(first['more'])
+        self.assertEqual(len(first['jobs']), 2)
+        self.assertFalse(rest['more'])
+        self.assertEqual(len(rest['jobs']), 1)
+        self.assertEqual(rest['cursor'], StatusEvent.objects.last().id)
+
+    def test_waits_for_recent_gap(self):
+        """Test a batch stops before a missing id until the events after it are old."""
+        job = create_job(user=self.user)
+        cursor = self.read()['cursor']
+        missing = StatusEvent.objects.create(job=job, status={})
+        StatusEvent.objects.create(job=job, status={})
+        missing.delete()
+
+        self.assertEqual(self.read(cursor)['cursor'], cursor)
+
+        StatusEvent.objects.filter(id__gt=cursor).update(created_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.read(cursor)['cursor'], StatusEvent.objects.last().id)
+
+    def test_invalid_cursor(self):
+        """Test a cursor that is not a number is rejected."""
+        res = self.client.get(FEED_URL, {'after': 'abc'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
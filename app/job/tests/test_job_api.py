@@ -100,10 +100,10 @@ class PrivateJobAPITests(TestCase):
 
         res = self.client.get(JOBS_URL)
 
-        jobs = Job.objects.all().order_by('-id')
+        jobs = Job.objects.all().order_by('-created_at', '-id')
         serializer = JobSerializer(jobs, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_job_list_limited_to_user(self):
         """Test list of jobs is limited to authenticated user."""
@@ -113,10 +113,10 @@ class PrivateJobAPITests(TestCase):
 
         res = self.client.get(JOBS_URL)
 
-        jobs = Job.objects.filter(user=self.user)
+        jobs = Job.objects.filter(user=self.user).order_by('-created_at', '-id')
         serializer = JobSerializer(jobs, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_get_job_detail(self):
         """Test get job detail."""
@@ -0,0 +1,63 @@
+"""
+Tests for cursor pagination of job and run listings.
+"""
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Job, Run
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+JOBS_URL = reverse('job:job-list')
+
+
+def runs_url(job_id):
+    return reverse('job:run-list', args=[job_id])
+
+
+class CursorPaginationTests(TestCase):
+    """Test listings are paged newest first by (created_at, id)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url, key):
+        """Follow the next links and return the keys listed on each page."""
+        pages = []
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            pages.append([item[key] for item in res.data['results']])
+            url = res.data['next']
+        return pages
+
+    def test_jobs_paged(self):
+        """Test every job of the user is listed once, newest first."""
+        for i in range(5):
+            create_job(user=self.user, title=f'Job {i}')
+        create_job(user=create_user(email='other@example.com', password='test123'))
+
+        pages = self.collect(JOBS_URL + '?page_size=2', 'id')
+
+        expected = [job_id.hex for job_id in Job.objects.filter(user=self.user)
+                    .order_by('-created_at', '-id').values_list('id', flat=True)]
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_runs_paged(self):
+        """Test every run of a job is listed once, newest first."""
+        job = create_job(user=self.user)
+        for _ in range(3):
+            Run.objects.create(job=job)
+
+        pages = self.collect(runs_url(job.id) + '?page_size=3', 'run_id')
+
+        expected = list(Run.objects.filter(job=job).order_by('-created_at', '-id').values_list('run_id', flat=True))
+        self.assertEqual([len(page) for page in pages], [3, 1])
+        self.assertEqual(sum(pages, []), expected)
@@ -0,0 +1,105 @@
+"""
+Query-count regression tests for the list and detail endpoints.
+
+Each endpoint is requested with 1, 100 and 10,000 rows behind it and must
+stay within its query budget, independent of the number of rows.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Budget, Job, ReleaseTask, Run
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+SIZES = (1, 100, 10000)
+
+# Most queries each endpoint may issue with cold caches: the group check
+# plus one select
+MAX_QUERIES = {
+    'job-list': 2,
+    'job-detail': 1,
+    'run-list': 2,
+    'run-detail': 1,
+    'releasetask-list': 1,
+    'budget-list': 2,
+}
+
+
+class QueryCountTests(TestCase):
+    """Test endpoints issue a bounded number of queries as data grows."""
+
+    def setUp(self):
+        self.user = create_user(email='user@example.com', password='test123')
+        self.user.groups.add(Group.objects.get_or_create(name='datasteward')[0])
+        self.job = create_job(user=self.user)
+        self.run = self.job.run_set.get()
+
+    def grow_to(self, size):
+        """Give the user size jobs, the job size runs, etc."""
+        jobs = size - Job.objects.filter(user=self.user).count()
+        Job.objects.bulk_create(
+            [Job(user=self.user, title=f'Job {i}', dataset_id='cps') for i in range(jobs)],
+            batch_size=1000,
+        )
+        last_run_id = Run.objects.filter(job=self.job).count()
+        Run.objects.bulk_create(
+            [Run(job=self.job, run_id=run_id) for run_id in range(last_run_id + 1, size + 1)],
+            batch_size=1000,
+        )
+        ReleaseTask.objects.bulk_create(
+            [ReleaseTask(run=self.run, user=self.user, analysis_ids=[1], reserved_cost=1.0)
+             for _ in range(size - ReleaseTask.objects.count())],
+            batch_size=1000,
+        )
+        users = size - Budget.objects.count()
+        first = get_user_model().objects.count()
+        new_users = get_user_model().objects.bulk_create(
+            [get_user_model()(email=f'user{first + i}@example.com') for i in range(users)],
+            batch_size=1000,
+        )
+        if new_users and new_users[0].pk is None:
+            new_users = get_user_model().objects.filter(budget__isnull=True)
+        Budget.objects.bulk_create([Budget(user=user) for user in new_users], batch_size=1000)
+
+    def count_queries(self, url):
+        client = APIClient()
+        # A fresh user object, so nothing is memoized from earlier requests
+        client.force_authenticate(get_user_model().objects.get(pk=self.user.pk))
+        # Cold group and budget caches, so every size is measured the same way
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            res = client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK, url)
+        return len(queries)
+
+    def urls(self):
+        return {
+            'job-list': reverse('job:job-list') + '?page_size=500',
+            'job-detail': reverse('job:job-detail', args=[self.job.id]),
+            'run-list': reverse('job:run-list', args=[self.job.id]) + '?page_size=500',
+            'run-detail': reverse('job:run-detail', args=[self.job.id, self.run.run_id]),
+            'releasetask-list': reverse('job:releasetask-list'),
+            'budget-list': reverse('budget:budget-list'),
+        }
+
+    def test_queries_independent_of_size(self):
+        """Test no endpoint issues more queries as its rows grow."""
+        counts = {}
+        for size in SIZES:
+            self.grow_to(size)
+            for name, url in self.urls().items():
+                counts.setdefault(name, []).append(self.count_queries(url))
+
+        for name, per_size in counts.items():
+            with self.subTest(endpoint=name):
+                self.assertLessEqual(max(per_size), MAX_QUERIES[name], per_size)
+                self.assertEqual(len(set(per_size)), 1, per_size)
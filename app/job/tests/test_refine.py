@@ -0,0 +1,61 @@
+"""
+Tests for the refine API.
+"""
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Budget, BudgetReservation, OutboxMessage, Run
+from .test_job_api import create_user
+from .test_results_api import create_job
+
+
+def refine_url(job_id, run_id):
+    return reverse('job:run-refine', args=[job_id, run_id])
+
+
+class RefineAPITests(TestCase):
+    """Test refining the statistics of a run."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+        self.job = create_job(user=self.user)
+
+    def refine(self, epsilon=1.0):
+        return self.client.post(
+            refine_url(self.job.id, 1),
+            {'refined': [{'statistic_id': 1, 'epsilon': epsilon}]},
+            format='json',
+        )
+
+    def test_refine_returns_new_run(self):
+        """Test refining is accepted with the new run's job and run ids."""
+        res = self.refine()
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data, {'job_id': str(self.job.id), 'run_id': 2})
+        run = Run.objects.get(job=self.job, run_id=2)
+        self.assertTrue(BudgetReservation.objects.filter(run=run, status=BudgetReservation.HELD).exists())
+
+    def test_refine_queues_sanitizer_only(self):
+        """Test a refined run goes to the sanitizer, not through the engine again."""
+        self.refine()
+
+        messages = OutboxMessage.objects.filter(run__job=self.job)
+        self.assertEqual(
+            sorted((m.run.run_id, m.kind) for m in messages),
+            [(1, OutboxMessage.ENGINE), (2, OutboxMessage.SANITIZER)],
+        )
+
+    def test_refine_over_budget(self):
+        """Test a refinement the budget cannot cover creates no run."""
+        review = Budget.objects.get(user=self.user).review
+
+        res = self.refine(epsilon=review + 1)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.job.run_set.count(), 1)
@@ -0,0 +1,98 @@
+"""
+Tests for sanitized output processing.
+"""
+import io
+import os
+import tempfile
+
+import pyarrow.parquet as pq
+from django.test import SimpleTestCase
+
+from job.results import summarize_analyses, summarize_analyses_parquet, write_parquet, ReleaseFilter
+
+
+SANITIZED_OUTPUT = (
+    b'analysis_id,analysis_name,epsilon,value_sanitized\n'
+    b'1,"Table, A",0.50,6074.14350\n'
+    b'2,Table B,0.25,1.0\n'
+    b'1,"Table, A",0.5,"multi\nline"\n'
+    b'3,Model C,1,2\n'
+)
+
+
+class SummarizeAnalysesTests(SimpleTestCase):
+    """Test summing epsilon by analysis."""
+
+    def test_summarize_analyses(self):
+        """Test sums and counts are grouped by analysis in order of appearance."""
+        for chunk_rows in (1, 2, 100):
+            summaries = summarize_analyses(io.BytesIO(SANITIZED_OUTPUT), chunk_rows=chunk_rows)
+
+            self.assertEqual(summaries, [
+                {'analysis_id': '1', 'analysis_name': 'Table, A', 'epsilon_sum': 1.0, 'row_count': 2},
+                {'analysis_id': '2', 'analysis_name': 'Table B', 'epsilon_sum': 0.25, 'row_count': 1},
+                {'analysis_id': '3', 'analysis_name': 'Model C', 'epsilon_sum': 1.0, 'row_count': 1},
+            ])
+
+    def test_summarize_empty_output(self):
+        """Test an empty output has no analyses."""
+        self.assertEqual(summarize_analyses(io.BytesIO(b'')), [])
+
+
+class ReleaseFilterTests(SimpleTestCase):
+    """Test filtering released rows."""
+
+    def test_release_filter(self):
+        """Test released rows are kept unchanged and their epsilon is summed."""
+        for block_size in (1, 16, 1024):
+            released = ReleaseFilter(io.BytesIO(SANITIZED_OUTPUT), [1, 3], block_size=block_size)
+
+            content = b''.join(released)
+
+            self.assertEqual(content, (
+                b'analysis_id,analysis_name,epsilon,value_sanitized\n'
+                b'1,"Table, A",0.50,6074.14350\n'
+                b'1,"Table, A",0.5,"multi\nline"\n'
+                b'3,Model C,1,2\n'
+            ))
+            self.assertEqual(released.cost, 2.0)
+            self.assertEqual(released.row_count, 3)
+
+    def test_release_filter_unquoted_rows_copied(self):
+        """Test rows without quotes are copied byte for byte."""
+        output = b'analysis_id,analysis_name,epsilon\n1,a,0.50\n2,b,1\n1,c,1e-1\n'
+
+        released = ReleaseFilter(io.BytesIO(output), [1])
+
+        self.assertEqual(b''.join(released), b'analysis_id,analysis_name,epsilon\n1,a,0.50\n1,c,1e-1\n')
+        self.assertAlmostEqual(released.cost, 0.6)
+
+
+class ParquetSidecarTests(SimpleTestCase):
+    """Test the Parquet sidecar of a sanitized output."""
+
+    def test_write_parquet(self):
+        """Test every row is converted with text values kept as they are."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'sanitized_output_1.parquet')
+            for block_size in (1, 16, 1024):
+                rows = write_parquet(io.BytesIO(SANITIZED_OUTPUT), path, block_size=block_size)
+
+                table = pq.read_table(path)
+                self.assertEqual(rows, 4)
+                self.assertEqual(table.column('epsilon').to_pylist(), [0.5, 0.25, 0.5, 1.0])
+                self.assertEqual(
+                    table.column('value_sanitized').to_pylist(),
+                    ['6074.14350', '1.0', 'multi\nline', '2'],
+                )
+
+    def test_summarize_analyses_parquet(self):
+        """Test the sidecar summary matches the CSV summary."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'sanitized_output_1.parquet')
+            write_parquet(io.BytesIO(SANITIZED_OUTPUT), path)
+
+            self.assertEqual(
+                summarize_analyses_parquet(path, chunk_rows=1),
+                summarize_analyses(io.BytesIO(SANITIZED_OUTPUT)),
+            )
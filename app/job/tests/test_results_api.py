@@ -0,0 +1,316 @@
+"""
+Tests for the run results APIs.
+"""
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.conf import settings
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+import boto3
+from moto import mock_s3
+
+from core import aws
+from core.models import Job, Run, AnalysisSummary, Budget, BudgetCharge, BudgetReservation, ReleaseTask
+from job.tasks import run_release_task
+from job.util import sanitized_output_key, released_output_key
+from .test_job_api import create_user
+
+
+def create_job(user, **params):
+    """Create and return a sample job."""
+    defaults = {
+        'title': 'Sample job title',
+        'description': 'Sample job description',
+        'dataset_id': 'cps',
+    }
+    defaults.update(params)
+
+    return Job.objects.create(user=user, **defaults)
+
+
+def csv_results_url(job_id, run_id):
+    """Create and return a sanitized results download URL."""
+    return reverse('job:run-get-csv-results', args=[job_id, run_id])
+
+
+def analyses_url(job_id, run_id):
+    """Create and return a run analyses URL."""
+    return reverse('job:run-get-analyses', args=[job_id, run_id])
+
+
+def release_url(job_id, run_id):
+    """Create and return a run release URL."""
+    return reverse('job:run-release', args=[job_id, run_id])
+
+
+def release_task_url(task_id):
+    """Create and return a release task detail URL."""
+    return reverse('job:releasetask-detail', args=[task_id])
+
+
+SANITIZED_OUTPUT = (
+    b'analysis_id,analysis_name,epsilon\n'
+    b'1,"Table, A",0.5\n'
+    b'2,Table B,0.25\n'
+    b'1,"Table, A",0.5\n'
+)
+
+
+@mock_s3
+@override_settings(RESULTS_CACHE_ENABLED=False)
+class RunResultsDownloadTests(TestCase):
+    """Test downloading run results from S3."""
+
+    def setUp(self):
+        aws.reset_clients()
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+        self.job = create_job(user=self.user)
+        self.run = Run.objects.filter(job=self.job).first()
+
+        self.s3 = boto3.client("s3", region_name=settings.AWS_S3_REGION_NAME)
+        self.s3.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def put_csv(self, key, content):
+        self.s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key, Body=content)
+
+    def test_get_csv_results_streams_object(self):
+        """Test sanitized results are relayed unchanged with a content length."""
+        content = b'analysis_id,analysis_name,epsilon\n1,"Table, A",0.5\n2,Table B,0.25\n'
+        self.put_csv(sanitized_output_key(self.job.id, self.run.run_id), content)
+
+        res = self.client.get(csv_results_url(self.job.id, self.run.run_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        self.assertEqual(int(res['Content-Length']), len(content))
+        self.assertEqual(b''.join(res.streaming_content), content)
+
+    def test_get_csv_results_not_modified(self):
+        """Test a client holding the current ETag gets a 304 without a body."""
+        key = sanitized_output_key(self.job.id, self.run.run_id)
+        self.put_csv(key, SANITIZED_OUTPUT)
+        url = csv_results_url(self.job.id, self.run.run_id)
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.content, b'')
+
+        self.put_csv(key, SANITIZED_OUTPUT + b'2,Table B,0.25\n')
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    @override_settings(RESULTS_X_ACCEL_REDIRECT=True)
+    def test_get_csv_results_x_accel_redirect(self):
+        """Test downloads are handed to nginx when X-Accel-Redirect is enabled."""
+        res = self.client.get(csv_results_url(self.job.id, self.run.run_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(res.streaming)
+        self.assertEqual(res.content, b'')
+        self.assertTrue(res['X-Accel-Redirect'].startswith(settings.RESULTS_X_ACCEL_S3_LOCATION))
+        self.assertIn(sanitized_output_key(self.job.id, self.run.run_id), res['X-Accel-Redirect'])
+
+    def test_get_csv_results_of_other_user(self):
+        """Test results of another user's run cannot be downloaded."""
+        other_user = create_user(email='other@example.com', password='test123')
+        job = create_job(user=other_user)
+
+        res = self.client.get(csv_results_url(job.id, 1))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_analyses_is_persisted(self):
+        """Test analyses are computed once and then read from the database."""
+        key = sanitized_output_key(self.job.id, self.run.run_id)
+        self.put_csv(key, SANITIZED_OUTPUT)
+
+        res = self.client.get(analyses_url(self.job.id, self.run.run_id))
+        self.s3.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+        res2 = self.client.get(analyses_url(self.job.id, self.run.run_id))
+
+        expected = [
+            {'analysis_id': '1', 'analysis_name': 'Table, A', 'epsilon_sum': 1.0},
+            {'analysis_id': '2', 'analysis_name': 'Table B', 'epsilon_sum': 0.25},
+        ]
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, expected)
+        self.assertEqual(res2.data, expected)
+        self.assertEqual(AnalysisSummary.objects.get(run=self.run, analysis_id='1').row_count, 2)
+
+    def test_release_uploads_selected_analyses(self):
+        """Test release writes the selected rows and charges their epsilon."""
+        self.put_csv(sanitized_output_key(self.job.id, self.run.run_id), SANITIZED_OUTPUT)
+        release_before = Budget.objects.get(user=self.user).release
+
+        res = self.client.post(
+            release_url(self.job.id, self.run.run_id),
+            {'analysis_ids': [1]},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        released = self.s3.get_object(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=released_output_key(self.job.id, self.run.run_id),
+        )['Body'].read().decode('utf-8')
+        self.assertEqual(released.splitlines(), [
+            'analysis_id,analysis_name,epsilon',
+            '1,"Table, A",0.5',
+            '1,"Table, A",0.5',
+        ])
+        self.assertEqual(Budget.objects.get(user=self.user).release, release_before - 1.0)
+
+    def test_release_insufficient_budget_uploads_nothing(self):
+        """Test release over budget is rejected and leaves no released output."""
+        self.put_csv(sanitized_output_key(self.job.id, self.run.run_id), SANITIZED_OUTPUT)
+        Budget.objects.filter(user=self.user).update(release=0.1)
+
+        res = self.client.post(
+            release_url(self.job.id, self.run.run_id),
+            {'analysis_ids': [1, 2]},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        listing = self.s3.list_objects_v2(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Prefix=released_output_key(self.job.id, self.run.run_id),
+        )
+        self.assertEqual(listing['KeyCount'], 0)
+        self.assertEqual(Budget.objects.get(user=self.user).release, 0.1)
+
+
+    def test_release_of_other_user(self):
+        """Test another user's run cannot be released."""
+        other_user = create_user(email='other@example.com', password='test123')
+        job = create_job(user=other_user)
+        self.put_csv(sanitized_output_key(job.id, 1), SANITIZED_OUTPUT)
+        release_before = Budget.objects.get(user=self.user).release
+
+        res = self.client.post(release_url(job.id, 1), {'analysis_ids': [1]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        listed = self.s3.list_objects_v2(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Prefix=released_output_key(job.id, 1),
+        )
+        self.assertEqual(listed['KeyCount'], 0)
+        self.assertEqual(Budget.objects.get(user=self.user).release, release_before)
+
+    @override_settings(RELEASE_WORKERS=0)
+    def test_async_release_returns_task(self):
+        """Test an async release is accepted and its task reports the charge."""
+        self.put_csv(sanitized_output_key(self.job.id, self.run.run_id), SANITIZED_OUTPUT)
+        release_before = Budget.objects.get(user=self.user).release
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                release_url(self.job.id, self.run.run_id) + '?async=true',
+                {'analysis_ids': [1]},
+                format='json',
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], ReleaseTask.QUEUED)
+        self.assertEqual(res.data['reserved_cost'], 1.0)
+        self.assertEqual(res['Location'], res.data['url'])
+
+        res = self.client.get(release_task_url(res.data['id']))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], ReleaseTask.SUCCEEDED)
+        self.assertEqual(res.data['progress'], 1.0)
+        self.assertEqual(res.data['charged_cost'], 1.0)
+        self.assertEqual(Budget.objects.get(user=self.user).release, release_before - 1.0)
+
+    def test_async_release_counts_reserved_budget(self):
+        """Test queued releases hold their cost against the release budget."""
+        self.put_csv(sanitized_output_key(self.job.id, self.run.run_id), SANITIZED_OUTPUT)
+        Budget.objects.filter(user=self.user).update(release=1.5)
+        url = release_url(self.job.id, self.run.run_id) + '?async=true'
+
+        # Nothing runs the first task, so its cost stays reserved
+        res = self.client.post(url, {'analysis_ids': [1]}, format='json')
+        res2 = self.client.post(url, {'analysis_ids': [1]}, format='json')
+        res3 = self.client.post(url, {'analysis_ids': [7]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res2.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(res3.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ReleaseTask.objects.count(), 1)
+        self.assertEqual(Budget.objects.get(user=self.user).release, 0.5)
+
+    def test_async_release_repeated_ids(self):
+        """Test an analysis named twice is reserved once, like the release charges it."""
+        self.put_csv(sanitized_output_key(self.job.id, self.run.run_id), SANITIZED_OUTPUT)
+
+        res = self.client.post(
+            release_url(self.job.id, self.run.run_id) + '?async=true',
+            {'analysis_ids': [1, 1]},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['reserved_cost'], 1.0)
+
+    def test_release_task_of_other_user(self):
+        """Test release tasks of other users are not visible."""
+        other = create_user(email='other@example.com', password='test123')
+        task = ReleaseTask.objects.create(run=self.run, user=other, analysis_ids=[1], reserved_cost=1.0)
+
+        res = self.client.get(release_task_url(task.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stale_release_tasks_fail(self):
+        """Test tasks stranded by a dead worker fail and give their hold back."""
+        release_before = Budget.objects.get(user=self.user).release
+
+        def queue_task():
+            reservation = BudgetReservation.hold(
+                self.user, Budget.RELEASE, 0.5, run=self.run, reason=BudgetCharge.RELEASE
+            )
+            return ReleaseTask.objects.create(
+                run=self.run, user=self.user, analysis_ids=[1], reserved_cost=0.5, reservation=reservation
+            )
+
+        stale = queue_task()
+        ReleaseTask.objects.filter(id=stale.id).update(
+            status=ReleaseTask.RUNNING,
+            updated_at=timezone.now() - timedelta(seconds=settings.RELEASE_TASK_STALE_AFTER + 1),
+        )
+        current = queue_task()
+
+        self.assertEqual(ReleaseTask.fail_stale(), 1)
+        self.assertEqual(ReleaseTask.fail_stale(), 0)
+
+        stale.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual(stale.status, ReleaseTask.FAILED)
+        self.assertEqual(stale.reservation.status, BudgetReservation.RELEASED)
+        self.assertEqual(current.status, ReleaseTask.QUEUED)
+        self.assertEqual(Budget.objects.get(user=self.user).release, release_before - 0.5)
+
+    def test_failed_release_task_is_not_run(self):
+        """Test a worker does not pick up a task that was failed as stale."""
+        task = ReleaseTask.objects.create(
+            run=self.run, user=self.user, analysis_ids=[1], reserved_cost=1.0, status=ReleaseTask.FAILED
+        )
+
+        run_release_task(task.id)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, ReleaseTask.FAILED)
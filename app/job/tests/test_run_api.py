@@ -63,11 +63,11 @@ class PrivateRunAPITests(TestCase):
 
         res = self.client.get(list_url(self.job.id))
     
-        runs = Run.objects.filter(job=self.job).order_by('-id')
+        runs = Run.objects.filter(job=self.job).order_by('-created_at', '-id')
         serializer = RunSerializer(runs, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_retrieve_runs_of_other_user(self):
         """Test retrieving a list of runs owned by other user fails."""
@@ -82,7 +82,7 @@ class PrivateRunAPITests(TestCase):
         serializer = RunSerializer(runs, many=True)
         
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_get_run_detail(self):
         """Test get run detail."""
@@ -1,6 +1,7 @@
 """
 URL mappings for the job app.
 """
+from django.conf import settings
 from django.urls import (
     path,
     include,
@@ -15,6 +16,7 @@ from job import views
 
 router = routers.DefaultRouter()
 router.register('jobs', views.JobViewSet)
+router.register('release-tasks', views.ReleaseTaskViewSet, basename='releasetask')
 
 runs_router = routers.NestedSimpleRouter(router, 'jobs', lookup='jobs')
 runs_router.register('runs', views.RunViewSet, basename='run')
@@ -26,4 +28,17 @@ urlpatterns = [
     #path('job/jobs/<uuid:pk>/runs/<int:pk>/', views.RunViewSet.as_view({'patch': 'detail'})),
     path('', include(router.urls)),
     path('', include(runs_router.urls))
-]
\ No newline at end of file
+]
+if settings.RESULTS_ASYNC_VIEWS:
+    from job import async_views, events
+
+    # The ASGI app serves the S3-bound run actions asynchronously; these
+    # shadow the routes of the same name in runs_router
+    urlpatterns = [
+        path('jobs/<str:jobs_pk>/runs/<str:run_id>/get-csv-results/', async_views.get_csv_results),
+        path('jobs/<str:jobs_pk>/runs/<str:run_id>/get-released-csv-results/', async_views.get_released_csv_results),
+        path('jobs/<str:jobs_pk>/runs/<str:run_id>/get-analyses/', async_views.get_analyses),
+        path('jobs/<str:jobs_pk>/runs/<str:run_id>/release/', async_views.release),
+        # Long-lived streams, only served by the ASGI app
+        path('jobs/<str:pk>/events/', events.job_events),
+    ] + urlpatterns
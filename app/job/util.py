@@ -1,47 +1,29 @@
 import os
+import re
 import json
-import boto3
 import csv
 import uuid
 from datetime import datetime
 from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from urllib.parse import urlsplit
 
-from rest_framework.response import Response
-from rest_framework import status
+from core.aws import (
+    get_s3_client,
+    get_ses_client,
+)
+from core.conditional import make_etag, set_validators, timestamp
+from job.cache import get_result_cache
 
-from botocore import exceptions
-
-def trigger_sanitizer(run, refined_epsilons):
- 
-    event = {
+def sanitizer_event(run, refined_epsilons):
+    """Return the sanitizer lambda input for a refined run."""
+    return {
         "job_id": str(run.job.id),
         "run_id": run.run_id,
         "user_email": run.job.user.email,
-        "use_default_epsilon": False,    
+        "use_default_epsilon": False,
         "epsilons": refined_epsilons
     }
-            
-    try:
-        # invoke engine
-        client = boto3.client(
-            "lambda", 
-            region_name = os.getenv('AWS_S3_REGION_NAME'),
-            aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-        )
-
-        response = client.invoke(
-            FunctionName = settings.AWS_SANITIZER_LAMBDA,
-            Payload = json.dumps(event).encode(),
-            InvocationType="Event"
-        )
-        return Response(response, status=status.HTTP_200_OK)
-    except exceptions.ClientError as e:
-        print("lambda exception")
-        error_response = e.response
-        #error_code = error_response['Error']['Code']
-        error_message = error_response['Error']['Message']
-        return Response({'error': error_message}, status=status.HTTP_400_BAD_REQUEST)
 
 
 def compute_cost(refined_statistics):
@@ -53,7 +35,7 @@ def compute_cost(refined_statistics):
     return cost
 
 def create_presigned_url(file_path):
-    s3 = boto3.client('s3', config=boto3.session.Config(signature_version='s3v4'), aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+    s3 = get_s3_client(signature_version='s3v4')
 
     # The name of your S3 bucket
     bucket_name = settings.AWS_STORAGE_BUCKET_NAME
@@ -80,7 +62,7 @@ def create_presigned_url(file_path):
 
 def send_email_to_user(signed_url, user):
     # Create an SES client
-    client = boto3.client('ses', region_name='us-east-1')
+    client = get_ses_client()
 
     # Specify the email details
     sender = 'staylor@urban.org'
@@ -133,7 +115,7 @@ def get_file_path_for_release(job_id, run_id):
 
 def upload_csv_to_s3(csv_buffer, filename):
     """Upload csv file to S3"""
-    s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+    s3 = get_s3_client()
 
     s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, 
                 Key=filename, 
@@ -142,3 +124,202 @@ def upload_csv_to_s3(csv_buffer, filename):
                 # SSEKMSKeyId=settings.AWS_S3_OBJECT_PARAMETERS["SSEKMSKeyId"]
         )
 
+
+class S3MultipartUpload:
+    """Upload a stream of bytes to S3 in parts of RESULTS_UPLOAD_PART_SIZE.
+
+    Nothing becomes visible under the key until complete() is called; abort()
+    discards the parts uploaded so far.
+    """
+
+    def __init__(self, file_key, part_size=None):
+        self.s3 = get_s3_client()
+        self.bucket = settings.AWS_STORAGE_BUCKET_NAME
+        self.key = file_key
+        self.part_size = part_size or settings.RESULTS_UPLOAD_PART_SIZE
+        self.parts = []
+        self.buffer = bytearray()
+        self.upload_id = self.s3.create_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            ContentType='text/csv',
+        )['UploadId']
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer.clear()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+
+    def complete(self):
+        # S3 needs at least one part; the last one may be smaller than 5MB
+        if self.buffer or not self.parts:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts},
+        )
+
+    def abort(self):
+        self.buffer.clear()
+        self.s3.abort_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+        )
+
+
+def sanitized_output_key(job_id, run_id):
+    """S3 key of the sanitized output of a run."""
+    return os.path.join('submissions', f'{job_id}', f'sanitized_output_{run_id}.csv')
+
+
+def released_output_key(job_id, run_id):
+    """S3 key of the released output of a run."""
+    return os.path.join('submissions', f'{job_id}', f'released_output_{run_id}.csv')
+
+
+def iter_s3_body(body, chunk_size=None):
+    """Yield the raw bytes of an S3 object body in fixed-size chunks."""
+    if chunk_size is None:
+        chunk_size = settings.RESULTS_CHUNK_SIZE
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+def stream_s3_object(file_key, content_type='text/csv'):
+    """Relay an object from S3 to the client without buffering it.
+
+    Raises botocore ClientError if the object cannot be retrieved.
+    """
+    s3 = get_s3_client()
+    obj = s3.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file_key)
+
+    response = StreamingHttpResponse(iter_s3_body(obj['Body']), content_type=content_type)
+    response['Content-Length'] = obj['ContentLength']
+    response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_key)}"'
+    return set_validators(response, result_etag(obj['ETag']), timestamp(obj.get('LastModified')))
+
+
+def x_accel_s3_response(file_key, content_type='text/csv'):
+    """Let nginx fetch an object from S3 and send it to the client.
+
+    The response only carries a presigned URL in the X-Accel-Redirect header;
+    nginx follows it through an internal location, so the worker is released
+    before any bytes are transferred.
+    """
+    s3 = get_s3_client(signature_version='s3v4')
+    url = s3.generate_presigned_url(
+        ClientMethod='get_object',
+        Params={
+            'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
+            'Key': file_key
+        },
+        ExpiresIn=settings.RESULTS_X_ACCEL_URL_EXPIRY,
+        HttpMethod='GET'
+    )
+    parts = urlsplit(url)
+    location = f'{settings.RESULTS_X_ACCEL_S3_LOCATION}{parts.netloc}{parts.path}?{parts.query}'
+
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = location
+    response['X-Accel-Buffering'] = 'no'
+    response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_key)}"'
+    return response
+
+
+def x_accel_file_response(relative_path, filename, content_type='text/csv'):
+    """Let nginx send a file below RESULTS_LOCAL_ROOT to the client."""
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = f'{settings.RESULTS_X_ACCEL_FILE_LOCATION}{relative_path}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def cached_file_response(cached, filename, content_type='text/csv'):
+    """Serve a file from the local result cache.
+
+    Raises FileNotFoundError if the entry was evicted since its lookup.
+    """
+    if settings.RESULTS_X_ACCEL_REDIRECT:
+        relative_path = os.path.relpath(cached.path, settings.RESULTS_LOCAL_ROOT)
+        return x_accel_file_response(relative_path, filename, content_type)
+
+    size = cached.size
+    response = StreamingHttpResponse(cached.iter_chunks(), content_type=content_type)
+    response['Content-Length'] = size
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return set_validators(response, result_etag(cached.etag))
+
+
+def result_etag(s3_etag):
+    """ETag of a result object, the same from S3 and from the result cache."""
+    return make_etag(re.sub(r'[^A-Za-z0-9]', '', s3_etag))
+
+
+def result_validators(file_key, cacheable=False):
+    """Return the (etag, last_modified) of a result object without its body.
+
+    A cached copy answers without calling S3 (but has no Last-Modified).
+    Raises botocore ClientError if the object cannot be retrieved.
+    """
+    cache = get_result_cache() if cacheable else None
+    cached = cache.get(settings.AWS_STORAGE_BUCKET_NAME, file_key) if cache is not None else None
+    if cached is not None:
+        return result_etag(cached.etag), None
+    obj = get_s3_client().head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file_key)
+    return result_etag(obj['ETag']), timestamp(obj['LastModified'])
+
+
+def result_download_response(file_key, cacheable=False, content_type='text/csv'):
+    """Return the download response for an object in the results bucket.
+
+    Only immutable objects (sanitized outputs) should be marked cacheable;
+    released outputs are rewritten on every release.
+    """
+    cache = get_result_cache() if cacheable else None
+    if cache is not None:
+        cached = cache.fetch(settings.AWS_STORAGE_BUCKET_NAME, file_key)
+        try:
+            return cached_file_response(cached, os.path.basename(file_key), content_type)
+        except FileNotFoundError:
+            pass  # evicted by another process; served from S3 instead
+    if settings.RESULTS_X_ACCEL_REDIRECT:
+        return x_accel_s3_response(file_key, content_type)
+    return stream_s3_object(file_key, content_type)
+
+
+def open_result_object(file_key, cacheable=False):
+    """Return a binary file object with an object of the results bucket.
+
+    Cacheable objects are read through the local result cache when it is
+    enabled, otherwise this is the S3 streaming body. Callers must close it.
+    Raises botocore ClientError if the object cannot be retrieved.
+    """
+    cache = get_result_cache() if cacheable else None
+    if cache is not None:
+        return cache.open(settings.AWS_STORAGE_BUCKET_NAME, file_key)
+
+    obj = get_s3_client().get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file_key)
+    return obj['Body']
+
+
+def open_sanitized_output(job_id, run_id):
+    """Return a binary file object with the sanitized output of a run."""
+    return open_result_object(sanitized_output_key(job_id, run_id), cacheable=True)
@@ -9,21 +9,39 @@ from rest_framework.permissions import IsAuthenticated
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 
 
-import boto3
 from botocore.exceptions import ClientError
 
 from django.conf import settings
 from django.db.models import Sum, Q
 
-from knox.auth import TokenAuthentication
+from users.authentication import CachedTokenAuthentication, sign_stream_token
 
 from app.schema import KnoxTokenScheme # needed, do not delete
 
-from core.models import Job, Run, Budget
+from core.models import (
+    Job,
+    Run,
+    Budget,
+    BudgetCharge,
+    BudgetReservation,
+    InsufficientBudget,
+    AnalysisSummary,
+    OutboxMessage,
+    ReleaseTask,
+)
 from job import serializers
+from core.conditional import is_conditional, make_etag, not_modified, set_validators, timestamp, version
 from job.util import *
+from job import columnar
+from job.renderers import RESULT_RENDERER_CLASSES
+from job.bulk import update_run_statuses
+from job.feed import read_feed
+from job.results import summarize_analyses_parquet
+from job.tasks import release_run, submit_release_task
+from .pagination import CreatedAtCursorPagination
 from .permissions import IsAdminUser, IsResearcher, IsEngineUser
 
 import json
@@ -38,15 +56,16 @@ class JobViewSet(viewsets.ModelViewSet):
     """View for manage job APIs."""
     serializer_class = serializers.JobDetailSerializer
     queryset = Job.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         """Retrieve jobs for authenticated user."""
-        if self.request.user.groups.filter(name='engine').exists():
+        if self.request.user.in_group('engine'):
             return self.queryset
         else:
-            return self.queryset.filter(user=self.request.user).order_by('-created_at')
+            return self.queryset.filter(user=self.request.user).order_by('-created_at', '-id')
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
@@ -64,23 +83,74 @@ class JobViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
     def create(self, request, *args, **kwargs):
-        # Check if the condition is true
-        budget = Budget.objects.filter(user=request.user)[0]
-        if not budget.review >= 1:
+        # The first run is charged when the job is saved; the job is not
+        # created if that charge fails
+        try:
+            return super().create(request, *args, **kwargs)
+        except InsufficientBudget:
             return Response({'error': 'Insufficient budget'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Condition is true, proceed with object creation
-        return super().create(request, *args, **kwargs)
-
     def list(self, request):
-        queryset = self.get_queryset()
-        serializer = serializers.JobSerializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = serializers.JobSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def retrieve(self, request, pk=None):
         item = get_object_or_404(self.queryset, pk=pk)
+
+        # Polling clients get a 304 while the job is unchanged
+        etag = make_etag(item.id.hex, version(item.created_at))
+        last_modified = timestamp(item.created_at)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
         serializer = serializers.JobDetailSerializer(item)
-        return Response(serializer.data)
+        return set_validators(Response(serializer.data), etag, last_modified)
+
+    @action(methods=['POST'], detail=True, url_path='events-token')
+    def events_token(self, request, pk=None):
+        """A short-lived token for opening the job's event stream from a browser.
+
+        Pass it as ``?token=`` to /api/jobs/<id>/events/; it is accepted for
+        STREAM_TOKEN_MAX_AGE seconds.
+        """
+        job = get_object_or_404(self.get_queryset(), pk=pk)
+        return Response({
+            'token': sign_stream_token(request.user, job.id.hex),
+            'expires_in': settings.STREAM_TOKEN_MAX_AGE,
+        })
+
+    @action(methods=['GET'], detail=False, url_path='feed', permission_classes=[IsAuthenticated, IsEngineUser])
+    def feed(self, request):
+        """Jobs and runs changed since ?after=<cursor>, for the engine.
+
+        Start from 0 and pass back the returned cursor; ``more`` is true
+        while there is a next batch to read right away.
+        """
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = int(request.query_params.get('limit', settings.FEED_BATCH_SIZE))
+        except ValueError:
+            return Response({'error': 'after and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if after < 0 or limit < 1:
+            return Response({'error': 'after must be at least 0 and limit at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(read_feed(after, min(limit, settings.FEED_MAX_BATCH_SIZE)))
+
+    @action(methods=['POST'], detail=False, url_path='run-status', permission_classes=[IsAuthenticated, IsEngineUser])
+    def run_status(self, request):
+        """Update the status of many runs at once, for the engine.
+
+        Takes {"updates": [{"job_id", "run_id", "status"}, ...]} and returns
+        one result per update, in order.
+        """
+        serializer = serializers.BulkRunStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = update_run_statuses(serializer.validated_data['updates'])
+        return Response({'results': results})
 
     @action(methods=['POST'], detail=True, url_path='upload-script')
     def upload_script(self, request, pk=None):
@@ -107,17 +177,19 @@ class JobViewSet(viewsets.ModelViewSet):
 class RunViewSet(viewsets.ModelViewSet):
     """View for manage run APIs."""
     serializer_class = serializers.RunDetailSerializer
-    queryset = Run.objects.all()
-    authentication_classes = [TokenAuthentication]
+    # Run serializers nest the job
+    queryset = Run.objects.select_related('job')
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
     lookup_field = ('run_id')
 
     def get_queryset(self):
         """Retrieve jobs for authenticated user."""
-        if self.request.user.groups.filter(name='engine').exists():
-            return self.queryset.filter(job=self.kwargs['jobs_pk']).order_by('-created_at')
+        if self.request.user.in_group('engine'):
+            return self.queryset.filter(job=self.kwargs['jobs_pk']).order_by('-created_at', '-id')
         else:
-            return Run.objects.filter(job=self.kwargs['jobs_pk'], job__user=self.request.user).order_by('-id')
+            return self.queryset.filter(job=self.kwargs['jobs_pk'], job__user=self.request.user).order_by('-created_at', '-id')
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
@@ -135,46 +207,83 @@ class RunViewSet(viewsets.ModelViewSet):
         # send signal to update_review_budget
 
         serializer.save()
+
+        # A failed run gives its budget holds back
+        if 'status' in serializer.validated_data:
+            BudgetReservation.resolve_for_run(instance)
         return Response(serializer.data)
 
     def retrieve(self, request, jobs_pk=None, run_id=None)   :
-        job = get_object_or_404(Job, id=jobs_pk)
-        item = get_object_or_404(self.queryset, job=job, run_id=run_id)
+        item = get_object_or_404(self.queryset, job=jobs_pk, run_id=run_id)
+
+        # The run is serialized with its job, so both versions count
+        etag = make_etag(item.job_id.hex, item.run_id, version(item.created_at), version(item.job.created_at))
+        last_modified = timestamp(max(item.created_at, item.job.created_at))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
         serializer = serializers.RunDetailSerializer(item)
-        return Response(serializer.data) 
+        return set_validators(Response(serializer.data), etag, last_modified)
     
-    @action(methods=['GET'], detail=True, url_path='get-csv-results')
+    def _analyses_for(self, run):
+        """Return the analysis summaries of a run, computing them on first use."""
+        # Summaries are computed once per run and then served from the database
+        analyses = AnalysisSummary.objects.filter(run=run)
+        if not analyses:
+            file_key = sanitized_output_key(run.job_id, run.run_id)
+
+            # Compute cost (epsilon sum) by analysis_id (and keep track of analysis_name)
+            # from the columnar sidecar of the output
+            with columnar.local_sidecar(file_key, cacheable=True) as source:
+                summaries = summarize_analyses_parquet(source)
+            analyses = AnalysisSummary.create_for_run(run, summaries)
+        return analyses
+
+    def _not_modified_result(self, request, file_key, cacheable):
+        """Return a 304 if the client's copy of a CSV output is current.
+
+        Only conditional requests pay for the HEAD request to S3.
+        """
+        if request.query_params.get('format') or not is_conditional(request):
+            return None
+        etag, last_modified = result_validators(file_key, cacheable)
+        return not_modified(request, etag, last_modified)
+
+    def _download_response(self, request, file_key, cacheable):
+        """Return an output as CSV, or as Parquet / Arrow with ?format=."""
+        result_format = request.query_params.get('format')
+        if result_format == 'parquet':
+            return columnar.parquet_download_response(file_key, cacheable)
+        if result_format == 'arrow':
+            return columnar.arrow_stream_response(file_key, cacheable)
+        return result_download_response(file_key, cacheable)
+
+    @action(methods=['GET'], detail=True, url_path='get-csv-results', renderer_classes=RESULT_RENDERER_CLASSES)
     def get_csv_results(self, request, jobs_pk=None, run_id=None):
-        # Set up S3 client
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+        # Only the owner (or the engine) may download results
+        self.get_object()
 
-        # Set up S3 bucket and file details
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        file_key = os.path.join('submissions',jobs_pk,f'sanitized_output_{run_id}.csv')
+        file_key = sanitized_output_key(jobs_pk, run_id)
 
-        print(file_key)
-        # Retrieve the file from S3
+        # Relay the file from S3 (or the local cache) as it is read, or let nginx do it
         try:
-            response = s3.get_object(Bucket=bucket_name, Key=file_key)
-            file_content = response['Body'].read().decode('utf-8')  # Decode the CSV file content
+            response = self._not_modified_result(request, file_key, cacheable=True)
+            if response is not None:
+                return response
+            return self._download_response(request, file_key, cacheable=True)
         except ClientError as e:
             return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
 
-        # Set the response headers to indicate a CSV file download
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_key)}"'
-
-        # Write the CSV file content to the response
-        writer = csv.writer(response)
-        for line in file_content.splitlines():
-            writer.writerow(line.split(','))
-
-        return response
-
 
     @action(methods=['POST'], detail=True, url_path='refine')
     def refine(self, request, jobs_pk=None, run_id=None):
-        """Endpoint that accepts refined epsilon values for statistics"""
+        """Endpoint that accepts refined epsilon values for statistics.
+
+        The refinement creates a new run and queues it for the sanitizer. The
+        response is 202 with ``{"job_id": ..., "run_id": ...}`` naming that
+        run, whose status and results are then polled like any other run's.
+        """
         job = get_object_or_404(Job, id=jobs_pk)
     
         # Validate payload
@@ -186,180 +295,141 @@ class RunViewSet(viewsets.ModelViewSet):
 
         # Compute cost
         cost = compute_cost(refined_statistics)
-        print(f"cost={cost}")
 
-        # Check budget
-        budget = Budget.objects.filter(user=request.user)[0]
-        if budget.review < cost:
+        # Turn away refinements the budget clearly cannot cover without
+        # touching the database; the hold below is the real check
+        budget = Budget.for_request(request)
+        if budget is not None and budget.review < cost:
             return Response({'error': 'Insufficient budget'}, status=status.HTTP_403_FORBIDDEN)
-        print(f"review_budget = {budget.review}")
-        
-        # Create new run
-        run = Run.objects.create(job=job)
 
-        # Trigger sanitizer
-        response = trigger_sanitizer(run, refined_statistics)
-        print(response)
-        # Charge user
-        if response.status_code == status.HTTP_200_OK:
-            Budget.objects.filter(user=request.user)[0].charge_review_budget(cost)
+        # Create new run, hold its cost and queue the sanitizer in one
+        # transaction; the outbox dispatcher invokes the lambda after commit.
+        # The hold is settled when the engine reports the run completed and
+        # released if it fails (see BudgetReservation.resolve_for_runs), or
+        # settled when it expires if neither is reported. Everything is
+        # rolled back if it is over budget.
+        try:
+            with transaction.atomic():
+                run = Run.objects.create(job=job)
+                BudgetReservation.hold(request.user, Budget.REVIEW, cost, run=run, reason=BudgetCharge.REFINE)
+                OutboxMessage.enqueue(
+                    OutboxMessage.SANITIZER,
+                    sanitizer_event(run, refined_statistics),
+                    run=run,
+                )
+        except InsufficientBudget:
+            return Response({'error': 'Insufficient budget'}, status=status.HTTP_403_FORBIDDEN)
 
-        return response
+        return Response({'job_id': str(job.id), 'run_id': run.run_id}, status=status.HTTP_202_ACCEPTED)
     
 
     @action(methods=['POST'], detail=True, url_path='release')
     def release(self, request, jobs_pk=None, run_id=None):
-        """Endpoint that releases results."""
-        # TODO: Validate payload
-        released_ids = request.data['analysis_ids']
-        print(released_ids)
-
-        # Set up S3 client
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-
-        # Set up S3 bucket and file details
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        file_key = os.path.join('submissions',jobs_pk,f'sanitized_output_{run_id}.csv')
-        print(file_key)
-        
-        # Retrieve the file from S3
+        """Endpoint that releases results.
+
+        With ?async=true the release is queued and the response is 202 with
+        a release task to poll instead of waiting for the upload.
+        """
+        if request.query_params.get('async', '').lower() in ('1', 'true'):
+            return self._release_async(request, jobs_pk, run_id)
+
+        # Only the owner (or the engine) may release results
+        run = self.get_object()
+        serializer = serializers.ReleaseRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
         try:
-            response = s3.get_object(Bucket=bucket_name, Key=file_key)
-            file_content = response['Body'].read().decode('utf-8')  # Decode the CSV file content
+            release_run(run, request.user, serializer.validated_data['analysis_ids'])
+        except InsufficientBudget:
+            return Response({'error': 'Insufficient budget'}, status=status.HTTP_403_FORBIDDEN)
         except ClientError as e:
-            return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
+            return HttpResponse(f"Error writing file: {str(e)}", status=500)
 
         # Set the response headers to indicate a CSV file download
         response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_key)}"'
-
-        # Compute cost to release and generate CSV content 
-        output_buffer = io.StringIO()
-        writer = csv.writer(output_buffer)
-        line_num = 1
-        cost = 0 
-        for csv_line in file_content.splitlines():
-            # Header
-            if line_num == 1:
-                col_list = csv_line.split(',')
-                analysis_id_index = col_list.index("analysis_id")
-                epsilon_index = col_list.index("epsilon")
-                writer.writerow(csv_line.split(','))
-            else:
-                value_list = csv_line.split(',')
-                analysis_id = int(value_list[analysis_id_index])
-                if analysis_id in released_ids: 
-                    writer.writerow(csv_line.split(','))
-                    epsilon = float(value_list[epsilon_index])
-                    cost = cost + epsilon
-            line_num = line_num + 1
-
-        # Enough release budget?
-        budget = get_object_or_404(Budget, user=request.user)
-        print(cost)
-        if budget.release < cost:
-            return Response({'error': 'Insufficient budget'}, status=status.HTTP_403_FORBIDDEN)
+        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(sanitized_output_key(jobs_pk, run_id))}"'
+        return response
 
-        # Write released CSV to S3  
-        output_file_key = os.path.join('submissions',jobs_pk,f'released_output_{run_id}.csv')
-        upload_csv_to_s3(output_buffer, output_file_key)
-        
-        # Charge user
-        Budget.objects.filter(user=request.user)[0].charge_release_budget(cost)
+    def _release_async(self, request, jobs_pk, run_id):
+        run = self.get_object()
+        serializer = serializers.ReleaseRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        released_ids = serializer.validated_data['analysis_ids']
 
-        # Update run status to "released"
-        run = get_object_or_404(self.queryset, job=jobs_pk, run_id=run_id)
-        run.status = {'ok': True, 'info': 'released', 'errormsg': None}
-        run.save() 
+        # The cost is known up front from the analyses of the run
+        try:
+            analyses = self._analyses_for(run)
+        except ClientError as e:
+            return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
+        costs = {analysis.analysis_id: analysis.epsilon_sum for analysis in analyses}
+        unknown = [i for i in released_ids if str(i) not in costs]
+        if unknown:
+            return Response({'error': f'Unknown analysis ids: {unknown}'}, status=status.HTTP_400_BAD_REQUEST)
+        # Each analysis is released once, however often it is named
+        cost = sum(costs[str(i)] for i in set(released_ids))
+        budget = Budget.for_request(request)
+        if budget is not None and budget.release < cost:
+            return Response({'error': 'Insufficient budget'}, status=status.HTTP_403_FORBIDDEN)
 
-        # Update job status to "released"
-        job = get_object_or_404(Job, id=jobs_pk)
-        job.status = {'ok': True, 'info': 'released', 'errormsg': None}
-        job.save() 
-              
-        return response 
-    
+        # Hold the cost against the budget until the task is done
+        try:
+            with transaction.atomic():
+                reservation = BudgetReservation.hold(
+                    request.user, Budget.RELEASE, cost, run=run, reason=BudgetCharge.RELEASE
+                )
+                task = ReleaseTask.objects.create(
+                    run=run,
+                    user=request.user,
+                    analysis_ids=released_ids,
+                    reserved_cost=cost,
+                    reservation=reservation,
+                )
+                transaction.on_commit(lambda: submit_release_task(task.id))
+        except InsufficientBudget:
+            return Response({'error': 'Insufficient budget'}, status=status.HTTP_403_FORBIDDEN)
+
+        data = serializers.ReleaseTaskSerializer(task, context={'request': request}).data
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers={'Location': data['url']})
 
-    @action(methods=['GET'], detail=True, url_path='get-released-csv-results')
+    @action(methods=['GET'], detail=True, url_path='get-released-csv-results', renderer_classes=RESULT_RENDERER_CLASSES)
     def get_released_csv_results(self, request, jobs_pk=None, run_id=None):  
         """Endpoint that returns results that have already been released."""
-        # Set up S3 client
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+        # Only the owner (or the engine) may download results
+        self.get_object()
 
-        # Set up S3 bucket and file details
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        file_key = os.path.join('submissions',jobs_pk,f'released_output_{run_id}.csv')
-        print(file_key)
+        file_key = released_output_key(jobs_pk, run_id)
 
-        # Retrieve the file from S3
+        # Relay the file from S3 as it is read, or let nginx do it
         try:
-            response = s3.get_object(Bucket=bucket_name, Key=file_key)
-            file_content = response['Body'].read().decode('utf-8')  # Decode the CSV file content
+            response = self._not_modified_result(request, file_key, cacheable=False)
+            if response is not None:
+                return response
+            return self._download_response(request, file_key, cacheable=False)
         except ClientError as e:
             return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
-
-        # Set the response headers to indicate a CSV file download
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_key)}"'
-
-        # Write the CSV file content to the response
-        writer = csv.writer(response)
-        for line in file_content.splitlines():
-            writer.writerow(line.split(','))
-        return response
     
 
     @action(methods=['GET'], detail=True, url_path='get-analyses')
     def get_analyses(self, request, jobs_pk=None, run_id=None):  
         """Endpoint that returns all analyses for a given run and their total cost."""
-        # Set up S3 client
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-
-        # Set up S3 bucket and file details
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        file_key = os.path.join('submissions',jobs_pk,f'sanitized_output_{run_id}.csv')
-        print(file_key)
+        run = self.get_object()
 
-        # Retrieve the file from S3
         try:
-            response = s3.get_object(Bucket=bucket_name, Key=file_key)
-            file_content = response['Body'].read().decode('utf-8')  # Decode the CSV file content
+            analyses = self._analyses_for(run)
         except ClientError as e:
             return HttpResponse(f"Error retrieving file: {str(e)}", status=500)
-        
-        # Compute cost (epsilon sum) by analysis_id (and keep track of analysis_name)
-        analyses_dict = {}
-        line_num = 1
-
-        for csv_line in file_content.splitlines():
-            if line_num == 1: 
-                col_list = csv_line.split(',')
-                analysis_id_index = col_list.index("analysis_id")
-                analysis_name_index = col_list.index("analysis_name")
-                epsilon_index = col_list.index("epsilon")
-            else: 
-                value_list = csv_line.split(',')
-                analysis_id = value_list[analysis_id_index]
-                analysis_name = value_list[analysis_name_index]
-                epsilon = float(value_list[epsilon_index])
-
-                if analysis_id not in analyses_dict: 
-                    analyses_dict[analysis_id] = {
-                        "epsilon": epsilon, 
-                        "analysis_name": analysis_name
-                    }
-                else: 
-                    analyses_dict[analysis_id]['epsilon'] += epsilon 
-            line_num = line_num + 1
-
-        # Format as list of dictionaries 
-        analyses_list = [
-            {
-                "analysis_id": key, 
-                "analysis_name": value['analysis_name'],
-                "epsilon_sum": value['epsilon'], 
-            } 
-            for key, value in analyses_dict.items()
-        ]
-        
-        return Response(analyses_list, status=status.HTTP_200_OK)
+
+        serializer = serializers.AnalysisSummarySerializer(analyses, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ReleaseTaskViewSet(viewsets.ReadOnlyModelViewSet):
+    """View for polling background releases."""
+    serializer_class = serializers.ReleaseTaskSerializer
+    queryset = ReleaseTask.objects.all()
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """Retrieve release tasks for authenticated user."""
+        return self.queryset.filter(user=self.request.user).select_related('run')
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class UsersConfig(AppConfig):
+    name = 'users'
+
+    def ready(self):
+        # Connect the token cache invalidation receivers
+        from users import authentication  # noqa: F401
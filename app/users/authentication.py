@@ -0,0 +1,190 @@
+"""
+Knox token authentication with a cache of verified tokens.
+
+For every request knox looks the token up by its prefix, compares SHA512
+digests and loads the user. CachedTokenAuthentication remembers the tokens
+it has verified in a bounded per-process LRU, for AUTH_TOKEN_CACHE_TTL
+seconds and never past the token's expiry, so repeated requests with the
+same token cost no queries.
+
+Deleting a token (logout, logoutall, knox's cleanup of expired tokens) and
+saving or deleting its user evict it. Other processes learn about it
+through markers in the default cache, which they check on every hit. With a
+per-process cache backend (the LocMemCache default) they never would, so
+the cache is only used when the default cache is shared.
+
+Browsers cannot set headers on an EventSource, so the job event stream also
+accepts a signed query token: short-lived, bound to one user and one job,
+and issued by an endpoint that takes the usual knox token.
+"""
+import binascii
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import knox_settings
+
+
+# Backends whose entries other processes cannot see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared():
+    """Whether revocation markers in the default cache reach other processes."""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+def token_marker_key(digest):
+    return f'auth_token_revoked:{digest}'
+
+
+def user_marker_key(user_id):
+    return f'auth_user_changed:{user_id}'
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of token digests to the user and token they verified as."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest):
+        """Return (user, auth_token, cached_at) for a digest, or None."""
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None and entry[3] <= time.monotonic():
+                del self.entries[digest]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return entry[:3]
+
+    def set(self, digest, user, auth_token, ttl):
+        """Remember a verified token for ttl seconds, or until it expires."""
+        if auth_token.expiry is not None:
+            ttl = min(ttl, (auth_token.expiry - timezone.now()).total_seconds())
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[digest] = (user, auth_token, time.time(), time.monotonic() + ttl)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict(self, digest):
+        with self.lock:
+            self.entries.pop(digest, None)
+
+    def evict_user(self, user_id):
+        with self.lock:
+            for digest in [d for d, entry in self.entries.items() if entry[0].pk == user_id]:
+                del self.entries[digest]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+token_cache = VerifiedTokenCache(settings.AUTH_TOKEN_CACHE_SIZE)
+
+
+def _fresh_copy(instance):
+    """Copy a cached model instance so requests never share (or memoize on) it."""
+    instance = copy.copy(instance)
+    instance.__dict__.pop('_group_names', None)
+    return instance
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """knox TokenAuthentication that skips the database for known tokens."""
+
+    def authenticate_credentials(self, token):
+        # Renewing tokens on use needs the database every time, and without a
+        # shared cache a token revoked in another process would stay valid
+        if not token_cache.max_size or knox_settings.AUTO_REFRESH or not cache_is_shared():
+            return super().authenticate_credentials(token)
+        try:
+            digest = hash_token(token.decode('utf-8'))
+        except (TypeError, ValueError, binascii.Error):
+            # Let knox report the malformed token
+            return super().authenticate_credentials(token)
+
+        cached = token_cache.get(digest)
+        if cached is not None:
+            user, auth_token, cached_at = cached
+            markers = cache.get_many([token_marker_key(digest), user_marker_key(user.pk)])
+            if token_marker_key(digest) not in markers and markers.get(user_marker_key(user.pk), 0) < cached_at:
+                auth_token = _fresh_copy(auth_token)
+                auth_token.user = _fresh_copy(user)
+                return auth_token.user, auth_token
+            token_cache.evict(digest)
+
+        user, auth_token = super().authenticate_credentials(token)
+        token_cache.set(digest, _fresh_copy(user), _fresh_copy(auth_token), settings.AUTH_TOKEN_CACHE_TTL)
+        return user, auth_token
+
+
+STREAM_TOKEN_SALT = 'users.authentication.stream'
+
+
+def sign_stream_token(user, scope):
+    """Return a token that authenticates user for scope (e.g. a job id)."""
+    return signing.TimestampSigner(salt=STREAM_TOKEN_SALT).sign_object({'user': user.pk, 'scope': scope})
+
+
+def verify_stream_token(token, scope):
+    """Return the active user of a token signed for scope, or None.
+
+    Tokens are accepted for STREAM_TOKEN_MAX_AGE seconds after signing.
+    """
+    try:
+        data = signing.TimestampSigner(salt=STREAM_TOKEN_SALT).unsign_object(
+            token, max_age=settings.STREAM_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+    if not isinstance(data, dict) or data.get('scope') != scope:
+        return None
+    return get_user_model().objects.filter(pk=data.get('user'), is_active=True).first()
+
+
+@receiver(post_delete, sender=AuthToken)
+def forget_deleted_token(sender, instance, **kwargs):
+    """Stop accepting a token once it is deleted (logout, logoutall, expiry)."""
+    token_cache.evict(instance.digest)
+    cache.set(token_marker_key(instance.digest), True, settings.AUTH_TOKEN_CACHE_TTL)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def forget_changed_user(sender, instance, **kwargs):
+    """Re-verify the tokens of a user that changed, e.g. was deactivated."""
+    token_cache.evict_user(instance.pk)
+    cache.set(user_marker_key(instance.pk), time.time(), settings.AUTH_TOKEN_CACHE_TTL)
@@ -0,0 +1,131 @@
+"""
+Tests for the cached knox token authentication.
+"""
+import os
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from knox.models import AuthToken
+from rest_framework import exceptions, status
+from rest_framework.test import APIClient, APIRequestFactory
+
+from users.authentication import CachedTokenAuthentication, VerifiedTokenCache, token_cache
+
+
+# A cache every process on the host sees
+SHARED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'auth-token-tests'),
+    }
+}
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class CachedTokenAuthenticationTests(TestCase):
+    """Test verified tokens are served from the token cache."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.auth_token, self.token = AuthToken.objects.create(self.user)
+
+    def authenticate(self, token=None):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token or self.token}')
+        return CachedTokenAuthentication().authenticate(request)
+
+    def test_repeated_requests_skip_database(self):
+        """Test a verified token is accepted again without queries."""
+        user, auth_token = self.authenticate()
+
+        with self.assertNumQueries(0):
+            user2, auth_token2 = self.authenticate()
+
+        self.assertEqual((user2.pk, auth_token2.pk), (self.user.pk, auth_token.pk))
+        self.assertIsNot(user2, user)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_not_used(self):
+        """Test tokens are verified every time when revocations cannot reach other processes."""
+        self.authenticate()
+        user, auth_token = self.authenticate()
+
+        self.assertEqual(auth_token.pk, self.auth_token.pk)
+        self.assertEqual(token_cache.stats(), {'size': 0, 'hits': 0, 'misses': 0})
+
+    def test_invalid_token_rejected(self):
+        """Test unknown and malformed tokens are still rejected."""
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate('0' * len(self.token))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate('not-hex')
+
+    def test_deleted_token_rejected(self):
+        """Test a deleted token is not served from the cache."""
+        self.authenticate()
+
+        self.auth_token.delete()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_logout_invalidates_token(self):
+        """Test logging out stops the token from authenticating."""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(client.get(reverse('budget:budget-list')).status_code, status.HTTP_200_OK)
+
+        res = client.post(reverse('users:knox_logout'))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(client.get(reverse('budget:budget-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_user_rejected(self):
+        """Test deactivating a user evicts their tokens."""
+        self.authenticate()
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+
+class VerifiedTokenCacheTests(TestCase):
+    """Test the bounds of the verified token cache."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+
+    def test_ttl_capped_by_token_expiry(self):
+        """Test tokens are not cached past their expiry."""
+        tokens = VerifiedTokenCache(10)
+        expiring, _ = AuthToken.objects.create(self.user, expiry=timedelta(seconds=-1))
+        lasting, _ = AuthToken.objects.create(self.user, expiry=timedelta(hours=1))
+
+        tokens.set('expiring', self.user, expiring, ttl=60)
+        tokens.set('lasting', self.user, lasting, ttl=60)
+
+        self.assertIsNone(tokens.get('expiring'))
+        self.assertIsNotNone(tokens.get('lasting'))
+
+    def test_least_recently_used_evicted(self):
+        """Test the cache keeps at most max_size tokens."""
+        tokens = VerifiedTokenCache(2)
+        auth_token, _ = AuthToken.objects.create(self.user)
+
+        tokens.set('a', self.user, auth_token, ttl=60)
+        tokens.set('b', self.user, auth_token, ttl=60)
+        tokens.get('a')
+        tokens.set('c', self.user, auth_token, ttl=60)
+
+        self.assertIsNone(tokens.get('b'))
+        self.assertIsNotNone(tokens.get('a'))
+        self.assertIsNotNone(tokens.get('c'))
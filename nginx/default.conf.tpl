@@ -38,6 +38,62 @@ server {
            alias /vol/static;
     }
 
+    # Result downloads handed over by Django with X-Accel-Redirect. Django
+    # checks auth and ownership and passes a presigned S3 URL (or a path in
+    # the shared results volume); clients cannot request these directly.
+    location ~ ^/protected-s3/(?<s3_host>[^/]+)/(?<s3_path>.*)$ {
+        internal;
+        resolver                ${DNS_RESOLVER} valid=300s ipv6=off;
+        proxy_pass              https://$s3_host/$s3_path$is_args$args;
+        proxy_set_header        Host $s3_host;
+        proxy_set_header        Authorization "";
+        proxy_set_header        Cookie "";
+        proxy_hide_header       x-amz-id-2;
+        proxy_hide_header       x-amz-request-id;
+        proxy_hide_header       Set-Cookie;
+        proxy_ssl_server_name   on;
+        proxy_http_version      1.1;
+        proxy_buffering         off;
+    }
+
+    location /protected-results/ {
+        internal;
+        alias /vol/results/;
+    }
+
+    # S3-bound run actions are served by the ASGI app (job/async_views.py)
+    location ~ ^/api/job/jobs/[^/]+/runs/[^/]+/(get-csv-results|get-released-csv-results|get-analyses|release)/$ {
+        proxy_pass           http://${ASGI_HOST}:${ASGI_PORT};
+        include              /etc/nginx/mime.types;
+        client_max_body_size 10M;
+        proxy_http_version   1.1;
+        proxy_buffering      off;
+        proxy_read_timeout   300s;
+        proxy_redirect       off;
+        proxy_set_header     Host $host;
+        proxy_set_header     X-Real-IP $remote_addr;
+        proxy_set_header     X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header     X-Forwarded-Ssl on;
+        proxy_set_header     X-Forwarded-Proto https;
+    }
+
+    # Status event streams (job/events.py) are long-lived; the app sends a
+    # keepalive comment every EVENTS_KEEPALIVE seconds, within the read timeout
+    location ~ ^/api/job/jobs/[^/]+/events/$ {
+        proxy_pass           http://${ASGI_HOST}:${ASGI_PORT};
+        proxy_http_version   1.1;
+        proxy_buffering      off;
+        proxy_cache          off;
+        proxy_read_timeout   1h;
+        proxy_redirect       off;
+        proxy_set_header     Connection "";
+        proxy_set_header     Host $host;
+        proxy_set_header     X-Real-IP $remote_addr;
+        proxy_set_header     X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header     X-Forwarded-Ssl on;
+        proxy_set_header     X-Forwarded-Proto https;
+    }
+
     location /api {
         uwsgi_pass           ${APP_HOST}:${APP_PORT};
         include              /etc/nginx/uwsgi_params;
@@ -2,5 +2,5 @@
 
 set -e
 
-envsubst '$APP_HOST,$APP_PORT' < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
+envsubst '$APP_HOST,$APP_PORT,$ASGI_HOST,$ASGI_PORT,$DNS_RESOLVER' < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
 nginx -g 'daemon off;'
\ No newline at end of file
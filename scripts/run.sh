@@ -13,4 +13,10 @@ python manage.py migrate
 # python manage.py createsuperuser --noinput --username $DJANGO_SUPERUSER_USERNAME --email $DJANGO_SUPERUSER_EMAIL --password $DJANGO_SUPERUSER_PASSWORD
 
 
+# Metrics of all uWSGI workers are aggregated from this directory
+# (see app/core/metrics.py); samples of a previous run must not survive
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
\ No newline at end of file